@@ -80,8 +80,8 @@ if __name__ == '__main__':
 # Install dependencies
 pip3.9 install --user -r requirements.txt
 
-# Build search index
-python3.9 src/build_index.py
+# Build search index (compact: int8 index and float16 embeddings, about 1/3 of the float32 size)
+python3.9 src/build_index.py --index-type sq8 --embedding-dtype float16
 
 # Start Streamlit (for console testing)
 # streamlit run src/app.py --server.port 8501 --server.address 0.0.0.0
@@ -106,7 +106,7 @@ python3.9 src/build_index.py
 3. Run these commands:
    cd csv_search_engine
    pip3.9 install --user -r requirements.txt
-   python3.9 src/build_index.py
+   python3.9 src/build_index.py --index-type sq8 --embedding-dtype float16
 
 ## Step 3: Set Up Web App
 1. Go to 'Web' tab
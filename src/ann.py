@@ -0,0 +1,368 @@
+import numpy as np
+import faiss
+import time
+
+INDEX_TYPES = ['flat', 'ivf', 'ivfpq', 'hnsw', 'sq8', 'sqfp16', 'pca']
+
+# Flat scalar-quantized indexes: 1 or 2 bytes per dimension instead of 4
+SQ_TYPES = {'sq8': faiss.ScalarQuantizer.QT_8bit, 'sqfp16': faiss.ScalarQuantizer.QT_fp16}
+
+# Storage types for workflow_embeddings.npy
+EMBEDDING_DTYPES = ['float32', 'float16']
+
+DEFAULT_PARAMS = {
+    'nlist': None,          # IVF cells, None picks ~4 * sqrt(rows)
+    'nprobe': 16,           # IVF cells visited per query
+    'pq_m': 16,             # PQ sub-quantizers, must divide the dimension
+    'pq_bits': 8,           # bits per PQ code
+    'hnsw_m': 32,           # HNSW neighbours per node
+    'ef_construction': 200,
+    'ef_search': 64,
+    'pca_dim': 64,          # dimension of the 'pca' first-stage index
+    'rescore': 10,          # 'pca': candidates per result re-scored with the full vectors
+}
+
+# Candidate multipliers compared in the two-stage recall/latency report
+RESCORE_SWEEP = (1, 2, 5, 10, 20)
+
+TRAIN_SAMPLE = 100000
+ADD_BATCH_SIZE = 65536
+
+def resolve_params(index_type, num_rows, params=None):
+    """Fill in defaults and derived values for the chosen index type"""
+    resolved = dict(DEFAULT_PARAMS)
+    resolved.update({k: v for k, v in (params or {}).items() if v is not None})
+    if index_type in ('ivf', 'ivfpq') and resolved['nlist'] is None:
+        # Keep ~39 training points per centroid, which is what FAISS asks for
+        resolved['nlist'] = int(max(1, min(4 * np.sqrt(num_rows), num_rows // 39)))
+    return resolved
+
+def create_index(index_type, dimension, params):
+    """Create an empty inner-product index of the requested type"""
+    if index_type == 'flat':
+        return faiss.IndexFlatIP(dimension)
+    if index_type == 'ivf':
+        quantizer = faiss.IndexFlatIP(dimension)
+        return faiss.IndexIVFFlat(quantizer, dimension, params['nlist'], faiss.METRIC_INNER_PRODUCT)
+    if index_type == 'ivfpq':
+        if dimension % params['pq_m']:
+            raise ValueError(f"pq_m={params['pq_m']} must divide the embedding dimension {dimension}")
+        quantizer = faiss.IndexFlatIP(dimension)
+        return faiss.IndexIVFPQ(quantizer, dimension, params['nlist'], params['pq_m'], params['pq_bits'],
+                                faiss.METRIC_INNER_PRODUCT)
+    if index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dimension, params['hnsw_m'], faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = params['ef_construction']
+        return index
+    if index_type in SQ_TYPES:
+        return faiss.IndexScalarQuantizer(dimension, SQ_TYPES[index_type], faiss.METRIC_INNER_PRODUCT)
+    if index_type == 'pca':
+        if not 0 < params['pca_dim'] < dimension:
+            raise ValueError(f"pca_dim={params['pca_dim']} must be between 1 and the embedding dimension {dimension}")
+        # First stage of a two-stage search (see RescoredIndex): a projection to
+        # pca_dim dimensions in front of a flat index over the projected vectors
+        projection = faiss.PCAMatrix(dimension, params['pca_dim'])
+        return faiss.IndexPreTransform(projection, faiss.IndexFlatIP(params['pca_dim']))
+    raise ValueError(f"Unknown index type {index_type!r}, expected one of {INDEX_TYPES}")
+
+def apply_search_params(index, params):
+    """Set query-time parameters (nprobe / efSearch) on a loaded index"""
+    params = params or {}
+    if params.get('nprobe') is not None:
+        try:
+            faiss.extract_index_ivf(index).nprobe = params['nprobe']
+        except RuntimeError:
+            pass  # not an IVF index
+    if params.get('ef_search') is not None and hasattr(index, 'hnsw'):
+        index.hnsw.efSearch = params['ef_search']
+    return index
+
+def sample_rows(num_rows, size, seed=0):
+    """Sorted random row ids, so reads from a memory map stay sequential"""
+    rng = np.random.default_rng(seed)
+    if size >= num_rows:
+        return np.arange(num_rows)
+    return np.sort(rng.choice(num_rows, size=size, replace=False))
+
+def fill_index(index, embeddings, batch_size=ADD_BATCH_SIZE):
+    """Train the index if needed and add vectors batch by batch from a (memory-mapped) array"""
+    num_rows = len(embeddings)
+    if not index.is_trained:
+        train = np.ascontiguousarray(embeddings[sample_rows(num_rows, TRAIN_SAMPLE)], dtype='float32')
+        print(f"Training index on {len(train)} vectors...")
+        if isinstance(index, faiss.IndexPreTransform):
+            # PCAMatrix centres the data; with every vector mirrored the mean is
+            # zero, so the projection keeps inner products instead of distances
+            # to the mean (an uncentred PCA)
+            train = np.vstack([train, -train])
+        index.train(train)
+    for start in range(0, num_rows, batch_size):
+        index.add(np.ascontiguousarray(embeddings[start:start + batch_size], dtype='float32'))
+    return index
+
+def exact_search(embeddings, queries, k, batch_size=ADD_BATCH_SIZE, rows=None):
+    """Brute-force inner-product top-k over a (memory-mapped) array, one block at a time.
+
+    With rows set, only those rows are scanned and their ids are returned.
+    """
+    total = len(embeddings) if rows is None else len(rows)
+    best_scores = np.full((len(queries), k), -np.inf, dtype='float32')
+    best_ids = np.full((len(queries), k), -1, dtype='int64')
+    for start in range(0, total, batch_size):
+        if rows is None:
+            block_ids = np.arange(start, min(start + batch_size, total))
+            block = np.asarray(embeddings[start:start + batch_size], dtype='float32')
+        else:
+            block_ids = np.asarray(rows[start:start + batch_size], dtype='int64')
+            block = np.asarray(embeddings[block_ids], dtype='float32')
+        scores = np.concatenate([best_scores, queries @ block.T], axis=1)
+        ids = np.concatenate([best_ids, np.broadcast_to(block_ids, (len(queries), len(block_ids)))], axis=1)
+        top = np.argpartition(-scores, min(k, scores.shape[1] - 1), axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, top, axis=1)
+        best_ids = np.take_along_axis(ids, top, axis=1)
+    order = np.argsort(-best_scores, axis=1)
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    best_ids = np.take_along_axis(best_ids, order, axis=1)
+    best_ids[best_scores == -np.inf] = -1
+    return best_scores, best_ids
+
+def search_parameters(index, selector):
+    """SearchParameters carrying an IDSelector plus the index's own nprobe / efSearch"""
+    if isinstance(index, RescoredIndex):
+        index = index.first_stage
+    try:
+        ivf = faiss.extract_index_ivf(index)
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    except RuntimeError:
+        pass  # not an IVF index
+    if hasattr(index, 'hnsw'):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
+def filtered_search(index, queries, k, mask, embeddings=None, ids=None):
+    """Top-k restricted to rows where mask is True, filtered inside FAISS via an IDSelectorBitmap.
+
+    ANN indexes can come back short when the filter is very selective (the
+    allowed rows sit in unprobed IVF cells or outside the HNSW beam). If that
+    happens and the stored embeddings are available, the allowed rows are
+    scanned exactly so the number of results never drops below min(k, allowed).
+
+    For an index shard, ids maps its rows to global ids: mask is over the
+    shard's rows, embeddings is the global array and global ids are returned.
+    """
+    packed = np.packbits(mask, bitorder='little')
+    selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(packed))
+    D, I = index.search(queries, k, params=search_parameters(index, selector))
+    if ids is not None:
+        I = to_global_ids(I, ids)
+
+    wanted = min(k, int(mask.sum()))
+    if embeddings is not None and (I >= 0).sum(axis=1).min() < wanted:
+        rows = np.flatnonzero(mask)
+        D, I = exact_search(embeddings, queries, k, rows=rows if ids is None else ids[rows])
+    return D, I
+
+def exact_range_search(embeddings, query, threshold, batch_size=ADD_BATCH_SIZE, rows=None):
+    """Brute-force (scores, ids) of all rows scoring above threshold for one query, one block at a time"""
+    total = len(embeddings) if rows is None else len(rows)
+    found_scores, found_ids = [], []
+    for start in range(0, total, batch_size):
+        if rows is None:
+            block_ids = np.arange(start, min(start + batch_size, total))
+            block = np.asarray(embeddings[start:start + batch_size], dtype='float32')
+        else:
+            block_ids = np.asarray(rows[start:start + batch_size], dtype='int64')
+            block = np.asarray(embeddings[block_ids], dtype='float32')
+        scores = block @ query
+        hits = scores > threshold
+        found_scores.append(scores[hits])
+        found_ids.append(block_ids[hits])
+    if not found_scores:
+        return np.empty(0, dtype='float32'), np.empty(0, dtype='int64')
+    return np.concatenate(found_scores).astype('float32'), np.concatenate(found_ids).astype('int64')
+
+def top_range(D, I, limit):
+    """Range-search hits sorted best first (equal scores by row id), capped at limit"""
+    order = np.lexsort((I, -D))[:limit]
+    return D[order], I[order]
+
+def range_search(index, query, threshold, limit, mask=None, embeddings=None, ids=None):
+    """(scores, ids) of every row scoring above threshold for one query, best first, at most limit.
+
+    Backed by FAISS range_search, with an IDSelectorBitmap when mask is given.
+    Index types without range search fall back to an exact scan of the stored
+    embeddings. As in filtered_search, ids maps an index shard's rows to global ids.
+    """
+    params = None
+    if mask is not None:
+        packed = np.packbits(mask, bitorder='little')
+        selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(packed))
+        params = search_parameters(index, selector)
+    try:
+        _, D, I = index.range_search(query, threshold, params=params)
+    except RuntimeError:
+        if embeddings is None:
+            raise
+        rows = None if mask is None else np.flatnonzero(mask)
+        if ids is not None:
+            rows = ids if rows is None else ids[rows]
+        D, I = exact_range_search(embeddings, query[0], threshold, rows=rows)
+        return top_range(D, I, limit)
+    if ids is not None:
+        I = np.asarray(ids)[I]
+    return top_range(D, I.astype('int64'), limit)
+
+def rescore(embeddings, queries, I, k, ids=None):
+    """Exact top-k among candidate rows: their full vectors are gathered and scored in one batch.
+
+    I holds candidate row ids per query (-1 for padding); ids maps them to rows
+    of embeddings for an index shard. Returns (scores, candidate ids) best first.
+    """
+    valid = I >= 0
+    rows = np.where(valid, I, 0)
+    if ids is not None:
+        rows = np.asarray(ids)[rows]
+    vectors = np.asarray(embeddings[rows.ravel()], dtype='float32').reshape(*I.shape, -1)
+    scores = np.einsum('qcd,qd->qc', vectors, queries)
+    scores[~valid] = -np.inf
+    # Stable, so equal scores keep the first stage's order
+    top = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+    D = np.take_along_axis(scores, top, axis=1).astype('float32')
+    I = np.take_along_axis(I, top, axis=1)
+    I[D == -np.inf] = -1
+    return D, I
+
+class RescoredIndex:
+    """Two-stage search over a reduced-dimension first-stage index.
+
+    The first stage (a projection plus a flat index, see create_index('pca'))
+    returns multiplier * k candidates per query, which are re-scored exactly
+    against the full stored vectors with NumPy. Exposes the parts of the FAISS
+    index API the engine uses (search, ntotal, d); range searches raise, so
+    range_search falls back to its exact scan.
+    """
+
+    def __init__(self, first_stage, embeddings, multiplier=DEFAULT_PARAMS['rescore'], ids=None):
+        self.first_stage = first_stage
+        self.embeddings = embeddings
+        self.multiplier = multiplier
+        self.ids = ids
+        self.ntotal = first_stage.ntotal
+        self.d = first_stage.d
+
+    def search(self, queries, k, params=None):
+        _, I = self.first_stage.search(queries, k * self.multiplier, params=params)
+        return rescore(self.embeddings, queries, I, k, self.ids)
+
+    def range_search(self, queries, threshold, params=None):
+        raise RuntimeError("two-stage indexes have no range search")
+
+def two_stage(index, embeddings, params=None, ids=None):
+    """Wrap a reduced-dimension first-stage index in a RescoredIndex (other indexes are returned as is)"""
+    if not isinstance(index, faiss.IndexPreTransform):
+        return index
+    if embeddings is None:
+        raise FileNotFoundError("two-stage search needs the stored embeddings to re-score candidates")
+    multiplier = (params or {}).get('rescore') or DEFAULT_PARAMS['rescore']
+    return RescoredIndex(index, embeddings, int(multiplier), ids)
+
+def compare_two_stage(index, embeddings, k=10, num_queries=200, multipliers=RESCORE_SWEEP):
+    """recall@k and latency of a two-stage index per candidate multiplier, next to an IndexFlatIP over the full vectors"""
+    flat = fill_index(faiss.IndexFlatIP(embeddings.shape[1]), embeddings)
+    report = {'flat': evaluate_index(flat, embeddings, k, num_queries)}
+    del flat
+    multiplier = index.multiplier
+    for m in multipliers:
+        index.multiplier = m
+        report[m] = evaluate_index(index, embeddings, k, num_queries)
+    index.multiplier = multiplier
+    return report
+
+def print_two_stage_report(report):
+    for key, evaluation in report.items():
+        label = "IndexFlatIP (full dimension)" if key == 'flat' else f"two-stage, {key}x candidates"
+        print(f"  {label:>30}: recall@{evaluation['k']} {evaluation['recall']:.4f}, "
+              f"p50 {evaluation['p50_ms']:.3f} ms, p99 {evaluation['p99_ms']:.3f} ms")
+
+def to_global_ids(I, ids):
+    """Map shard-local result ids to global ids, keeping -1 padding"""
+    return np.where(I >= 0, ids[np.maximum(I, 0)], -1)
+
+def sample_queries(embeddings, num_queries, noise=0.05, seed=0):
+    """Perturbed copies of stored vectors, used as a stand-in query set"""
+    rng = np.random.default_rng(seed)
+    queries = np.asarray(embeddings[sample_rows(len(embeddings), num_queries, seed)], dtype='float32')
+    queries = queries + rng.normal(scale=noise, size=queries.shape).astype('float32')
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+def count_hits(embeddings, query, ids, truth_scores):
+    """Number of returned ids that belong in the exact top-k.
+
+    Compared by exact score rather than by id so that ties between identical
+    vectors (duplicate workflow names) are not counted as misses.
+    """
+    ids = np.sort(ids[ids >= 0])
+    if not len(ids):
+        return 0
+    scores = np.asarray(embeddings[ids], dtype='float32') @ query
+    return min(len(truth_scores), int(np.sum(scores >= truth_scores[-1] - 1e-5)))
+
+def evaluate_index(index, embeddings, k=10, num_queries=200):
+    """Report recall@k against exact search and p50/p99 single-query latency"""
+    k = min(k, len(embeddings))
+    queries = sample_queries(embeddings, num_queries)
+    truth_scores, _ = exact_search(embeddings, queries, k)
+
+    latencies = []
+    hits = 0
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        _, ids = index.search(queries[i:i + 1], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += count_hits(embeddings, queries[i], ids[0], truth_scores[i])
+
+    return {
+        'k': k,
+        'queries': len(queries),
+        'recall': hits / (len(queries) * k),
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+    }
+
+def storage_recall(embeddings, stored, k=10, num_queries=200):
+    """recall@k of exact search over compact stored vectors against the float32 originals"""
+    k = min(k, len(embeddings))
+    queries = sample_queries(embeddings, num_queries)
+    truth_scores, _ = exact_search(embeddings, queries, k)
+    _, ids = exact_search(stored, queries, k)
+    hits = sum(count_hits(embeddings, queries[i], ids[i], truth_scores[i]) for i in range(len(queries)))
+    return hits / (len(queries) * k)
+
+def storage_report(num_rows, dimension, embedding_bytes, embedding_dtype, index_bytes, index_type,
+                   index_recall=None, embedding_recall=None):
+    """Bytes on disk / in memory against float32 embeddings plus a float32 flat index"""
+    float32_bytes = num_rows * dimension * 4
+    return {
+        'embeddings': {'dtype': embedding_dtype, 'bytes': embedding_bytes, 'float32_bytes': float32_bytes},
+        'index': {'type': index_type, 'bytes': index_bytes, 'float32_bytes': float32_bytes},
+        'saved_bytes': 2 * float32_bytes - embedding_bytes - index_bytes,
+        'index_recall': index_recall,
+        'embedding_recall': embedding_recall,
+    }
+
+def print_storage_report(report, k):
+    """Memory saved and recall@k change against float32 storage"""
+    mb = 1024 * 1024
+    embeddings, index = report['embeddings'], report['index']
+    baseline = embeddings['float32_bytes'] + index['float32_bytes']
+    if not baseline:
+        return
+    print(f"Storage: embeddings {embeddings['bytes'] / mb:.1f} MB ({embeddings['dtype']}), "
+          f"index {index['bytes'] / mb:.1f} MB ({index['type']}) vs {baseline / mb:.1f} MB for float32 "
+          f"embeddings + flat index, saved {report['saved_bytes'] / mb:.1f} MB ({report['saved_bytes'] / baseline:.1%})")
+    if report['index_recall'] is not None:
+        print(f"  {index['type']} index recall@{k}: {report['index_recall']:.4f} "
+              f"({report['index_recall'] - 1:+.4f} vs float32 exact search)")
+    if report['embedding_recall'] is not None:
+        print(f"  {embeddings['dtype']} embeddings exact recall@{k}: {report['embedding_recall']:.4f} "
+              f"({report['embedding_recall'] - 1:+.4f} vs float32)")
@@ -2,71 +2,109 @@
 
 import streamlit as st
 import pandas as pd
-import numpy as np
-from sentence_transformers import SentenceTransformer
-import faiss
+from artifacts import current_build
+from search import EXAMPLE_QUERIES, SEARCH_MODES
+from engine import CSVSearchEngine
+from query_cache import CACHE_PATH
+from metrics import REGISTRY, stage
 import os
 
 # Paths
 CSV_PATH = '../data/workflows.csv'
-EMBEDDING_PATH = '../embeddings/workflow_embeddings.npy'
-INDEX_PATH = '../embeddings/faiss_index.index'
+
+# Bytes of workflow_json shown in an opened result; the download has the full payload
+JSON_PREVIEW_BYTES = 20000
 
 @st.cache_resource
 def load_search_engine():
     """Load all necessary data and models (cached for performance)"""
     try:
         # Check if files exist
-        if not os.path.exists(CSV_PATH):
+        _, paths = current_build()
+        if not os.path.exists(CSV_PATH) and not os.path.exists(paths.metadata):
             st.error(f"CSV file not found at {CSV_PATH}")
-            return None, None, None, None
-            
-        if not os.path.exists(EMBEDDING_PATH):
-            st.error(f"Embeddings not found at {EMBEDDING_PATH}")
-            st.error("Please run build_index.py first!")
-            return None, None, None, None
+            return None
             
-        if not os.path.exists(INDEX_PATH):
-            st.error(f"FAISS index not found at {INDEX_PATH}")
+        if not os.path.exists(paths.manifest) and not os.path.exists(paths.index):
+            st.error(f"FAISS index not found at {paths.index}")
             st.error("Please run build_index.py first!")
-            return None, None, None, None
+            return None
         
-        # Load data
-        df = pd.read_csv(CSV_PATH)
-        embeddings = np.load(EMBEDDING_PATH)
-        index = faiss.read_index(INDEX_PATH)
-        model = SentenceTransformer('all-MiniLM-L6-v2')
-        
-        return df, embeddings, index, model
+        # The engine memory-maps the index and metadata snapshot, and warms the
+        # query cache with the example queries shown in the sidebar
+        # Sessions run in separate threads, so concurrent searches from
+        # several users are micro-batched into one encode/search call.
+        # The cached engine swaps in newly published builds by itself
+        return CSVSearchEngine(cache_path=CACHE_PATH, micro_batch=True)
     
     except Exception as e:
         st.error(f"Error loading search engine: {e}")
-        return None, None, None, None
+        return None
 
-def search_workflows(query, df, index, model, k=5):
-    """Search for similar workflows"""
-    # Generate query embedding
-    query_emb = model.encode([query])
-    query_emb = query_emb / np.linalg.norm(query_emb, axis=1, keepdims=True)
-    
-    # Search
-    D, I = index.search(query_emb, k)
-    
-    results = []
-    for i, idx in enumerate(I[0]):
-        score = D[0][i]
-        workflow_name = df.iloc[idx]['workflow_name']
-        workflow_id = df.iloc[idx]['workflow_id']
-        workflow_json = df.iloc[idx]['workflow_json']
-        results.append({
-            'rank': i + 1,
-            'workflow_name': workflow_name,
-            'workflow_id': workflow_id,
-            'workflow_json': workflow_json,
-            'score': score
-        })
-    
-    return results
+def search_workflows(query, engine, k=5, mode=None, filters=None, collapse=True, page=0, threshold=None):
+    """Search for similar workflows; returns one page of k results and whether another page follows.
+
+    With threshold set, the pages hold every workflow whose similarity is above
+    it (semantic search, capped at RANGE_LIMIT) instead of a ranked top list.
+    """
+    # Repeated queries are served from the engine's query/result cache, and
+    # workflow_json is only decompressed when a result is displayed or exported.
+    # Both the ranking and the threshold hits are cached whole, so turning
+    # pages slices them without searching again
+    if threshold is not None:
+        results = engine.find_threshold(query, threshold, filters=filters, collapse=collapse)
+        return results[page * k:(page + 1) * k], len(results) > (page + 1) * k
+    return engine.find_page(query, page, k, mode, filters, collapse)
+
+def change_page(step):
+    st.session_state.page += step
+
+def use_suggestion(name):
+    st.session_state.search_query = name
+
+def format_bytes(size):
+    return f"{size / 1024:.1f} KB" if size < 1024 * 1024 else f"{size / 1024 / 1024:.1f} MB"
+
+def show_summary(engine, result):
+    """Node count, trigger and node types from the feature store; nothing is decompressed"""
+    size = result['workflow_json'].size()
+    if engine.features is None:
+        st.caption(f"Workflow JSON: {format_bytes(size)}")
+        return
+    summary = engine.features.summary(result['row'])
+    st.write(f"**Nodes:** {summary['node_count']} · **Trigger:** {summary['trigger'] or 'none'} · "
+             f"**JSON:** {format_bytes(size)}")
+    if summary['node_types']:
+        st.caption("Node types: " + ", ".join(summary['node_types']))
+
+def show_workflow_json(result):
+    """Highlighted preview of an opened result, capped at JSON_PREVIEW_BYTES, plus a full download"""
+    handle = result['workflow_json']
+    size = handle.size()
+    with stage('json_load'):
+        preview = handle.load(limit=JSON_PREVIEW_BYTES)
+    st.code(preview, language='json')
+    if size > JSON_PREVIEW_BYTES:
+        st.caption(f"Showing the first {format_bytes(JSON_PREVIEW_BYTES)} of {format_bytes(size)}, "
+                   f"download the workflow for the rest")
+    # Streamlit needs the whole file for a download button, so it is only
+    # assembled (chunk by chunk from the blob store) on the rerun after the
+    # user asks for it, and dropped again once it has been downloaded
+    prepared = st.session_state.setdefault('prepared_downloads', set())
+    if result['row'] not in prepared:
+        st.button("📦 Prepare download", key=f"prepare_{result['row']}",
+                  on_click=prepared.add, args=(result['row'],),
+                  help=f"Assemble the full workflow JSON ({format_bytes(size)})")
+        return
+    st.download_button(
+        label="📥 Download workflow JSON",
+        data=b''.join(handle.stream()),
+        file_name=f"workflow_{result['workflow_id']}.json",
+        mime="application/json",
+        key=f"download_{result['row']}",
+        on_click=prepared.discard,
+        args=(result['row'],)
+    )
 
 # Streamlit App
 def main():
@@ -80,30 +118,45 @@ def main():
     st.markdown("Search through your workflow data using semantic similarity")
     
     # Load search engine
-    df, embeddings, index, model = load_search_engine()
+    engine = load_search_engine()
     
-    if df is None:
+    if engine is None:
         st.stop()
     
     # Sidebar with info
     with st.sidebar:
         st.header("📊 Dataset Info")
-        st.write(f"Total workflows: {len(df)}")
-        st.write(f"Embedding dimension: {embeddings.shape[1]}")
+        st.write(f"Total workflows: {len(engine.metadata)}")
+        st.write(f"Embedding dimension: {engine.index.d}")
+        st.caption(f"Build: {engine.build_id or 'unversioned'}")
+        st.caption(f"Storage: {engine.storage_info()}")
+        cache_stats = engine.cache.stats()['results']
+        st.caption(f"Query cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses")
+        batch_stats = engine.batcher.stats()
+        st.caption(f"Micro-batching: {batch_stats['batches']} batches, "
+                   f"mean size {batch_stats['mean_batch_size']:.1f}, queue depth {batch_stats['queue_depth']}")
         
-        st.header("💡 Example Queries")
-        example_queries = [
-            "email automation",
-            "data scraping",
-            "notifications",
-            "file backup",
-            "social media",
-            "payment processing"
-        ]
+        filters = None
+        if engine.features is not None:
+            st.header("🧩 Filters")
+            filters = {
+                'node_types': st.multiselect("Uses node types:", engine.features.vocab_names('node_types')),
+                'integrations': st.multiselect("Uses integrations:", engine.features.vocab_names('integrations')),
+                'trigger': st.selectbox("Trigger:", [''] + engine.features.vocab_names('triggers')),
+                'min_nodes': st.number_input("Minimum nodes:", min_value=0, value=0, step=1) or None,
+            }
         
-        for query in example_queries:
+        st.header("💡 Example Queries")
+        for query in EXAMPLE_QUERIES:
             if st.button(f"'{query}'", key=f"example_{query}"):
                 st.session_state.search_query = query
+        
+        if st.checkbox("🐞 Show debug metrics"):
+            # Includes the render time of previous runs (this run renders after the sidebar)
+            snapshot = REGISTRY.snapshot()
+            if snapshot['histograms']:
+                st.dataframe(pd.DataFrame(snapshot['histograms']).T.round(3), width='stretch')
+            st.json(snapshot['counters'])
     
     # Main search interface
     col1, col2 = st.columns([3, 1])
@@ -114,34 +167,79 @@ def main():
             value=st.session_state.get('search_query', ''),
             placeholder="e.g., email automation, data scraping, notifications..."
         )
+        # Workflow-name completions come from a memory-mapped index in well
+        # under a millisecond, so they are offered on every rerun
+        suggestions = [s for s in engine.suggest(query, 5) if s['workflow_name'] != query] if query else []
+        if suggestions:
+            st.caption("Matching workflow names:")
+            for column, suggestion in zip(st.columns(len(suggestions)), suggestions):
+                column.button(suggestion['workflow_name'], key=f"suggest_{suggestion['workflow_name']}",
+                              on_click=use_suggestion, args=(suggestion['workflow_name'],),
+                              help=f"{suggestion['count']} workflows")
     
     with col2:
-        num_results = st.selectbox("Results to show:", [5, 10, 15], index=0)
+        num_results = st.selectbox("Results per page:", [5, 10, 15, 25, 50], index=0)
+        threshold = None
+        if st.checkbox("Only results above a score"):
+            # Range search over similarity scores, so it always runs in semantic mode
+            threshold = st.slider("Minimum similarity:", 0.0, 1.0, 0.6, 0.05)
+        mode = st.selectbox("Search mode:", SEARCH_MODES, index=SEARCH_MODES.index(engine.mode),
+                            disabled=threshold is not None)
+        if threshold is not None:
+            mode = 'semantic'
+        collapse = st.checkbox("Hide duplicate workflows", value=True, disabled=engine.duplicates is None)
+    
+    # Back to the first page whenever the search itself changes
+    search_key = (query, num_results, threshold, mode, str(filters), collapse)
+    if st.session_state.get('search_key') != search_key:
+        st.session_state.search_key = search_key
+        st.session_state.page = 0
+    page = st.session_state.page
     
     if query:
         with st.spinner('Searching...'):
-            results = search_workflows(query, df, index, model, k=num_results)
+            results, more = search_workflows(query, engine, k=num_results, mode=mode, filters=filters,
+                                             collapse=collapse, page=page, threshold=threshold)
         
-        st.subheader(f"🎯 Top {len(results)} Results for: '{query}'")
+        first = page * num_results + 1
+        above = f" scoring above {threshold:.2f}" if threshold is not None else ""
+        if results:
+            st.subheader(f"🎯 Results {first}-{first + len(results) - 1}{above} for: '{query}'")
+        else:
+            st.subheader(f"🎯 No results{above} for: '{query}'")
+        
+        # Hybrid/keyword scores are rank-based, so show them relative to the best hit
+        top_score = results[0]['score'] if results and mode != 'semantic' else 1.0
         
         # Display results
-        for result in results:
-            with st.expander(f"#{result['rank']} - {result['workflow_name']} (Score: {result['score']:.4f})", expanded=True):
-                st.write("**Workflow ID:**")
-                st.write(result['workflow_id'])
-                
-                st.write("**Workflow JSON:**")
-                st.code(result['workflow_json'], language='json')
-                
-                # Progress bar for similarity score
-                st.write("**Similarity Score:**")
-                score_percentage = max(0, min(100, result['score'] * 100))
-                st.progress(float(score_percentage / 100))
-                st.caption(f"Score: {result['score']:.4f}")
+        with stage('render'):
+            for result in results:
+                with st.expander(f"#{result['rank']} - {result['workflow_name']} (Score: {result['score']:.4f})", expanded=True):
+                    st.write("**Workflow ID:**")
+                    st.write(result['workflow_id'])
+                    if collapse and result.get('duplicates'):
+                        st.caption(f"{result['duplicates']} duplicate workflows hidden")
+                    
+                    # Only the compact summary is sent until the result is opened, so
+                    # the page stays small however large the workflows are
+                    show_summary(engine, result)
+                    if st.toggle("Open workflow JSON", key=f"open_{result['row']}"):
+                        show_workflow_json(result)
+                    
+                    # Progress bar for similarity score
+                    st.write("**Similarity Score:**")
+                    score_percentage = max(0, min(100, result['score'] / top_score * 100))
+                    st.progress(float(score_percentage / 100))
+                    st.caption(f"Score: {result['score']:.4f}")
+        
+        prev_col, page_col, next_col = st.columns([1, 2, 1])
+        prev_col.button("◀ Previous", on_click=change_page, args=(-1,), disabled=page == 0)
+        page_col.caption(f"Page {page + 1}")
+        next_col.button("Next ▶", on_click=change_page, args=(1,), disabled=not more)
         
         # Download results
         if st.button("📥 Download Results as CSV"):
-            results_df = pd.DataFrame(results)
+            results_df = pd.DataFrame([{**r, 'workflow_json': r['workflow_json'].load()} for r in results])
             csv = results_df.to_csv(index=False)
             st.download_button(
                 label="Download CSV",
@@ -155,7 +253,7 @@ def main():
         
         # Show sample data
         st.subheader("📋 Sample Data")
-        st.dataframe(df.head(10), width='stretch')
+        st.dataframe(engine.metadata.head(10), width='stretch')
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,233 @@
+from contextlib import contextmanager
+import numpy as np
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+# Paths
+ARTIFACTS_DIR = '../embeddings'
+BUILDS_DIR = '../embeddings/builds'
+CURRENT_PATH = '../embeddings/CURRENT'
+
+# Published builds kept on disk; older ones are removed when a new build is published
+KEEP_BUILDS = 3
+
+# Written into a build directory while it is being built; holds the building process id
+BUILDING_MARKER = 'BUILDING'
+
+# Where a process cannot be checked for (Windows), unpublished builds older than this are stale
+STALE_BUILD_SECONDS = 24 * 3600
+
+# Build ids made by new_build: a timestamp plus a numeric suffix for builds in the same second
+BUILD_ID = re.compile(r'(\d{8}-\d{6})(?:-(\d+))?')
+
+# Seconds between checks of the CURRENT pointer in a running engine
+RELOAD_INTERVAL = 2.0
+
+class BuildPaths:
+    """Artifact paths inside one build directory.
+
+    Names match the original flat ../embeddings layout, so BuildPaths(ARTIFACTS_DIR)
+    reads builds made before versioned directories existed.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.manifest = os.path.join(root, 'manifest.json')
+        self.embeddings = os.path.join(root, 'workflow_embeddings.npy')
+        self.index = os.path.join(root, 'faiss_index.index')
+        self.shards = os.path.join(root, 'shards')
+        self.row_hashes = os.path.join(root, 'row_hashes.npy')
+        self.metadata = os.path.join(root, 'metadata')
+        self.workflow_json = os.path.join(root, 'workflow_json')
+        self.lexical = os.path.join(root, 'lexical')
+        self.features = os.path.join(root, 'features')
+        self.duplicate_groups = os.path.join(root, 'duplicate_groups.npy')
+        self.typeahead = os.path.join(root, 'typeahead')
+
+def read_current(path=CURRENT_PATH):
+    """Build id the CURRENT pointer names, or None"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def current_build(builds_dir=BUILDS_DIR, current_path=CURRENT_PATH):
+    """(build id, BuildPaths) of the published build; (None, legacy flat layout) before the first one"""
+    build_id = read_current(current_path)
+    if build_id is None:
+        return None, BuildPaths(ARTIFACTS_DIR)
+    return build_id, BuildPaths(os.path.join(builds_dir, build_id))
+
+def new_build(build_id=None, builds_dir=BUILDS_DIR):
+    """Create an empty directory for a new build; nothing reads it until it is published"""
+    build_id = build_id or time.strftime('%Y%m%d-%H%M%S')
+    candidate, n = build_id, 1
+    while os.path.exists(os.path.join(builds_dir, candidate)):
+        n += 1
+        candidate = f"{build_id}-{n}"
+    os.makedirs(os.path.join(builds_dir, candidate))
+    with open(os.path.join(builds_dir, candidate, BUILDING_MARKER), 'w', encoding='utf-8') as f:
+        f.write(str(os.getpid()))
+    return candidate, BuildPaths(os.path.join(builds_dir, candidate))
+
+def meta_count(directory):
+    """Row count stored in an artifact directory's meta.json, or None if it is absent"""
+    path = os.path.join(directory, 'meta.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)['count']
+
+def validate_build(paths):
+    """Check that every artifact of a build has the manifest's row count and dimension.
+
+    Returns the manifest; raises ValueError on the first mismatch.
+    """
+    if not os.path.exists(paths.manifest):
+        raise ValueError(f"no manifest in {paths.root}")
+    with open(paths.manifest, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    count, dimension = manifest.get('count'), manifest.get('dimension')
+
+    def check(name, found_count, found_dimension=None):
+        if found_count is not None and found_count != count:
+            raise ValueError(f"{name} has {found_count} rows, manifest says {count}")
+        if found_dimension is not None and dimension is not None and found_dimension != dimension:
+            raise ValueError(f"{name} has dimension {found_dimension}, manifest says {dimension}")
+
+    embeddings = np.load(paths.embeddings, mmap_mode='r')
+    check('workflow_embeddings.npy', embeddings.shape[0], embeddings.shape[1])
+    if manifest.get('shards'):
+        check('shards', sum(shard['count'] for shard in manifest['shards']))
+        for shard in manifest['shards']:
+            ids = np.load(os.path.join(paths.shards, shard['ids']), mmap_mode='r')
+            if len(ids) != shard['count'] or not os.path.exists(os.path.join(paths.shards, shard['index'])):
+                raise ValueError(f"shard {shard['index']} is incomplete")
+    else:
+        from index_io import read_index
+        try:
+            index = read_index(paths.index)
+        except RuntimeError as e:
+            raise ValueError(f"unreadable faiss_index.index: {e}")
+        check('faiss_index.index', index.ntotal, index.d)
+    for name in ('metadata', 'workflow_json', 'lexical', 'features', 'typeahead'):
+        check(name, meta_count(getattr(paths, name)))
+    if os.path.exists(paths.duplicate_groups):
+        check('duplicate_groups.npy', len(np.load(paths.duplicate_groups, mmap_mode='r')))
+    return manifest
+
+def publish(build_id, builds_dir=BUILDS_DIR, current_path=CURRENT_PATH, keep=KEEP_BUILDS):
+    """Validate a finished build and point CURRENT at it with one atomic rename"""
+    root = os.path.join(builds_dir, build_id)
+    validate_build(BuildPaths(root))
+    tmp_path = f"{current_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(build_id + '\n')
+    os.replace(tmp_path, current_path)
+    if os.path.exists(os.path.join(root, BUILDING_MARKER)):
+        os.remove(os.path.join(root, BUILDING_MARKER))
+    prune(builds_dir, keep, current=build_id)
+
+def build_order(name):
+    """Sort key for build ids: timestamp, then same-second suffix as a number ('-10' after '-2')"""
+    match = BUILD_ID.fullmatch(name)
+    if match is None:
+        return (name, 0)
+    return (match.group(1), int(match.group(2) or 1))
+
+def build_in_progress(root):
+    """True if the process that is writing an unpublished build directory is still running"""
+    marker = os.path.join(root, BUILDING_MARKER)
+    try:
+        with open(marker, 'r', encoding='utf-8') as f:
+            pid = int(f.read())
+    except (OSError, ValueError):
+        return False
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        # os.kill(pid, 0) would terminate the process on Windows
+        return time.time() - os.path.getmtime(marker) < STALE_BUILD_SECONDS
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def prune(builds_dir=BUILDS_DIR, keep=KEEP_BUILDS, current=None):
+    """Remove all but the newest keep published builds (never the current one), and failed builds.
+
+    Directories without a manifest are builds that failed or were interrupted,
+    unless the process writing them is still running. Engines that still have
+    an old build open keep reading it: its memory maps stay valid until they
+    are closed.
+    """
+    builds, stale = [], []
+    for name in os.listdir(builds_dir):
+        root = os.path.join(builds_dir, name)
+        if name == current or not os.path.isdir(root) or build_in_progress(root):
+            continue
+        (builds if os.path.exists(os.path.join(root, 'manifest.json')) else stale).append(name)
+    builds = sorted(builds + ([current] if current else []), key=build_order)
+    for name in (builds[:-keep] if keep else builds) + stale:
+        if name != current:
+            # Windows cannot delete files another process has mapped; they go next time
+            shutil.rmtree(os.path.join(builds_dir, name), ignore_errors=True)
+
+class SwapGate:
+    """Lets requests run concurrently while a swap waits for them to finish.
+
+    Requests enter with `with gate.request():` (re-entrant per thread). swap(fn)
+    holds back new requests, waits until the running ones are done, then runs
+    fn, so no request ever sees half of an old build and half of a new one.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.active = 0
+        self.swapping = False
+        self.local = threading.local()
+
+    @contextmanager
+    def request(self):
+        self._enter()
+        try:
+            yield
+        finally:
+            self._exit()
+
+    def _enter(self):
+        depth = getattr(self.local, 'depth', 0)
+        if depth == 0:
+            with self.condition:
+                while self.swapping:
+                    self.condition.wait()
+                self.active += 1
+        self.local.depth = depth + 1
+
+    def _exit(self):
+        self.local.depth -= 1
+        if self.local.depth == 0:
+            with self.condition:
+                self.active -= 1
+                self.condition.notify_all()
+
+    def swap(self, fn):
+        with self.condition:
+            while self.swapping:
+                self.condition.wait()
+            self.swapping = True
+            while self.active:
+                self.condition.wait()
+            try:
+                return fn()
+            finally:
+                self.swapping = False
+                self.condition.notify_all()
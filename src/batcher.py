@@ -0,0 +1,99 @@
+from concurrent.futures import Future
+import queue
+import threading
+import time
+
+MAX_BATCH = 32
+MAX_WAIT_MS = 5
+
+class MicroBatcher:
+    """Collect concurrent requests for up to max_wait_ms or max_batch items and run them as one batch.
+
+    fn receives a list of items and must return a list of results in the same
+    order. Each caller gets its own result back through a Future.
+    """
+
+    def __init__(self, fn, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.max_seen = 0
+        self.size_counts = {}
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self.thread.start()
+
+    def submit(self, item):
+        """Queue an item and return a Future for its result"""
+        if self.closed:
+            raise RuntimeError("batcher is closed")
+        future = Future()
+        self.queue.put((item, future))
+        return future
+
+    def __call__(self, item):
+        return self.submit(item).result()
+
+    def _collect(self):
+        """Block for the first item, then gather more until the batch is full or the wait expires"""
+        batch = [self.queue.get()]
+        if batch[0] is None:
+            return None
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                entry = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                # Put the shutdown marker back for the outer loop
+                self.queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            items = [item for item, _ in batch]
+            try:
+                results = self.fn(items)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+
+            with self.lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.max_seen = max(self.max_seen, len(batch))
+                self.size_counts[len(batch)] = self.size_counts.get(len(batch), 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'queue_depth': self.queue.qsize(),
+                'batches': self.batches,
+                'items': self.items,
+                'mean_batch_size': self.items / self.batches if self.batches else 0.0,
+                'max_batch_size': self.max_seen,
+                'batch_sizes': dict(sorted(self.size_counts.items())),
+            }
+
+    def close(self):
+        """Stop the worker thread once queued items are done"""
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+            self.thread.join()
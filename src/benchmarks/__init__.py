@@ -0,0 +1,9 @@
+"""
+Benchmarks for building and searching at scale.
+
+    generate.py      synthetic workflows.csv files (10k to 10M rows)
+    stub_encoder.py  deterministic offline encoder (ENCODER_BACKEND=stub)
+    harness.py       build/startup/query benchmark with JSON reports
+
+Run from src/, e.g. `python -m benchmarks.harness --rows 10000 100000`.
+"""
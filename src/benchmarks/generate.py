@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Generate a synthetic workflows.csv with realistic name and workflow_json sizes.
+
+Names follow the usual n8n patterns ("Gmail to Google Sheets", "Daily Slack
+report", "My workflow 3", "... (copy)"). Node counts and parameter payloads
+are drawn from long-tailed distributions, so most workflow_json values are a
+few KB and a few are very large, as in real exports. Output is deterministic
+for a given seed and rows are streamed, so 10M rows need no extra memory.
+
+    python -m benchmarks.generate --rows 100000 --output ../benchmark_runs/workflows.csv
+"""
+
+import argparse
+import csv
+import json
+import os
+import random
+import time
+
+# Node types weighted roughly by how often they appear in public n8n workflows
+NODE_TYPES = [
+    ('n8n-nodes-base.httpRequest', 30), ('n8n-nodes-base.set', 28), ('n8n-nodes-base.if', 20),
+    ('n8n-nodes-base.code', 18), ('n8n-nodes-base.stickyNote', 15), ('n8n-nodes-base.googleSheets', 12),
+    ('n8n-nodes-base.slack', 10), ('n8n-nodes-base.gmail', 9), ('n8n-nodes-base.merge', 8),
+    ('@n8n/n8n-nodes-langchain.openAi', 8), ('n8n-nodes-base.telegram', 6), ('n8n-nodes-base.airtable', 5),
+    ('n8n-nodes-base.notion', 5), ('n8n-nodes-base.switch', 5), ('n8n-nodes-base.splitInBatches', 4),
+    ('n8n-nodes-base.postgres', 4), ('n8n-nodes-base.discord', 3), ('n8n-nodes-base.hubspot', 3),
+    ('n8n-nodes-base.stripe', 2), ('n8n-nodes-base.googleDrive', 4), ('n8n-nodes-base.wait', 3),
+    ('n8n-nodes-base.emailSend', 3), ('n8n-nodes-base.twitter', 2), ('n8n-nodes-base.trello', 2),
+]
+TRIGGERS = [
+    ('n8n-nodes-base.webhook', 25), ('n8n-nodes-base.scheduleTrigger', 25), ('n8n-nodes-base.manualTrigger', 20),
+    ('n8n-nodes-base.gmailTrigger', 6), ('n8n-nodes-base.telegramTrigger', 5), ('n8n-nodes-base.slackTrigger', 4),
+    ('n8n-nodes-base.formTrigger', 5), ('n8n-nodes-base.googleSheetsTrigger', 4), ('n8n-nodes-base.cron', 6),
+]
+CREDENTIALS = {
+    'slack': 'slackApi', 'gmail': 'gmailOAuth2', 'googleSheets': 'googleSheetsOAuth2Api', 'openAi': 'openAiApi',
+    'telegram': 'telegramApi', 'airtable': 'airtableTokenApi', 'notion': 'notionApi', 'postgres': 'postgres',
+    'hubspot': 'hubspotOAuth2Api', 'stripe': 'stripeApi', 'googleDrive': 'googleDriveOAuth2Api',
+    'discord': 'discordWebhookApi', 'twitter': 'twitterOAuth2Api', 'trello': 'trelloApi',
+}
+SERVICES = ['Gmail', 'Google Sheets', 'Slack', 'Telegram', 'Airtable', 'Notion', 'HubSpot', 'Stripe', 'Discord',
+            'OpenAI', 'Google Drive', 'Postgres', 'Trello', 'Twitter', 'Webhook', 'RSS', 'Shopify', 'Jira']
+ACTIONS = ['sync', 'backup', 'notify', 'report', 'scrape', 'summarize', 'import', 'export', 'monitor', 'alert',
+           'enrich leads', 'process orders', 'send invoices', 'post updates', 'classify emails', 'translate']
+PREFIXES = ['', '', '', 'Daily ', 'Weekly ', 'Automated ', 'AI ', 'Auto-', 'Simple ', '[PROD] ']
+WORDS = ['value', 'url', 'message', 'channel', 'sheet', 'range', 'query', 'text', 'prompt', 'field', 'status']
+
+def weighted(items):
+    names, weights = zip(*items)
+    return list(names), list(weights)
+
+def workflow_name(rng):
+    """A name in one of the common n8n naming styles"""
+    style = rng.random()
+    if style < 0.08:
+        name = f"My workflow {rng.randint(1, 40)}" if rng.random() < 0.7 else "My workflow"
+    elif style < 0.45:
+        a, b = rng.sample(SERVICES, 2)
+        name = f"{rng.choice(PREFIXES)}{a} to {b}"
+    elif style < 0.8:
+        name = f"{rng.choice(PREFIXES)}{rng.choice(SERVICES)} {rng.choice(ACTIONS)}"
+    else:
+        name = f"{rng.choice(ACTIONS).capitalize()} {rng.choice(SERVICES)} with {rng.choice(SERVICES)}"
+    if rng.random() < 0.05:
+        name += rng.choice([' (copy)', ' copy', ' v2', ' (1)'])
+    return name
+
+def node_parameters(rng, scale):
+    """Parameters whose serialized size follows a log-normal distribution (median ~scale bytes)"""
+    size = int(min(rng.lognormvariate(0, 1.2) * scale, 200 * scale))
+    params, total = {}, 0
+    while total < size:
+        key = rng.choice(WORDS)
+        value = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 40)))
+        params[f"{key}{len(params)}"] = value
+        total += len(key) + len(value) + 8
+    return params
+
+def workflow_json(rng, name, node_types, node_weights, triggers, trigger_weights, scale):
+    """An n8n workflow export: a trigger, a long-tailed number of nodes and a linear connection chain"""
+    num_nodes = max(1, min(int(rng.lognormvariate(1.6, 0.7)), 120))
+    types = rng.choices(triggers, trigger_weights) + rng.choices(node_types, node_weights, k=num_nodes - 1)
+    nodes = []
+    for i, node_type in enumerate(types):
+        node = {
+            'id': f"{rng.getrandbits(64):016x}",
+            'name': f"{node_type.rsplit('.', 1)[-1]} {i}",
+            'type': node_type,
+            'typeVersion': rng.choice([1, 1, 2, 3, 4.1]),
+            'position': [240 * i, rng.choice([0, 200, 400])],
+            'parameters': node_parameters(rng, scale),
+        }
+        credential = CREDENTIALS.get(node_type.rsplit('.', 1)[-1].replace('Trigger', ''))
+        if credential:
+            node['credentials'] = {credential: {'id': str(rng.randint(1, 999)), 'name': f"{credential} account"}}
+        nodes.append(node)
+    connections = {a['name']: {'main': [[{'node': b['name'], 'type': 'main', 'index': 0}]]}
+                   for a, b in zip(nodes, nodes[1:])}
+    return json.dumps({'name': name, 'nodes': nodes, 'connections': connections, 'settings': {}},
+                      separators=(',', ':'))
+
+def generate(rows, output, seed=0, json_scale=200):
+    """Write rows synthetic workflows to output; returns bytes written"""
+    rng = random.Random(seed)
+    node_types, node_weights = weighted(NODE_TYPES)
+    triggers, trigger_weights = weighted(TRIGGERS)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    start = time.perf_counter()
+    with open(output, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['workflow_id', 'workflow_name', 'workflow_json'])
+        for i in range(rows):
+            name = workflow_name(rng)
+            writer.writerow([f"wf{seed}-{i}", name,
+                             workflow_json(rng, name, node_types, node_weights, triggers, trigger_weights, json_scale)])
+            if (i + 1) % 100000 == 0:
+                print(f"  {i + 1}/{rows} rows ({time.perf_counter() - start:.0f}s)")
+    size = os.path.getsize(output)
+    print(f"Wrote {rows} workflows ({size / 1024 / 1024:.1f} MB) to {output}")
+    return size
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic workflows.csv")
+    parser.add_argument('--rows', type=int, default=10000, help="number of workflows (10k to 10M)")
+    parser.add_argument('--output', required=True, help="CSV path to write (existing files are overwritten)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json-scale', type=int, default=200,
+                        help="median parameter bytes per node (scales workflow_json sizes)")
+    args = parser.parse_args()
+    generate(args.rows, args.output, args.seed, args.json_scale)
+
+if __name__ == "__main__":
+    main()
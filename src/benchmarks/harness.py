@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Build and query benchmark on synthetic data.
+
+For each row count a scratch tree (data/, embeddings/, src/) is created under
+BENCH_DIR, a synthetic workflows.csv is generated and build_index.py and
+CSVSearchEngine run against it with the stub encoder. Every step runs in a
+fresh process so startup time and peak RSS are measured per step. Reports:
+
+    build       seconds, rows/sec, peak RSS
+    index size  bytes per artifact in embeddings/
+    query       engine startup, single-query and batch p50/p99 per mode, peak RSS
+
+Results are written as JSON; --compare prints the change against an earlier report.
+
+    python -m benchmarks.harness --rows 10000 100000 --compare ../benchmark_runs/results-old.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is not reported
+    resource = None
+
+from artifacts import read_current
+from benchmarks.generate import generate
+
+# Paths
+BENCH_DIR = '../benchmark_runs'
+
+NUM_QUERIES = 200
+QUERY_BATCH_SIZE = 32
+MODES = ['semantic', 'hybrid']
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def peak_rss_mb():
+    """Peak resident set size of this process"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KB elsewhere
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    def pick(q):
+        return latencies[min(len(latencies) - 1, int(round(q * (len(latencies) - 1))))] if latencies else 0.0
+    return {'p50_ms': pick(0.5), 'p99_ms': pick(0.99)}
+
+def directory_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total
+
+def index_size(embeddings_dir):
+    """Bytes per top-level artifact of the published build in embeddings/"""
+    build_id = read_current(os.path.join(embeddings_dir, 'CURRENT'))
+    if build_id is not None:
+        embeddings_dir = os.path.join(embeddings_dir, 'builds', build_id)
+    artifacts = {}
+    for name in sorted(os.listdir(embeddings_dir)):
+        path = os.path.join(embeddings_dir, name)
+        artifacts[name] = directory_size(path) if os.path.isdir(path) else os.path.getsize(path)
+    return {'total_bytes': sum(artifacts.values()), 'artifacts': artifacts}
+
+# Steps run inside the child process (cwd = <run dir>/src, ENCODER_BACKEND=stub)
+
+def child_build(options):
+    from artifacts import current_build
+    from build_index import build_index
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stderr):
+        build_index(incremental=False, chunk_size=options['chunk_size'], index_type=options['index_type'],
+                    eval_queries=0, encoder='stub', embedding_dtype=options['embedding_dtype'])
+    seconds = time.perf_counter() - start
+    with open(current_build()[1].manifest, 'r', encoding='utf-8') as f:
+        rows = json.load(f)['count']
+    return {'rows': rows, 'seconds': seconds, 'rows_per_sec': rows / seconds if seconds else 0.0,
+            'peak_rss_mb': peak_rss_mb()}
+
+def sample_queries(metadata, num_queries, seed=0):
+    """Realistic queries: two or three words from random workflow names"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(num_queries):
+        words = str(metadata.get('workflow_name', rng.randrange(len(metadata)))).split()
+        queries.append(' '.join(rng.sample(words, min(len(words), rng.randint(2, 3)))) or 'workflow')
+    return queries
+
+def child_query(options):
+    start = time.perf_counter()
+    from engine import CSVSearchEngine
+    with contextlib.redirect_stdout(sys.stderr):
+        # cache_size=0: every query is a cache miss
+        engine = CSVSearchEngine(cache_size=0, encoder='stub')
+    startup = time.perf_counter() - start
+    if not hasattr(engine, 'model'):
+        raise RuntimeError("search engine failed to load")
+
+    k = options['k']
+    batch_size = options['batch_size']
+    queries = sample_queries(engine.metadata, options['queries'])
+    report = {'startup_s': startup, 'queries': len(queries), 'k': k, 'modes': {}}
+    for mode in options['modes']:
+        if mode != 'semantic' and engine.lexical is None:
+            continue
+        engine.find(queries[0], k, mode)  # warm-up
+        single = []
+        for query in queries:
+            t = time.perf_counter()
+            engine.find(query, k, mode)
+            single.append((time.perf_counter() - t) * 1000)
+
+        batches = []
+        t_all = time.perf_counter()
+        for i in range(0, len(queries), batch_size):
+            t = time.perf_counter()
+            engine.search_batch(queries[i:i + batch_size], k, batch_size, mode=mode)
+            batches.append((time.perf_counter() - t) * 1000)
+        elapsed = time.perf_counter() - t_all
+        report['modes'][mode] = {
+            'single': percentiles(single),
+            'batch': {'batch_size': batch_size, **percentiles(batches),
+                      'queries_per_sec': len(queries) / elapsed if elapsed else 0.0},
+        }
+    report['peak_rss_mb'] = peak_rss_mb()
+    return report
+
+CHILD_STEPS = {'build': child_build, 'query': child_query}
+
+def run_child(step, run_dir, options, verbose=False):
+    """Run a step in a fresh interpreter and return its JSON report"""
+    env = dict(os.environ, ENCODER_BACKEND='stub',
+               PYTHONPATH=os.pathsep.join(filter(None, [SRC_DIR, os.environ.get('PYTHONPATH')])))
+    process = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.harness', '--child', step, '--options', json.dumps(options)],
+        cwd=os.path.join(run_dir, 'src'), env=env, stdout=subprocess.PIPE,
+        stderr=None if verbose else subprocess.PIPE, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"{step} step failed:\n{process.stderr or ''}")
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+def run(rows, options, seed=0, json_scale=200, verbose=False):
+    """Generate, build and query one dataset size"""
+    run_dir = os.path.abspath(os.path.join(BENCH_DIR, f"run-{rows}-s{seed}-j{json_scale}"))
+    csv_path = os.path.join(run_dir, 'data', 'workflows.csv')
+    for name in ('data', 'embeddings', 'src'):
+        os.makedirs(os.path.join(run_dir, name), exist_ok=True)
+
+    result = {'rows': rows}
+    if not os.path.exists(csv_path):
+        print(f"Generating {rows} workflows...")
+        start = time.perf_counter()
+        generate(rows, csv_path, seed, json_scale)
+        result['generate_s'] = time.perf_counter() - start
+    result['csv_bytes'] = os.path.getsize(csv_path)
+
+    print(f"Building index for {rows} workflows...")
+    result['build'] = run_child('build', run_dir, options, verbose)
+    result['index_size'] = index_size(os.path.join(run_dir, 'embeddings'))
+    print("Running queries...")
+    result['query'] = run_child('query', run_dir, options, verbose)
+    return result
+
+def summary_metrics(result):
+    """Flat {metric: value} view of a run, used for printing and comparisons"""
+    metrics = {
+        'build rows/sec': result['build']['rows_per_sec'],
+        'build peak RSS MB': result['build']['peak_rss_mb'],
+        'index size MB': result['index_size']['total_bytes'] / 1024 / 1024,
+        'startup s': result['query']['startup_s'],
+        'query peak RSS MB': result['query']['peak_rss_mb'],
+    }
+    for mode, report in result['query']['modes'].items():
+        metrics[f"{mode} single p50 ms"] = report['single']['p50_ms']
+        metrics[f"{mode} single p99 ms"] = report['single']['p99_ms']
+        metrics[f"{mode} batch p50 ms"] = report['batch']['p50_ms']
+        metrics[f"{mode} batch p99 ms"] = report['batch']['p99_ms']
+    return metrics
+
+def print_summary(result, previous=None):
+    print(f"\n{result['rows']} workflows")
+    print("-" * 60)
+    before = summary_metrics(previous) if previous else {}
+    for name, value in summary_metrics(result).items():
+        if value is None:
+            continue
+        line = f"  {name:24s} {value:12.3f}"
+        if before.get(name):
+            line += f"   ({(value - before[name]) / before[name] * 100:+.1f}% vs previous)"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark build and search on synthetic workflows")
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000], help="dataset sizes (10k to 10M)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json-scale', type=int, default=200, help="median parameter bytes per node")
+    parser.add_argument('--index-type', default='flat', help="FAISS index type to build")
+    parser.add_argument('--embedding-dtype', default='float32', help="storage type of the embeddings (float16 halves them)")
+    parser.add_argument('--chunk-size', type=int, default=50000, help="rows per streamed CSV chunk (0 loads all at once)")
+    parser.add_argument('--queries', type=int, default=NUM_QUERIES, help="queries per mode")
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=QUERY_BATCH_SIZE, help="queries per search_batch call")
+    parser.add_argument('--modes', nargs='+', default=MODES)
+    parser.add_argument('--output', help="report path (default: BENCH_DIR/results-<time>.json)")
+    parser.add_argument('--compare', metavar='REPORT', help="earlier report to compare against")
+    parser.add_argument('--verbose', action='store_true', help="show build and engine output")
+    parser.add_argument('--child', choices=sorted(CHILD_STEPS), help=argparse.SUPPRESS)
+    parser.add_argument('--options', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(CHILD_STEPS[args.child](json.loads(args.options))))
+        return
+
+    options = {'chunk_size': args.chunk_size or None, 'index_type': args.index_type,
+               'embedding_dtype': args.embedding_dtype, 'queries': args.queries,
+               'k': args.k, 'batch_size': args.batch_size, 'modes': args.modes}
+    previous = {}
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = {run['rows']: run for run in json.load(f)['runs']}
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'options': {**options, 'seed': args.seed, 'json_scale': args.json_scale, 'encoder': 'stub'},
+        'runs': [],
+    }
+    for rows in args.rows:
+        result = run(rows, options, args.seed, args.json_scale, args.verbose)
+        report['runs'].append(result)
+        print_summary(result, previous.get(rows))
+
+    output = args.output or os.path.join(BENCH_DIR, f"results-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport saved to {output}")
+
+if __name__ == "__main__":
+    main()
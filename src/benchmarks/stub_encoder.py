@@ -0,0 +1,43 @@
+import hashlib
+import re
+import numpy as np
+
+# Same width as all-MiniLM-L6-v2, so index sizes and search costs are realistic
+STUB_DIMENSION = 384
+
+TOKEN = re.compile(r'\w+')
+
+class StubEncoder:
+    """Deterministic bag-of-words encoder with SentenceTransformer's encode() interface.
+
+    Every token maps to a fixed pseudo-random vector seeded by its hash, and a
+    text is the sum of its token vectors. Texts sharing words end up close
+    together, which is enough to exercise the index like real embeddings,
+    without a model download, torch or network access.
+    """
+
+    def __init__(self, dimension=STUB_DIMENSION):
+        self.dimension = dimension
+        self.vectors = {}
+
+    def get_sentence_embedding_dimension(self):
+        return self.dimension
+
+    def token_vector(self, token):
+        vector = self.vectors.get(token)
+        if vector is None:
+            seed = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+            vector = np.random.default_rng(seed).standard_normal(self.dimension).astype('float32')
+            self.vectors[token] = vector
+        return vector
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, **kwargs):
+        if isinstance(texts, str):
+            texts = [texts]
+        out = np.zeros((len(texts), self.dimension), dtype='float32')
+        # A shared offset keeps empty texts from producing zero vectors
+        out += 1e-3
+        for i, text in enumerate(texts):
+            for token in TOKEN.findall(str(text).lower()):
+                out[i] += self.token_vector(token)
+        return out
@@ -0,0 +1,171 @@
+import numpy as np
+import json
+import os
+import shutil
+import threading
+
+try:
+    import zstandard
+except ImportError:  # optional, payloads are stored uncompressed without it
+    zstandard = None
+
+# Paths
+BLOB_STORE_DIR = '../embeddings/workflow_json'
+
+COMPRESSION_LEVEL = 10
+# Bytes per chunk when a record is streamed out
+STREAM_CHUNK = 65536
+DICT_SIZE = 112640
+DICT_SAMPLES = 5000
+
+class BlobStoreWriter:
+    """Write one independently compressed zstd frame per record plus an offsets table.
+
+    When dict_size is set, a zstd dictionary is trained on the first batch of
+    records; small JSON payloads compress far better with a shared dictionary.
+    """
+
+    def __init__(self, path=BLOB_STORE_DIR, level=COMPRESSION_LEVEL, dict_size=DICT_SIZE):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self.file = open(os.path.join(self.tmp_path, 'blobs.bin'), 'wb')
+        self.offsets = [np.zeros(1, dtype='int64')]
+        self.position = 0
+        self.count = 0
+        self.raw_bytes = 0
+        self.level = level
+        self.dict_size = dict_size if zstandard is not None else 0
+        self.dictionary = None
+        self.compressor = None
+
+    def _start(self, payloads):
+        """Create the compressor, training a dictionary on the first payloads"""
+        if zstandard is None:
+            return
+        if self.dict_size:
+            samples = payloads[:DICT_SAMPLES]
+            try:
+                self.dictionary = zstandard.train_dictionary(self.dict_size, samples, level=self.level)
+            except zstandard.ZstdError as e:
+                print(f"Could not train zstd dictionary ({e}), compressing without one")
+        self.compressor = zstandard.ZstdCompressor(level=self.level, dict_data=self.dictionary)
+
+    def append(self, values):
+        """Append an iterable of strings"""
+        payloads = [v.encode('utf-8') for v in values]
+        if self.count == 0 and self.compressor is None:
+            self._start(payloads)
+        if self.compressor is not None:
+            frames = [self.compressor.compress(p) for p in payloads]
+        else:
+            frames = payloads
+        lengths = np.fromiter((len(f) for f in frames), dtype='int64', count=len(frames))
+        self.file.write(b''.join(frames))
+        self.offsets.append(self.position + np.cumsum(lengths))
+        self.position += int(lengths.sum())
+        self.raw_bytes += sum(len(p) for p in payloads)
+        self.count += len(payloads)
+
+    def close(self):
+        """Finish the store and move it into place"""
+        self.file.close()
+        np.save(os.path.join(self.tmp_path, 'offsets.npy'), np.concatenate(self.offsets))
+        if self.dictionary is not None:
+            with open(os.path.join(self.tmp_path, 'dict.bin'), 'wb') as f:
+                f.write(self.dictionary.as_bytes())
+        meta = {
+            'count': self.count,
+            'codec': 'zstd' if self.compressor is not None else 'none',
+            'level': self.level,
+            'dictionary': self.dictionary is not None,
+            'raw_bytes': self.raw_bytes,
+            'stored_bytes': self.position,
+        }
+        with open(os.path.join(self.tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self.tmp_path, self.path)
+        return meta
+
+class BlobStore:
+    """Random-access reader; records are only decompressed when requested"""
+
+    def __init__(self, path=BLOB_STORE_DIR):
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.count = self.meta['count']
+        self.codec = self.meta['codec']
+        if self.codec == 'zstd' and zstandard is None:
+            raise ImportError("zstandard is required to read this blob store (pip install zstandard)")
+
+        blob_path = os.path.join(path, 'blobs.bin')
+        if os.path.getsize(blob_path):
+            self.data = np.memmap(blob_path, dtype='uint8', mode='r')
+        else:
+            self.data = np.zeros(0, dtype='uint8')
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r')
+
+        self.dictionary = None
+        if self.meta.get('dictionary'):
+            with open(os.path.join(path, 'dict.bin'), 'rb') as f:
+                self.dictionary = zstandard.ZstdCompressionDict(f.read())
+        # Decompressors are not thread safe, keep one per thread
+        self.local = threading.local()
+
+    def __len__(self):
+        return self.count
+
+    def _decompressor(self):
+        if not hasattr(self.local, 'decompressor'):
+            self.local.decompressor = zstandard.ZstdDecompressor(dict_data=self.dictionary)
+        return self.local.decompressor
+
+    def get(self, row):
+        """Return the record at row as a string"""
+        frame = self.data[self.offsets[row]:self.offsets[row + 1]].tobytes()
+        if self.codec == 'zstd':
+            frame = self._decompressor().decompress(frame)
+        return frame.decode('utf-8')
+
+    def size(self, row):
+        """Uncompressed size in bytes of the record at row, read from the frame header"""
+        frame = self.data[self.offsets[row]:self.offsets[row + 1]]
+        if self.codec == 'zstd' and len(frame):
+            return zstandard.frame_content_size(frame[:18].tobytes())
+        return len(frame)
+
+    def stream(self, row, chunk_size=STREAM_CHUNK):
+        """Yield the record at row as UTF-8 byte chunks, decompressing as it goes"""
+        frame = self.data[self.offsets[row]:self.offsets[row + 1]]
+        if self.codec != 'zstd':
+            for start in range(0, len(frame), chunk_size):
+                yield frame[start:start + chunk_size].tobytes()
+            return
+        # A stream may be consumed from several threads or interleaved with get(),
+        # so it gets its own decompressor
+        decompressor = zstandard.ZstdDecompressor(dict_data=self.dictionary)
+        with decompressor.stream_reader(memoryview(frame)) as reader:
+            while True:
+                chunk = reader.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def read(self, row, limit):
+        """The first limit bytes of the record at row as a string; only that much is decompressed"""
+        head = b''
+        for chunk in self.stream(row, min(limit, STREAM_CHUNK)):
+            head += chunk
+            if len(head) >= limit:
+                break
+        # A cut inside a multi-byte character is dropped
+        return head[:limit].decode('utf-8', errors='ignore')
+
+def load_blob_store(path=BLOB_STORE_DIR):
+    """Return the blob store at path, or None if it has not been built"""
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        return None
+    return BlobStore(path)
@@ -1,48 +1,412 @@
 import pandas as pd
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import faiss
+from snapshot import SnapshotWriter
+from blobstore import DICT_SIZE, BlobStoreWriter
+from lexical import LexicalIndexWriter
+from workflow_features import FeatureStoreWriter, parse_workflow
+from shards import ShardCoordinator, build_shards, shard_bytes
+from duplicates import DuplicateGrouper, FirstRows
+from typeahead import TypeaheadWriter
+from artifacts import current_build, new_build, publish
+from encoders import ENCODER_BACKEND, ENCODER_BACKENDS, ParallelEncoder
+from ann import (INDEX_TYPES, EMBEDDING_DTYPES, DEFAULT_PARAMS, ADD_BATCH_SIZE, resolve_params, create_index,
+                 apply_search_params, fill_index, evaluate_index, storage_recall, storage_report, print_storage_report,
+                 two_stage, compare_two_stage, print_two_stage_report)
+import argparse
+import hashlib
+import json
 import os
 
-# Paths
+# Paths (artifacts are written to a new directory under artifacts.BUILDS_DIR)
 CSV_PATH = '../data/workflows.csv'
-EMBEDDING_PATH = '../embeddings/workflow_embeddings.npy'
-INDEX_PATH = '../embeddings/faiss_index.index'
 
-def build_index():
+MODEL_NAME = 'all-MiniLM-L6-v2'
+BATCH_SIZE = 256
+
+# Bytes per row hash (SHA-1 digest)
+HASH_SIZE = 20
+
+def row_hash(workflow_id, text):
+    """Content hash of a row's searchable text, keyed by its workflow_id"""
+    return hashlib.sha1(f"{workflow_id}\x1f{text}".encode('utf-8')).digest()
+
+class PreviousRows:
+    """Row hashes of the previous build, looked up one chunk at a time from disk.
+
+    The hashes are argsorted once into a memory-mapped copy under tmp_path and
+    each chunk is matched with a binary search; rows that are reused are marked
+    in a memory-mapped bitmap, so nothing here grows with the previous build.
+    """
+
+    def __init__(self, hashes, tmp_path):
+        self.tmp_path = tmp_path
+        keys = hashes.view(f'V{HASH_SIZE}').reshape(-1)
+        order = np.argsort(keys)
+        self.keys = np.lib.format.open_memmap(tmp_path + '.keys.npy', mode='w+', dtype=keys.dtype, shape=keys.shape)
+        self.rows = np.lib.format.open_memmap(tmp_path + '.rows.npy', mode='w+', dtype='int64', shape=keys.shape)
+        for start in range(0, len(order), ADD_BATCH_SIZE):
+            block = order[start:start + ADD_BATCH_SIZE]
+            self.keys[start:start + len(block)] = keys[block]
+            self.rows[start:start + len(block)] = block
+        del order
+        self.used = np.lib.format.open_memmap(tmp_path + '.used.npy', mode='w+', dtype=bool, shape=keys.shape)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def find(self, chunk_hashes):
+        """(found mask, previous rows of the found hashes) for a list of digests; marks the rows as used"""
+        query = np.frombuffer(b''.join(chunk_hashes), dtype=self.keys.dtype)
+        if not len(self.keys):
+            return np.zeros(len(query), dtype=bool), np.zeros(0, dtype='int64')
+        positions = np.minimum(np.searchsorted(self.keys, query), len(self.keys) - 1)
+        found = self.keys[positions] == query
+        rows = np.asarray(self.rows[positions[found]])
+        self.used[rows] = True
+        return found, rows
+
+    @property
+    def dropped(self):
+        """Previous rows no row of this build reused"""
+        return len(self.used) - int(np.count_nonzero(self.used))
+
+    def close(self):
+        del self.keys, self.rows, self.used
+        for suffix in ('.keys.npy', '.rows.npy', '.used.npy'):
+            os.remove(self.tmp_path + suffix)
+
+def load_previous_build(encoder=ENCODER_BACKEND, paths=None, tmp_path=None):
+    """Return (PreviousRows, embeddings) from the published build, or (None, None).
+
+    tmp_path is where PreviousRows keeps its sorted copy of the hashes.
+    """
+    paths = paths or current_build()[1]
+    if not all(os.path.exists(p) for p in (paths.manifest, paths.row_hashes, paths.embeddings)):
+        return None, None
+
+    with open(paths.manifest, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('model') != MODEL_NAME:
+        print(f"Previous build used model {manifest.get('model')!r}, re-encoding everything")
+        return None, None
+    if manifest.get('encoder', 'torch') != encoder:
+        print(f"Previous build used the {manifest.get('encoder', 'torch')} encoder, re-encoding everything")
+        return None, None
+
+    # Older builds stored 'S20' strings, which drop trailing NULs; viewed as raw bytes both layouts match
+    hashes = np.load(paths.row_hashes, mmap_mode='r')
+    embeddings = np.load(paths.embeddings, mmap_mode='r')
+    if len(hashes) != len(embeddings):
+        print("Previous manifest does not match stored embeddings, re-encoding everything")
+        return None, None
+
+    return PreviousRows(hashes, tmp_path or paths.row_hashes + '.tmp'), embeddings
+
+def read_workflows(columns, chunk_size=None):
+    """Yield DataFrame chunks of the CSV holding only the given columns"""
+    if chunk_size is None:
+        yield pd.read_csv(CSV_PATH, usecols=columns)
+    else:
+        yield from pd.read_csv(CSV_PATH, usecols=columns, chunksize=chunk_size)
+
+def scan_names(paths, chunk_size=None):
+    """First pass over the workflow names, without keeping them in memory.
+
+    Returns (text_rows, grouper): text_rows maps every row to the first row
+    with the same normalized name, whose vector it can copy, and the grouper
+    has written the duplicate groups. Both are resolved on disk (see
+    duplicates.FirstRows); len(text_rows) is the row count.
+    """
+    text_rows = FirstRows(os.path.join(paths.root, 'text_rows.tmp.npy'))
+    grouper = DuplicateGrouper(paths.duplicate_groups)
+    for chunk in read_workflows(['workflow_name'], chunk_size):
+        names = chunk['workflow_name'].fillna('').astype(str).tolist()
+        text_rows.append(names)
+        grouper.append(names)
+    grouper.close()
+    return text_rows.close(), grouper
+
+def build_index(incremental=True, chunk_size=None, batch_size=BATCH_SIZE, json_dict_size=DICT_SIZE,
+                index_type='flat', index_params=None, eval_queries=200, eval_k=10, encoder=None, workers=1,
+                embedding_dtype='float32', shards=1):
+    """Build embeddings and FAISS index.
+
+    With chunk_size set the CSV is streamed in chunks and vectors are written
+    straight into a memory-mapped .npy, so peak memory no longer depends on the
+    size of the CSV text.
+
+    index_type picks the FAISS index (see ann.INDEX_TYPES). Unless eval_queries
+    is 0, the built index is checked against exact search and its recall@k and
+    p50/p99 latency are printed. encoder picks the encoder backend (see
+    encoders.py); it defaults to $ENCODER_BACKEND or torch. With workers > 1
+    (0 = one per CPU core) texts are encoded on a pool of worker processes.
+    embedding_dtype='float16' halves workflow_embeddings.npy; vectors are
+    encoded and indexed in float32 and only converted when saved.
+    index_type='pca' builds a two-stage index (see ann.RescoredIndex) and
+    reports its recall/latency per candidate multiplier next to IndexFlatIP. With
+    shards > 1 the index is split into that many shard indexes (see shards.py)
+    searched by a scatter-gather coordinator instead of one faiss_index.index.
+
+    Everything is written to a new versioned build directory, which is
+    validated and then published by atomically swapping the CURRENT pointer
+    (see artifacts.py); running engines pick it up without a restart.
+    """
+    encoder = encoder or ENCODER_BACKEND
+    # Nothing reads the new build directory until it is published
+    build_id, paths = new_build()
+    print(f"Writing build {build_id} to {paths.root}")
+
     # Load CSV
     print("Loading CSV data...")
-    df = pd.read_csv(CSV_PATH)
-    print(f"Loaded {len(df)} workflows")
+    text_rows, grouper = scan_names(paths, chunk_size)
+    num_rows = len(text_rows)
+    print(f"Loaded {num_rows} workflows")
+
+    previous, old_embeddings = (load_previous_build(encoder, tmp_path=os.path.join(paths.root, 'previous.tmp'))
+                                if incremental else (None, None))
 
-    # Load model
-    print("Loading sentence transformer model...")
-    model = SentenceTransformer('all-MiniLM-L6-v2')
+    model = None
+    if old_embeddings is not None:
+        dimension = old_embeddings.shape[1]
+    else:
+        # Load model
+        print("Loading sentence transformer model...")
+        model = ParallelEncoder(encoder, workers, batch_size)
+        dimension = model.get_sentence_embedding_dimension()
+
+    tmp_embedding_path = paths.embeddings + '.float32.tmp.npy'
+    embeddings = np.lib.format.open_memmap(tmp_embedding_path, mode='w+', dtype='float32', shape=(num_rows, dimension))
+    hashes = np.lib.format.open_memmap(paths.row_hashes, mode='w+', dtype='uint8', shape=(num_rows, HASH_SIZE))
+    snapshot = SnapshotWriter(paths.metadata)
+    blobs = BlobStoreWriter(paths.workflow_json, dict_size=json_dict_size)
+    lexical = LexicalIndexWriter(paths.lexical)
+    feature_store = FeatureStoreWriter(paths.features)
+    typeahead = TypeaheadWriter(text_rows, paths.typeahead)
 
     # Generate embeddings
     print("Generating embeddings...")
-    # Use workflow_name as the searchable text
-    searchable_text = df['workflow_name'].fillna('').astype(str).tolist()
-    embeddings = model.encode(searchable_text, convert_to_numpy=True)
+    stats = {'reused': 0, 'encoded': 0, 'deduplicated': 0, 'dropped': 0}
+    offset = 0
+    for chunk in read_workflows(['workflow_id', 'workflow_name', 'workflow_json'], chunk_size):
+        snapshot.append(chunk)
+        blobs.append(chunk['workflow_json'].fillna('').astype(str))
+        # Parse workflow_json once for the BM25 index and the filter features
+        features = [parse_workflow(j) for j in chunk['workflow_json'].fillna('').astype(str)]
+        lexical.append(chunk['workflow_name'].fillna('').astype(str), features)
+        feature_store.append(features)
+
+        # Use workflow_name as the searchable text
+        searchable_text = chunk['workflow_name'].fillna('').astype(str).tolist()
+        typeahead.append(searchable_text)
+        workflow_ids = chunk['workflow_id'].astype(str).tolist()
+        chunk_hashes = [row_hash(w, t) for w, t in zip(workflow_ids, searchable_text)]
+        hashes[offset:offset + len(chunk)] = np.frombuffer(b''.join(chunk_hashes), dtype='uint8').reshape(-1, HASH_SIZE)
+
+        # Work out which rows can reuse a vector from the previous build
+        if previous is not None:
+            found, reused_from = previous.find(chunk_hashes)
+        else:
+            found, reused_from = np.zeros(len(chunk_hashes), dtype=bool), np.zeros(0, dtype='int64')
+        reused_rows = offset + np.flatnonzero(found)
+        encode_rows = np.flatnonzero(~found).tolist()
+        if len(reused_rows):
+            # Stored vectors are already normalized
+            embeddings[reused_rows] = old_embeddings[reused_from]
+
+        # Encode each distinct text once; identical texts copy the vector of its first row,
+        # which is always reused or encoded before them
+        unique_rows, copy_rows, copy_from = [], [], []
+        for row in encode_rows:
+            first = int(text_rows[offset + row])
+            if first == offset + row:
+                unique_rows.append(row)
+            else:
+                copy_rows.append(offset + row)
+                copy_from.append(first)
+
+        if unique_rows and model is None:
+            print("Loading sentence transformer model...")
+            model = ParallelEncoder(encoder, workers, batch_size)
+        # Length-bucketed batches come back in any order; each vector goes to its own row
+        texts = [searchable_text[i] for i in unique_rows]
+        for positions, batch_emb in (model.iter_encode(texts) if unique_rows else ()):
+            # Normalize embeddings for cosine similarity
+            batch_emb = batch_emb / np.linalg.norm(batch_emb, axis=1, keepdims=True)
+            embeddings[[offset + unique_rows[p] for p in positions]] = batch_emb
+        if copy_rows:
+            embeddings[copy_rows] = embeddings[copy_from]
+
+        stats['reused'] += len(reused_rows)
+        stats['encoded'] += len(unique_rows)
+        stats['deduplicated'] += len(copy_rows)
+        offset += len(chunk)
+        if chunk_size is not None:
+            print(f"  {offset}/{num_rows} rows")
+
+    if previous is not None:
+        stats['dropped'] = previous.dropped
+        previous.close()
     print(f"Generated embeddings with shape: {embeddings.shape}")
+    if stats['deduplicated']:
+        saved = stats['deduplicated'] / (stats['encoded'] + stats['deduplicated'])
+        print(f"Encoded {stats['encoded']} distinct texts, {stats['deduplicated']} duplicate rows copied "
+              f"their vector ({saved:.1%} of encodes saved)")
+    print(f"Duplicate groups: {grouper.num_groups} for {num_rows} rows")
+    if model is not None:
+        model.report()
+        model.close()
 
-    # Normalize embeddings for cosine similarity
-    embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    # Save metadata snapshot so search startup skips CSV parsing
+    snapshot.close()
+    blob_meta = blobs.close()
+    print(f"workflow_json stored {blob_meta['codec']}: {blob_meta['raw_bytes']} -> {blob_meta['stored_bytes']} bytes")
+    lexical_meta = lexical.close()
+    print(f"BM25 index: {lexical_meta['terms']} terms, {lexical_meta['postings']} postings")
+    features_meta = feature_store.close()
+    print(f"Workflow features: {len(features_meta['node_types'])} node types, "
+          f"{len(features_meta['integrations'])} integrations, {len(features_meta['triggers'])} triggers")
+    typeahead_meta = typeahead.close()
+    print(f"Typeahead: {typeahead_meta['names']} distinct names, {typeahead_meta['trigrams']} trigrams")
 
-    # Save embeddings
-    os.makedirs('../embeddings', exist_ok=True)
-    np.save(EMBEDDING_PATH, embeddings)
-    print(f"Embeddings saved to {EMBEDDING_PATH}")
+    # Release memory maps before the files are reopened
+    embeddings.flush()
+    hashes.flush()
+    del embeddings, hashes, text_rows, old_embeddings
+    os.remove(os.path.join(paths.root, 'text_rows.tmp.npy'))
 
-    # Build FAISS index
-    dimension = embeddings.shape[1]
-    index = faiss.IndexFlatIP(dimension)  # cosine similarity
-    index.add(embeddings)
+    # Build FAISS index one batch at a time from the float32 vectors
+    embeddings = np.load(tmp_embedding_path, mmap_mode='r')
+    shard_list = None
+    if shards > 1:
+        # IVF cell counts and the like are sized for one shard
+        params = resolve_params(index_type, -(-num_rows // shards), index_params)
+        print(f"Building {shards} {index_type} index shards...")
+        shard_list = build_shards(embeddings, shards, index_type, params, paths.shards)
+        index = ShardCoordinator(shard_list, params, tmp_embedding_path, paths.shards)
+    else:
+        params = resolve_params(index_type, num_rows, index_params)
+        print(f"Building {index_type} index...")
+        index = create_index(index_type, dimension, params)  # inner product == cosine similarity
+        fill_index(index, embeddings)
+        apply_search_params(index, params)
+        index = two_stage(index, embeddings, params)
+
+    # Measure the recall / latency trade-off of this index (for shards: of the merged scatter-gather search)
+    evaluation = None
+    if eval_queries and num_rows:
+        evaluation = evaluate_index(index, embeddings, k=eval_k, num_queries=eval_queries)
+        label = f"{index_type} index" if shard_list is None else f"{len(shard_list)}-shard {index_type} index"
+        print(f"{label}: recall@{evaluation['k']} {evaluation['recall']:.4f} vs exact search, "
+              f"p50 {evaluation['p50_ms']:.3f} ms, p99 {evaluation['p99_ms']:.3f} ms "
+              f"over {evaluation['queries']} queries")
+        if index_type == 'pca' and shard_list is None:
+            print(f"Two-stage search ({params['pca_dim']}-d first stage) vs the full-dimension flat index:")
+            evaluation['two_stage'] = compare_two_stage(index, embeddings, k=eval_k, num_queries=eval_queries)
+            print_two_stage_report(evaluation['two_stage'])
 
     # Save FAISS index
-    faiss.write_index(index, INDEX_PATH)
-    print(f"FAISS index saved to {INDEX_PATH}")
+    if shard_list is not None:
+        index.close()
+        index_bytes = shard_bytes(shard_list, paths.shards)
+        print(f"{len(shard_list)} FAISS index shards saved to {paths.shards}")
+    else:
+        faiss.write_index(getattr(index, 'first_stage', index), paths.index)
+        index_bytes = os.path.getsize(paths.index)
+        print(f"FAISS index saved to {paths.index}")
+    del index
+
+    # Save embeddings, converted block by block when a compact dtype was asked for
+    embedding_recall = None
+    if embedding_dtype != 'float32':
+        tmp_compact_path = paths.embeddings + f'.{embedding_dtype}.tmp.npy'
+        compact = np.lib.format.open_memmap(tmp_compact_path, mode='w+', dtype=embedding_dtype,
+                                            shape=(num_rows, dimension))
+        for start in range(0, num_rows, ADD_BATCH_SIZE):
+            compact[start:start + ADD_BATCH_SIZE] = embeddings[start:start + ADD_BATCH_SIZE]
+        compact.flush()
+        if eval_queries and num_rows:
+            embedding_recall = storage_recall(embeddings, compact, k=eval_k, num_queries=eval_queries)
+        del compact, embeddings
+        os.remove(tmp_embedding_path)
+        tmp_embedding_path = tmp_compact_path
+    else:
+        del embeddings
+    os.replace(tmp_embedding_path, paths.embeddings)
+    print(f"Embeddings saved to {paths.embeddings} ({embedding_dtype})")
+
+    storage = storage_report(num_rows, dimension, os.path.getsize(paths.embeddings), embedding_dtype,
+                             index_bytes, index_type,
+                             evaluation['recall'] if evaluation else None, embedding_recall)
+    print_storage_report(storage, evaluation['k'] if evaluation else eval_k)
+
+    # Save manifest so the next build only re-encodes changed rows
+    manifest = {
+        'model': MODEL_NAME,
+        'encoder': encoder,
+        'dimension': int(dimension),
+        'count': num_rows,
+        'build_id': build_id,
+        'embedding_dtype': embedding_dtype,
+        'index': {'type': index_type, 'params': params},
+        'shards': shard_list,
+        # Bounds how many rows a collapsed search fetches to find k distinct groups
+        'duplicates': {'groups': grouper.num_groups, 'max_size': grouper.max_size},
+        'evaluation': evaluation,
+        'storage': storage,
+    }
+    with open(paths.manifest, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+    # Atomic pointer swap: readers see either the old build or this one, never a mix
+    publish(build_id)
+    print(f"Published build {build_id}")
+
+    print(f"Reused {stats['reused']} rows, re-encoded {stats['encoded']} rows, "
+          f"copied {stats['deduplicated']} duplicates, dropped {stats['dropped']} rows")
     print("Index built and saved successfully!")
+    return stats
 
 if __name__ == "__main__":
-    build_index()
+    parser = argparse.ArgumentParser(description="Build embeddings and FAISS index for workflows.csv")
+    parser.add_argument('--full', action='store_true', help="re-encode every row instead of reusing unchanged ones")
+    parser.add_argument('--stream', action='store_true', help="read the CSV in chunks to keep memory flat on large exports")
+    parser.add_argument('--chunk-size', type=int, default=50000, help="rows per CSV chunk in streaming mode")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="texts per length-bucketed encode batch")
+    parser.add_argument('--workers', type=int, default=1, help="encoder processes (0 = one per CPU core)")
+    parser.add_argument('--encoder', choices=ENCODER_BACKENDS, help="encoder backend (default: $ENCODER_BACKEND or torch)")
+    parser.add_argument('--no-json-dict', action='store_true', help="compress workflow_json without a trained zstd dictionary")
+    parser.add_argument('--index-type', choices=INDEX_TYPES, default='flat',
+                        help="FAISS index to build (sq8/sqfp16: scalar-quantized flat index, "
+                             "pca: reduced-dimension first stage re-scored with the full vectors)")
+    parser.add_argument('--shards', type=int, default=1,
+                        help="split the index into N shards searched in parallel by worker processes")
+    parser.add_argument('--embedding-dtype', choices=EMBEDDING_DTYPES, default='float32',
+                        help="storage type of workflow_embeddings.npy")
+    parser.add_argument('--nlist', type=int, help="IVF cells (default ~4*sqrt(rows))")
+    parser.add_argument('--nprobe', type=int, help=f"IVF cells visited per query (default {DEFAULT_PARAMS['nprobe']})")
+    parser.add_argument('--pq-m', type=int, help=f"PQ sub-quantizers (default {DEFAULT_PARAMS['pq_m']})")
+    parser.add_argument('--pq-bits', type=int, help=f"bits per PQ code (default {DEFAULT_PARAMS['pq_bits']})")
+    parser.add_argument('--hnsw-m', type=int, help=f"HNSW neighbours per node (default {DEFAULT_PARAMS['hnsw_m']})")
+    parser.add_argument('--ef-construction', type=int, help=f"HNSW build depth (default {DEFAULT_PARAMS['ef_construction']})")
+    parser.add_argument('--ef-search', type=int, help=f"HNSW search depth (default {DEFAULT_PARAMS['ef_search']})")
+    parser.add_argument('--pca-dim', type=int,
+                        help=f"pca: dimension of the first-stage index (default {DEFAULT_PARAMS['pca_dim']})")
+    parser.add_argument('--rescore', type=int,
+                        help=f"pca: candidates per result re-scored with the full vectors (default {DEFAULT_PARAMS['rescore']})")
+    parser.add_argument('--eval-queries', type=int, default=200, help="sample queries for the recall/latency report (0 to skip)")
+    parser.add_argument('--eval-k', type=int, default=10, help="k used for recall@k")
+    args = parser.parse_args()
+    index_params = {name: getattr(args, name) for name in DEFAULT_PARAMS}
+    build_index(incremental=not args.full,
+                chunk_size=args.chunk_size if args.stream else None,
+                batch_size=args.batch_size,
+                json_dict_size=0 if args.no_json_dict else DICT_SIZE,
+                index_type=args.index_type,
+                index_params=index_params,
+                eval_queries=args.eval_queries,
+                eval_k=args.eval_k,
+                encoder=args.encoder,
+                workers=args.workers,
+                embedding_dtype=args.embedding_dtype,
+                shards=args.shards)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Local search daemon: keeps a warm CSVSearchEngine resident behind a Unix domain socket.
+
+search.py --query ... connects to it when it is running, so one-shot lookups
+skip importing torch and loading the model and index (milliseconds instead of
+seconds). The protocol is one JSON object per line in each direction:
+
+    {"op": "search", "query": "...", "k": 5, "mode": "hybrid", "filters": {...}, "collapse": true, "with_json": false}
+    {"op": "batch", "queries": ["...", ...], "k": 5, ...}
+    {"op": "ping"} / {"op": "stats"} / {"op": "metrics"} / {"op": "shutdown"}
+
+Replies are {"ok": true, ...} or {"ok": false, "error": "..."}.
+"""
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+
+from search import SEARCH_MODES
+
+# Paths
+SOCKET_PATH = '../embeddings/search.sock'
+
+# A missing or dead daemon must not slow the CLI down: give up quickly on connect
+CONNECT_TIMEOUT = 0.2
+REQUEST_TIMEOUT = 60
+
+def supported():
+    return hasattr(socket, 'AF_UNIX')
+
+def request(payload, path=SOCKET_PATH, timeout=REQUEST_TIMEOUT):
+    """Send one request to the daemon and return its reply, or None if no daemon is listening"""
+    if not supported() or not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        try:
+            sock.connect(path)
+        except OSError:
+            # Stale socket file left behind by a daemon that was killed
+            return None
+        sock.settimeout(timeout)
+        with sock.makefile('rwb') as stream:
+            stream.write(json.dumps(payload, ensure_ascii=False).encode('utf-8') + b'\n')
+            stream.flush()
+            line = stream.readline()
+    finally:
+        sock.close()
+    if not line:
+        return None
+    return json.loads(line)
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """One client connection; requests are answered in order until the client disconnects"""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                reply = {'ok': True, **self.server.dispatch(json.loads(line))}
+            except Exception as e:
+                reply = {'ok': False, 'error': str(e)}
+            self.wfile.write(json.dumps(reply, ensure_ascii=False).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+class SearchDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, engine, path=SOCKET_PATH):
+        self.engine = engine
+        self.path = path
+        super().__init__(path, RequestHandler)
+
+    def dispatch(self, params):
+        from engine import result_to_json
+
+        op = params.get('op', 'search')
+        if op == 'ping':
+            return {'pid': os.getpid(), 'workflows': len(self.engine.metadata), 'build': self.engine.build_id}
+        if op == 'stats':
+            stats = {'cache': self.engine.cache.stats()}
+            if self.engine.batcher is not None:
+                stats['batcher'] = self.engine.batcher.stats()
+            return stats
+        if op == 'metrics':
+            from metrics import REGISTRY
+            return {'text': REGISTRY.render()}
+        if op == 'shutdown':
+            # shutdown() waits for serve_forever to return, so it cannot run on a handler thread
+            threading.Thread(target=self.shutdown, daemon=True).start()
+            return {}
+
+        if op not in ('search', 'batch'):
+            raise ValueError(f"unknown op {op!r}")
+        k = int(params.get('k', 5))
+        with_json = bool(params.get('with_json', False))
+        filters = params.get('filters')
+        collapse = params.get('collapse')
+        # Report the mode the engine ran (semantic without a BM25 index) on the build that answered
+        with self.engine.gate.request():
+            mode = self.engine.search_mode(params.get('mode'))
+            if op == 'search':
+                results = self.engine.find(params['query'], k, mode, filters, collapse)
+                return {'mode': mode, 'results': [result_to_json(r, with_json) for r in results]}
+            results = self.engine.search_batch(params['queries'], k, mode=mode, filters=filters, collapse=collapse)
+            return {'mode': mode, 'results': [[result_to_json(r, with_json) for r in rs] for rs in results]}
+
+def serve(path=SOCKET_PATH, mode=None, encoder=None):
+    if request({'op': 'ping'}, path) is not None:
+        print(f"A search daemon is already listening on {path}")
+        return False
+    if os.path.exists(path):
+        os.remove(path)
+
+    from engine import CSVSearchEngine
+    from query_cache import CACHE_PATH
+
+    # Concurrent clients are micro-batched like the HTTP server's requests
+    engine = CSVSearchEngine(cache_path=CACHE_PATH, micro_batch=True, mode=mode, encoder=encoder)
+    if not hasattr(engine, 'model'):
+        return False
+    server = SearchDaemon(engine, path)
+    print(f"Search daemon listening on {path} (pid {os.getpid()})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep a warm search engine behind a Unix domain socket")
+    parser.add_argument('--socket', default=SOCKET_PATH, help="socket path")
+    parser.add_argument('--mode', choices=SEARCH_MODES, help="default retrieval mode")
+    parser.add_argument('--encoder', help="query encoder backend: torch or onnx (default: $ENCODER_BACKEND or torch)")
+    parser.add_argument('--status', action='store_true', help="report whether a daemon is running and exit")
+    parser.add_argument('--metrics', action='store_true', help="print the running daemon's metrics (Prometheus text) and exit")
+    parser.add_argument('--no-query-log', action='store_true', help="do not log one JSON line per query to stderr")
+    parser.add_argument('--stop', action='store_true', help="stop the running daemon and exit")
+    args = parser.parse_args()
+
+    if not supported():
+        sys.exit("Unix domain sockets are not available on this platform")
+
+    if args.metrics:
+        reply = request({'op': 'metrics'}, args.socket)
+        if reply is None:
+            sys.exit("No search daemon is running")
+        print(reply['text'], end='')
+        return
+
+    if args.status or args.stop:
+        reply = request({'op': 'shutdown' if args.stop else 'ping'}, args.socket)
+        if reply is None:
+            sys.exit("No search daemon is running")
+        print("Search daemon stopped" if args.stop else f"Search daemon running (pid {reply['pid']}, "
+                                                           f"{reply['workflows']} workflows)")
+        return
+
+    if not args.no_query_log:
+        from metrics import enable_query_log
+        enable_query_log()
+    if not serve(args.socket, args.mode, args.encoder):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
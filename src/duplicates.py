@@ -0,0 +1,119 @@
+import numpy as np
+import hashlib
+import os
+import re
+import shutil
+
+# Paths
+DUPLICATE_GROUPS_PATH = '../embeddings/duplicate_groups.npy'
+
+# Files keys are spread over while first rows are resolved; each is loaded on its own at the end
+PARTITIONS = 64
+# 128-bit key hash plus row id, as spilled to the partition files
+KEY_RECORD = np.dtype([('hi', '<u8'), ('lo', '<u8'), ('row', '<i4')])
+
+# Explicit copy markers n8n and people add at the end of a name: "(copy)", "copy 2", "v2", "(1)",
+# "version 4". A bare trailing number is not one ("Lesson 1" and "Lesson 2" are different workflows)
+COPY_SUFFIX = re.compile(r'(?:[\s_-]+|[\(\[](?:copy|duplicate)(?: \d+)?[\)\]]|\b(?:copy|duplicate|version)(?: \d+)?'
+                         r'|\bv\d+(?:\.\d+)*|[\(\[]\d+[\)\]])+$')
+
+def normalize_text(text):
+    """Texts that encode to the same vector: case and whitespace are ignored"""
+    return ' '.join(str(text).lower().split())
+
+def group_key(text):
+    """Near-duplicate key: normalized text without copy/version suffixes ('Gmail to Slack (copy) v2' -> 'gmail to slack')"""
+    text = normalize_text(text)
+    return COPY_SUFFIX.sub('', text) or text
+
+class FirstRows:
+    """Map every row to the first row with the same key without keeping the keys in memory.
+
+    Keys are hashed to 128 bits and spilled with their row ids to PARTITIONS
+    files chosen by hash, so equal keys always share a file. close() resolves
+    one file at a time into an int32 .npy at path. max_size is the row count
+    of the largest key once closed.
+    """
+
+    def __init__(self, path, key=normalize_text, partitions=PARTITIONS):
+        self.path = path
+        self.key = key
+        self.tmp_path = path + '.parts'
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self.files = [open(os.path.join(self.tmp_path, f'{i:03d}.bin'), 'wb') for i in range(partitions)]
+        self.count = 0
+        self.num_firsts = 0
+        self.max_size = 0
+
+    def append(self, texts):
+        digests = b''.join(hashlib.blake2b(self.key(text).encode('utf-8'), digest_size=16).digest() for text in texts)
+        records = np.zeros(len(texts), dtype=KEY_RECORD)
+        if len(texts):
+            digests = np.frombuffer(digests, dtype='<u8').reshape(-1, 2)
+            records['hi'], records['lo'] = digests[:, 0], digests[:, 1]
+            records['row'] = np.arange(self.count, self.count + len(texts))
+        partition = records['hi'] % len(self.files)
+        for i in np.unique(partition):
+            self.files[i].write(records[partition == i].tobytes())
+        self.count += len(texts)
+
+    def close(self):
+        """Write the first row of every row's key and return it memory-mapped"""
+        first = np.lib.format.open_memmap(self.path, mode='w+', dtype='int32', shape=(self.count,))
+        for f in self.files:
+            f.close()
+            records = np.fromfile(f.name, dtype=KEY_RECORD)
+            if not len(records):
+                continue
+            records = records[np.lexsort((records['row'], records['lo'], records['hi']))]
+            starts = np.ones(len(records), dtype=bool)
+            starts[1:] = (records['hi'][1:] != records['hi'][:-1]) | (records['lo'][1:] != records['lo'][:-1])
+            # Each record takes the row of the first record of its key
+            first[records['row']] = records['row'][np.maximum.accumulate(np.where(starts, np.arange(len(records)), 0))]
+            self.num_firsts += int(starts.sum())
+            self.max_size = max(self.max_size, int(np.diff(np.append(np.flatnonzero(starts), len(records))).max()))
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        first.flush()
+        return first
+
+class DuplicateGrouper(FirstRows):
+    """Assign each row the row id of the first row with the same group key"""
+
+    def __init__(self, path=DUPLICATE_GROUPS_PATH):
+        super().__init__(path, key=group_key)
+
+    @property
+    def num_groups(self):
+        return self.num_firsts
+
+class DuplicateGroups:
+    """Per-row duplicate-group ids; a group is identified by its first row (the representative)"""
+
+    def __init__(self, path=DUPLICATE_GROUPS_PATH):
+        self.groups = np.load(path, mmap_mode='r')
+        self._sizes = None
+
+    def __len__(self):
+        return len(self.groups)
+
+    def collapse(self, scores, ids, k):
+        """Best-scoring row of each group in a ranked (scores, ids) list, at most k of them"""
+        scores, ids = np.asarray(scores), np.asarray(ids)
+        found = ids >= 0
+        scores, ids = scores[found], ids[found]
+        _, first = np.unique(self.groups[ids], return_index=True)
+        keep = np.sort(first)[:k]
+        return scores[keep], ids[keep]
+
+    def size(self, row):
+        """Number of rows in the group of a row"""
+        if self._sizes is None:
+            self._sizes = np.bincount(np.asarray(self.groups), minlength=len(self.groups))
+        return int(self._sizes[self.groups[row]])
+
+def load_duplicate_groups(path=DUPLICATE_GROUPS_PATH):
+    """Return the duplicate groups at path, or None if they have not been built"""
+    if not os.path.exists(path):
+        return None
+    return DuplicateGroups(path)
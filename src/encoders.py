@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Query encoder backends.
+
+    torch  SentenceTransformer in full precision (default)
+    onnx   the same model exported to ONNX with dynamic int8 quantization, run
+           through onnxruntime; needs a one-time `python encoders.py export`
+    stub   deterministic hashing encoder for benchmarks (no model download,
+           not meaningful for real searches; see benchmarks/stub_encoder.py)
+
+torch and onnx produce embeddings compatible with the index built by build_index.py, so
+switching backends does not require a rebuild. `python encoders.py compare`
+reports cosine agreement, top-k overlap and latency against the torch encoder.
+The backend is chosen with the ENCODER_BACKEND environment variable or the
+--encoder option of search.py, server.py and daemon.py.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+import numpy as np
+
+# Paths
+ONNX_DIR = '../embeddings/onnx'
+CSV_PATH = '../data/workflows.csv'
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+
+ENCODER_BACKENDS = ['torch', 'onnx', 'stub']
+ENCODER_BACKEND = os.environ.get('ENCODER_BACKEND', 'torch')
+
+ONNX_OPSET = 14
+
+class OnnxEncoder:
+    """Sentence encoder backed by an exported ONNX graph, with the SentenceTransformer encode() interface"""
+
+    def __init__(self, path=ONNX_DIR):
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError("The onnx encoder needs onnxruntime and tokenizers (pip install onnxruntime)") from e
+        meta_path = os.path.join(path, 'meta.json')
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"No exported ONNX model at {path}, run `python encoders.py export` first")
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(path, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(max_length=self.meta['max_seq_length'])
+        self.tokenizer.enable_padding(pad_id=self.meta['pad_id'], pad_token=self.meta['pad_token'])
+        self.session = onnxruntime.InferenceSession(os.path.join(path, self.meta['file']),
+                                                    providers=['CPUExecutionProvider'])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def get_sentence_embedding_dimension(self):
+        return self.meta['dimension']
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, **kwargs):
+        """Pooled (not normalized) embeddings, like SentenceTransformer.encode with convert_to_numpy"""
+        if isinstance(texts, str):
+            texts = [texts]
+        out = np.zeros((len(texts), self.meta['dimension']), dtype='float32')
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch([str(t) for t in texts[start:start + batch_size]])
+            inputs = {
+                'input_ids': np.array([e.ids for e in encodings], dtype='int64'),
+                'attention_mask': np.array([e.attention_mask for e in encodings], dtype='int64'),
+                'token_type_ids': np.array([e.type_ids for e in encodings], dtype='int64'),
+            }
+            hidden = self.session.run(None, {name: inputs[name] for name in self.input_names})[0]
+            mask = inputs['attention_mask'][:, :, np.newaxis].astype('float32')
+            if self.meta['pooling'] == 'cls':
+                pooled = hidden[:, 0]
+            else:
+                pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            out[start:start + len(encodings)] = pooled
+        return out
+
+def encoder_version(backend, model=MODEL_NAME):
+    """Cache version for embeddings from a backend: quantized vectors differ slightly from torch ones"""
+    return model if backend == 'torch' else f"{model}+{backend}"
+
+def load_encoder(backend=None, path=ONNX_DIR):
+    """Return an object with SentenceTransformer's encode() for the chosen backend"""
+    backend = backend or ENCODER_BACKEND
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend {backend!r}, expected one of {ENCODER_BACKENDS}")
+    if backend == 'onnx':
+        return OnnxEncoder(path)
+    if backend == 'stub':
+        from benchmarks.stub_encoder import StubEncoder
+        return StubEncoder()
+    # Imported here: torch alone takes seconds to import
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(MODEL_NAME)
+
+# Encoder of the current ParallelEncoder worker process
+_worker_encoder = None
+
+def _init_worker(backend, threads=None):
+    global _worker_encoder
+    _worker_encoder = load_encoder(backend)
+    if threads and 'torch' in sys.modules:
+        # Split the cores between workers instead of every worker using all of them
+        sys.modules['torch'].set_num_threads(threads)
+
+def _worker_dimension():
+    return _worker_encoder.get_sentence_embedding_dimension()
+
+def _encode_batch(task):
+    batch_id, texts, batch_size = task
+    start = time.perf_counter()
+    embeddings = np.asarray(_worker_encoder.encode(texts, batch_size=batch_size, convert_to_numpy=True), dtype='float32')
+    return batch_id, embeddings, os.getpid(), time.perf_counter() - start
+
+def length_buckets(texts, batch_size):
+    """Positions of texts grouped into batches of similar length (longest first) to minimize padding.
+
+    Character length stands in for token count. The sort is stable, so the
+    batches only depend on the input.
+    """
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+class ParallelEncoder:
+    """Encode texts on a pool of worker processes, each holding its own copy of the model.
+
+    With workers=1 everything runs in this process. Either way texts are
+    length-bucketed, and every vector is written back to its input position,
+    so the output does not depend on which worker finishes first.
+    """
+
+    def __init__(self, backend=None, workers=1, batch_size=32):
+        self.workers = workers or os.cpu_count() or 1
+        self.batch_size = batch_size
+        self.pool = None
+        self.worker_stats = {}
+        if self.workers > 1:
+            # spawn: forking a parent that already imported torch is unsafe
+            context = multiprocessing.get_context('spawn')
+            threads = max(1, (os.cpu_count() or 1) // self.workers)
+            self.pool = context.Pool(self.workers, _init_worker, (backend, threads))
+        else:
+            _init_worker(backend)
+
+    def get_sentence_embedding_dimension(self):
+        if self.pool is not None:
+            return self.pool.apply(_worker_dimension)
+        return _worker_dimension()
+
+    def iter_encode(self, texts):
+        """Yield (positions, embeddings) per batch as batches complete; embeddings are not normalized"""
+        batches = length_buckets(texts, self.batch_size)
+        tasks = ((batch_id, [texts[i] for i in batch], self.batch_size) for batch_id, batch in enumerate(batches))
+        results = self.pool.imap_unordered(_encode_batch, tasks) if self.pool is not None else map(_encode_batch, tasks)
+        for batch_id, embeddings, pid, seconds in results:
+            stats = self.worker_stats.setdefault(pid, [0, 0.0])
+            stats[0] += len(batches[batch_id])
+            stats[1] += seconds
+            yield batches[batch_id], embeddings
+
+    def report(self):
+        """Print rows/sec per worker (time spent encoding, excluding idle time)"""
+        for i, (rows, seconds) in enumerate(sorted(self.worker_stats.values(), key=lambda s: -s[0])):
+            print(f"  worker {i}: {rows} rows in {seconds:.1f}s ({rows / seconds if seconds else 0.0:.1f} rows/sec)")
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+def export_onnx(path=ONNX_DIR, quantize=True, opset=ONNX_OPSET):
+    """Export the transformer of MODEL_NAME to ONNX, optionally with dynamic int8 weight quantization"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    print(f"Loading {MODEL_NAME}...")
+    model = SentenceTransformer(MODEL_NAME, device='cpu')
+    transformer, pooling = model[0], model[1]
+    tokenizer = transformer.tokenizer
+    if tokenizer.pad_token is None:
+        raise ValueError(f"{MODEL_NAME} has no padding token")
+
+    tmp_path = path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    sample = tokenizer(["an example search query"], return_tensors='pt')
+    # BertModel.forward takes these positionally in this order
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+    dynamic_axes = {name: {0: 'batch', 1: 'tokens'} for name in input_names + ['last_hidden_state']}
+    fp32_path = os.path.join(tmp_path, 'model.onnx')
+    print("Exporting ONNX graph...")
+    with torch.no_grad():
+        torch.onnx.export(transformer.auto_model.eval(), tuple(sample[name] for name in input_names), fp32_path,
+                          input_names=input_names, output_names=['last_hidden_state'],
+                          dynamic_axes=dynamic_axes, opset_version=opset)
+
+    file = 'model.onnx'
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        print("Quantizing weights to int8...")
+        quantize_dynamic(fp32_path, os.path.join(tmp_path, 'model_int8.onnx'), weight_type=QuantType.QInt8)
+        os.remove(fp32_path)
+        file = 'model_int8.onnx'
+
+    tokenizer.save_pretrained(tmp_path)
+    meta = {
+        'model': MODEL_NAME,
+        'file': file,
+        'quantized': quantize,
+        'dimension': model.get_sentence_embedding_dimension(),
+        'max_seq_length': model.max_seq_length,
+        'pooling': 'cls' if pooling.get_pooling_mode_str() == 'cls' else 'mean',
+        'pad_token': tokenizer.pad_token,
+        'pad_id': tokenizer.pad_token_id,
+    }
+    with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    size = os.path.getsize(os.path.join(path, file)) / 1024 / 1024
+    print(f"Saved {file} ({size:.1f} MB) to {path}")
+    return meta
+
+def normalized(embeddings):
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+def latency_ms(encoder, queries):
+    """p50/p99 single-query encode latency"""
+    encoder.encode(queries[:1])  # warm-up
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        encoder.encode([query])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {'p50_ms': float(np.percentile(latencies, 50)), 'p99_ms': float(np.percentile(latencies, 99))}
+
+def compare(backend='onnx', num_queries=200, k=10):
+    """Parity and latency of a backend against the torch encoder, on workflow names used as queries"""
+    from ann import exact_search, sample_rows
+    from artifacts import current_build
+    from snapshot import load_metadata
+    from search import EXAMPLE_QUERIES
+
+    _, paths = current_build()
+    embeddings = np.load(paths.embeddings, mmap_mode='r')
+    metadata = load_metadata(CSV_PATH, paths.metadata, len(embeddings), paths.workflow_json)
+    rows = sample_rows(len(metadata), max(num_queries - len(EXAMPLE_QUERIES), 0))
+    queries = list(EXAMPLE_QUERIES) + [str(metadata.get('workflow_name', int(row))) for row in rows]
+    k = min(k, len(embeddings))
+
+    reference, candidate = load_encoder('torch'), load_encoder(backend)
+    ref_emb = normalized(reference.encode(queries, convert_to_numpy=True)).astype('float32')
+    cand_emb = normalized(candidate.encode(queries, convert_to_numpy=True)).astype('float32')
+    cosine = (ref_emb * cand_emb).sum(axis=1)
+
+    _, ref_ids = exact_search(embeddings, ref_emb, k)
+    _, cand_ids = exact_search(embeddings, cand_emb, k)
+    overlap = [len(set(a) & set(b)) / k for a, b in zip(ref_ids.tolist(), cand_ids.tolist())]
+
+    report = {
+        'backend': backend,
+        'queries': len(queries),
+        'k': k,
+        'cosine_mean': float(cosine.mean()),
+        'cosine_min': float(cosine.min()),
+        'topk_overlap': float(np.mean(overlap)),
+        'torch': latency_ms(reference, queries),
+        backend: latency_ms(candidate, queries),
+    }
+    print(f"Parity over {len(queries)} queries: cosine mean {report['cosine_mean']:.4f}, "
+          f"min {report['cosine_min']:.4f}, top-{k} overlap {report['topk_overlap']:.3f}")
+    for name in ('torch', backend):
+        print(f"  {name:6s} encode p50 {report[name]['p50_ms']:.2f} ms, p99 {report[name]['p99_ms']:.2f} ms")
+    with open(os.path.join(ONNX_DIR, 'parity.json'), 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and check the ONNX query encoder")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export = subparsers.add_parser('export', help="export the model to ONNX (int8 by default)")
+    export.add_argument('--no-quantize', action='store_true', help="keep float32 weights")
+    export.add_argument('--opset', type=int, default=ONNX_OPSET)
+    check = subparsers.add_parser('compare', help="parity and latency against the torch encoder")
+    check.add_argument('--queries', type=int, default=200)
+    check.add_argument('-k', type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        export_onnx(quantize=not args.no_quantize, opset=args.opset)
+    else:
+        compare('onnx', args.queries, args.k)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,550 @@
+import numpy as np
+from snapshot import load_metadata
+from index_io import read_manifest, load_index, index_params
+from shards import ShardCoordinator
+from artifacts import RELOAD_INTERVAL, SwapGate, current_build, validate_build
+from query_cache import CACHE_SIZE, CACHE_TTL, LRUCache, QueryCache, normalize_query
+from batcher import MAX_BATCH, MAX_WAIT_MS, MicroBatcher
+from lexical import load_lexical_index, reciprocal_rank_fusion
+from workflow_features import load_feature_store, parse_filters, filter_key
+from duplicates import load_duplicate_groups
+from typeahead import SUGGEST_N, load_typeahead
+from ann import filtered_search, range_search, two_stage
+from encoders import ENCODER_BACKEND, encoder_version, load_encoder
+from metrics import REGISTRY, log_query, record_stages, stage, trace
+from search import BATCH_SIZE, EXAMPLE_QUERIES, SEARCH_MODES, print_results, score_label
+import atexit
+import os
+import threading
+
+# Paths (index artifacts are resolved per build, see artifacts.py)
+CSV_PATH = '../data/workflows.csv'
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+
+# Candidates taken from each retriever before fusion
+FUSION_DEPTH = 50
+
+# Rows ranked per query for pagination (doubled for deeper pages)
+PAGE_DEPTH = 100
+
+# Cap on the results of a score-threshold search
+RANGE_LIMIT = 1000
+
+# Most rows fetched per result before collapsing duplicates; fewer than k groups come back when
+# the top rows are all copies of a few workflows
+COLLAPSE_FETCH = 10
+
+class CSVSearchEngine:
+    def __init__(self, search_params=None, cache_size=CACHE_SIZE, cache_ttl=CACHE_TTL, cache_path=None,
+                 micro_batch=False, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS, mode=None,
+                 encoder=None, collapse=True, reload_interval=RELOAD_INTERVAL):
+        # Query-time overrides such as {'nprobe': 32}, {'ef_search': 128} or {'rescore': 20}
+        self.search_params = search_params
+        self.mode = mode
+        # Query encoder backend: 'torch' or 'onnx' (see encoders.py)
+        self.encoder = encoder or ENCODER_BACKEND
+        # Show one row per duplicate group (copies, "v2"s, identical texts) by default
+        self.collapse = collapse
+        self.cache = QueryCache(cache_size, cache_ttl, cache_path)
+        if cache_path:
+            atexit.register(self.cache.save)
+        # With micro_batch, concurrent find() calls from several threads are
+        # encoded and searched together as one batch
+        self.batcher = MicroBatcher(self.search_many, max_batch, max_wait_ms) if micro_batch else None
+        # Hot reload: new builds are swapped in between requests (0 disables watching)
+        self.reload_interval = reload_interval
+        self.gate = SwapGate()
+        self.reload_lock = threading.Lock()
+        self.rejected_builds = set()
+        self.stopped = threading.Event()
+        atexit.register(self.close)
+        self.load_data()
+    
+    def load_data(self):
+        """Load all necessary data and models"""
+        print("Loading search engine...")
+        
+        # Artifacts come from the published build (see artifacts.py)
+        build_id, paths = current_build()
+        
+        # Check if files exist
+        if not os.path.exists(CSV_PATH) and not os.path.exists(paths.metadata):
+            print(f"Error: CSV file not found at {CSV_PATH}")
+            return False
+            
+        if not os.path.exists(paths.manifest) and not os.path.exists(paths.index):
+            print(f"Error: FAISS index not found at {paths.index}")
+            print("Please run build_index.py first!")
+            return False
+        
+        try:
+            state = self.load_build(build_id, paths)
+        except ValueError as e:
+            print(f"Error: build {build_id} is inconsistent ({e}), please run build_index.py again")
+            return False
+        self.apply_build(state)
+        if self.mode is None:
+            self.mode = 'hybrid' if self.lexical is not None else 'semantic'
+        
+        # Load model
+        self.model = load_encoder(self.encoder)
+        
+        # Cached results are only valid for the index build and encoder they came from
+        self.set_cache_versions()
+        self.cache.load()
+        self.warm_cache()
+        
+        # Pick up builds published while we are running
+        if self.reload_interval:
+            self.watcher = threading.Thread(target=self.watch_builds, name='build-watcher', daemon=True)
+            self.watcher.start()
+        
+        print("Search engine loaded successfully!")
+        return True
+
+    def load_build(self, build_id, paths):
+        """Load one build's index and artifacts without touching the running engine"""
+        if build_id is not None:
+            # Published builds must agree on row counts and dimension before they are used
+            manifest = validate_build(paths)
+        else:
+            manifest = read_manifest(paths.manifest)
+        if getattr(self, 'manifest', None) and manifest.get('dimension') != self.manifest.get('dimension'):
+            raise ValueError(f"dimension {manifest.get('dimension')} does not match the loaded model "
+                             f"({self.manifest.get('dimension')}), restart to switch models")
+        state = {'build_id': build_id, 'paths': paths, 'manifest': manifest}
+        
+        if manifest.get('shards'):
+            # Sharded build: one worker process per shard, queried in parallel and merged exactly
+            index = ShardCoordinator(manifest['shards'], index_params(manifest, self.search_params),
+                                     paths.embeddings, paths.shards)
+        else:
+            # Load FAISS index (memory-mapped, shared between processes via the page cache)
+            index = load_index(paths.index, manifest, self.search_params)
+            if manifest.get('index', {}).get('type') == 'pca':
+                # Reduced-dimension first stage, candidates re-scored with the full vectors
+                state['_embeddings'] = np.load(paths.embeddings, mmap_mode='r')
+                index = two_stage(index, state['_embeddings'], index_params(manifest, self.search_params))
+        state['index'] = index
+        
+        # Load workflow metadata (binary snapshot, CSV as fallback)
+        state['metadata'] = load_metadata(CSV_PATH, paths.metadata, index.ntotal, paths.workflow_json)
+        
+        # Load BM25 index (optional, enables hybrid and keyword search)
+        state['lexical'] = load_lexical_index(paths.lexical)
+        if state['lexical'] is not None and len(state['lexical']) != index.ntotal:
+            print("BM25 index does not match the FAISS index, keyword search disabled")
+            state['lexical'] = None
+        
+        # Load pre-parsed workflow features (optional, enables filtered search)
+        state['features'] = load_feature_store(paths.features)
+        if state['features'] is not None and len(state['features']) != index.ntotal:
+            print("Workflow features do not match the FAISS index, filters disabled")
+            state['features'] = None
+        
+        # Load duplicate groups (optional, enables collapsing near-duplicate workflows)
+        state['duplicates'] = load_duplicate_groups(paths.duplicate_groups)
+        if state['duplicates'] is not None and len(state['duplicates']) != index.ntotal:
+            print("Duplicate groups do not match the FAISS index, duplicates are not collapsed")
+            state['duplicates'] = None
+        
+        # Load workflow-name completions (optional, enables suggest)
+        state['typeahead'] = load_typeahead(paths.typeahead)
+        if state['typeahead'] is not None and len(state['typeahead']) != index.ntotal:
+            print("Typeahead index does not match the FAISS index, suggestions disabled")
+            state['typeahead'] = None
+        state['masks'] = LRUCache(maxsize=64, ttl=None)
+        state.setdefault('_embeddings', None)
+        return state
+
+    def apply_build(self, state):
+        """Make a loaded build the one requests use"""
+        self.__dict__.update(state)
+        # Compact builds (float16 embeddings, sq8/sqfp16 index) load through the same calls:
+        # the .npy header and the FAISS file carry their own types
+        print(f"Loaded build {self.build_id or '(unversioned)'}: {self.storage_info()}")
+
+    def set_cache_versions(self):
+        model_version = encoder_version(self.encoder, self.manifest.get('model', MODEL_NAME))
+        self.cache.set_versions(model_version, (self.manifest.get('build_id'), model_version))
+
+    def reload(self):
+        """Swap in a newly published build; returns True if the engine switched builds.
+
+        The new build is loaded while requests keep running on the old one, then
+        swapped in between requests. Builds that fail validation are rejected
+        and the engine keeps serving the one it has.
+        """
+        build_id, paths = current_build()
+        if build_id is None or build_id == self.build_id or build_id in self.rejected_builds:
+            return False
+        with self.reload_lock:
+            if build_id == self.build_id:
+                return False
+            try:
+                state = self.load_build(build_id, paths)
+            except (ValueError, OSError, RuntimeError) as e:
+                print(f"Rejected build {build_id}: {e}")
+                self.rejected_builds.add(build_id)
+                REGISTRY.counter('search_reload_failures_total', "Published builds that were rejected").inc()
+                return False
+            old_index = self.index
+            
+            def swap():
+                self.apply_build(state)
+                self.set_cache_versions()
+            self.gate.swap(swap)
+            if isinstance(old_index, ShardCoordinator):
+                old_index.close()
+            REGISTRY.counter('search_reloads_total', "Builds swapped in while running").inc()
+        self.warm_cache()
+        return True
+
+    def watch_builds(self):
+        """Background thread: poll the CURRENT pointer and reload when it changes"""
+        while not self.stopped.wait(self.reload_interval):
+            try:
+                self.reload()
+            except Exception as e:
+                if not self.stopped.is_set():
+                    print(f"Build reload failed: {e!r}")
+
+    def close(self):
+        """Stop the build watcher and any shard workers"""
+        self.stopped.set()
+        if isinstance(getattr(self, 'index', None), ShardCoordinator):
+            self.index.close()
+
+    def warm_cache(self, queries=EXAMPLE_QUERIES, page_size=5):
+        """Pre-compute the example queries so the first clicks are cache hits.
+
+        Goes through find_page like the app, so the cached ranking has the
+        PAGE_DEPTH key the app's first page looks up.
+        """
+        for query in queries:
+            self.find_page(query, 0, page_size)
+
+    def storage_info(self):
+        """Index type and embedding storage type of the loaded build"""
+        index_type = self.manifest.get('index', {}).get('type', 'flat')
+        if self.manifest.get('shards'):
+            index_type = f"{len(self.manifest['shards'])}-shard {index_type}"
+        return f"{index_type} index ({self.index.ntotal} vectors), {self.manifest.get('embedding_dtype', 'float32')} embeddings"
+
+    @property
+    def embeddings(self):
+        """Stored vectors, memory-mapped on demand (search only needs the index)"""
+        if self._embeddings is None and os.path.exists(self.paths.embeddings):
+            self._embeddings = np.load(self.paths.embeddings, mmap_mode='r')
+        return self._embeddings
+
+    def filter_mask(self, filters):
+        """Boolean row mask for a filter dict (see FeatureStore), cached per filter"""
+        if self.features is None:
+            raise ValueError("Workflow features not found, please run build_index.py to enable filters")
+        key = filter_key(filters)
+        mask = self.masks.get(key)
+        if mask is None:
+            mask = self.features.mask(filters)
+            self.masks.put(key, mask)
+        return mask
+
+    def search_mask(self, filters):
+        """Row mask for a search, None without filters"""
+        return self.filter_mask(filters) if filters else None
+
+    def search_mode(self, mode=None):
+        """The mode a search actually runs in: mode (default: the engine's), or semantic without a BM25 index"""
+        mode = mode or self.mode
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode {mode!r}, expected one of {SEARCH_MODES}")
+        if mode != 'semantic' and self.lexical is None:
+            # No BM25 index built, fall back to embeddings only
+            return 'semantic'
+        return mode
+
+    def collapse_fetch(self, k):
+        """Rows to fetch for k duplicate groups: k times the largest group, capped at k * COLLAPSE_FETCH"""
+        max_size = self.manifest.get('duplicates', {}).get('max_size', COLLAPSE_FETCH)
+        return max(k, min(k * min(max_size, COLLAPSE_FETCH), self.index.ntotal))
+
+    def collapsed(self, search, k, collapse, fetched=None):
+        """Ranked (scores, ids) from search(n), keeping the best row of each duplicate group when collapsing.
+
+        Filters are applied by search, so every member of a group that passes
+        them can represent it. search runs once for collapse_fetch(k) rows;
+        fetched is the result of that search if it was already run.
+        """
+        if not collapse or self.duplicates is None:
+            return fetched if fetched is not None else search(k)
+        scores, ids = fetched if fetched is not None else search(self.collapse_fetch(k))
+        return self.duplicates.collapse(scores, ids, k)
+
+    def encode_query(self, query):
+        """Normalized query embedding, served from the cache when possible"""
+        key = normalize_query(query)
+        query_emb = self.cache.embeddings.get(key)
+        if query_emb is None:
+            with stage('encode'):
+                query_emb = self.model.encode([query])
+            query_emb = query_emb / np.linalg.norm(query_emb, axis=1, keepdims=True)
+            self.cache.embeddings.put(key, query_emb)
+        return query_emb
+
+    def encode_queries(self, queries, batch_size=BATCH_SIZE):
+        """Normalized embeddings for many queries; cache misses go through one batched encode"""
+        keys = [normalize_query(q) for q in queries]
+        cached = [self.cache.embeddings.get(key) for key in keys]
+        missing = [i for i, emb in enumerate(cached) if emb is None]
+        if missing:
+            with stage('encode'):
+                new_emb = self.model.encode([queries[i] for i in missing], batch_size=batch_size, convert_to_numpy=True)
+            new_emb = new_emb / np.linalg.norm(new_emb, axis=1, keepdims=True)
+            for i, emb in zip(missing, new_emb):
+                cached[i] = emb[np.newaxis]
+                self.cache.embeddings.put(keys[i], cached[i])
+        return np.vstack(cached).astype('float32')
+
+    def search_batch(self, queries, k=5, batch_size=BATCH_SIZE, mode=None, filters=None, collapse=None):
+        """Search many queries at once; returns one result list per query.
+
+        The dense side of every mode is one batched encode and one index.search
+        per batch; BM25 and fusion run per query, as in find().
+        """
+        with self.gate.request():
+            mode = self.search_mode(mode)
+            REGISTRY.counter('search_queries_total', "Queries searched", {'mode': mode}).inc(len(queries))
+            collapse = (self.collapse if collapse is None else collapse) and self.duplicates is not None
+            filters = parse_filters(filters)
+            mask = self.search_mask(filters)
+            fetch = self.collapse_fetch(k) if collapse else k
+            depth = fetch if mode == 'semantic' else max(fetch, FUSION_DEPTH)
+            results = []
+            for start in range(0, len(queries), batch_size):
+                batch = list(queries[start:start + batch_size])
+                lexical = [None] * len(batch)
+                if mode != 'semantic':
+                    with stage('lexical_search'):
+                        lexical = [self.lexical.search(query, depth, allowed=mask) for query in batch]
+                # Strong keyword matches skip the transformer, as in hybrid_search
+                dense = [i for i, lex in enumerate(lexical) if lex is None or (mode != 'keyword' and not lex[2])]
+                if dense:
+                    query_emb = self.encode_queries([batch[i] for i in dense], batch_size)
+                    
+                    # One index.search over the stacked query matrix
+                    with stage('index_search'):
+                        D, I = self.index_search(query_emb, depth, mask)
+                dense_rows = {i: j for j, i in enumerate(dense)}
+                
+                for i in range(len(batch)):
+                    j = dense_rows.get(i)
+                    if lexical[i] is None:
+                        ranked = D[j], I[j]
+                    else:
+                        lex_scores, lex_ids, _ = lexical[i]
+                        if j is None:
+                            ranked = lex_scores[:fetch], lex_ids[:fetch]
+                        else:
+                            ranked = reciprocal_rank_fusion([I[j], lex_ids], fetch)
+                    results.append(self.build_results(*self.collapsed(None, k, collapse, ranked)))
+            return results
+
+    def search_many(self, items):
+        """(scores, ids, stage timings) for a list of (query, k, mask) items, using one encode and one
+        index.search per distinct mask"""
+        results = [None] * len(items)
+        with trace() as batch_trace:
+            query_emb = self.encode_queries([query for query, _, _ in items])
+            # Queries sharing a mask object (the same cached filter mask) are searched together
+            by_mask = {}
+            for i, (_, _, mask) in enumerate(items):
+                by_mask.setdefault(id(mask), (mask, []))[1].append(i)
+            for mask, rows in by_mask.values():
+                k = max(items[i][1] for i in rows)
+                with stage('index_search'):
+                    D, I = self.index_search(query_emb[rows], k, mask)
+                for j, i in enumerate(rows):
+                    results[i] = (D[j, :items[i][1]], I[j, :items[i][1]])
+        # Every query in the batch waited for the whole batch
+        return [(D, I, batch_trace.stages) for D, I in results]
+
+    def dense_search(self, query, k, mask=None):
+        """Raw (scores, ids) from the embedding index, optionally restricted to a row mask"""
+        if self.batcher is not None:
+            # Joins whatever other queries arrive within the batching window
+            D, I, stages = self.batcher((query, k, mask))
+            record_stages(stages)
+            return D, I
+        
+        # Generate query embedding
+        query_emb = self.encode_query(query)
+        
+        # Search
+        with stage('index_search'):
+            D, I = self.index_search(query_emb, k, mask)
+        return D[0], I[0]
+
+    def index_search(self, query_emb, k, mask=None):
+        """(scores, ids) for a query matrix from the index or the shard coordinator"""
+        if isinstance(self.index, ShardCoordinator):
+            return self.index.search(query_emb, k, mask)
+        if mask is not None:
+            # The filter is applied inside FAISS with an IDSelector, so k results
+            # come back whenever at least k rows pass it
+            return filtered_search(self.index, query_emb, k, mask, self.embeddings)
+        return self.index.search(query_emb, k)
+
+    def hybrid_search(self, query, k, mode, mask=None):
+        """Raw (scores, ids) from BM25, fused with dense results unless the query is a strong keyword match"""
+        depth = max(k, FUSION_DEPTH)
+        with stage('lexical_search'):
+            lex_scores, lex_ids, strong = self.lexical.search(query, depth, allowed=mask)
+        if mode == 'keyword' or strong:
+            # Lexical-only fast path, the transformer is never called
+            return lex_scores[:k], lex_ids[:k]
+        _, dense_ids = self.dense_search(query, depth, mask)
+        return reciprocal_rank_fusion([dense_ids, lex_ids], k)
+
+    def find(self, query, k=5, mode=None, filters=None, collapse=None):
+        """Return the top-k workflows for a query as a list of dicts.
+
+        filters restricts results by pre-parsed workflow features, e.g.
+        {'node_types': ['HTTP Request', 'Gmail'], 'min_nodes': 5}. collapse
+        (default: the engine setting) returns one row per duplicate group.
+        """
+        return self.find_page(query, 0, k, mode, filters, collapse, depth=k)[0]
+
+    def find_page(self, query, page=0, page_size=10, mode=None, filters=None, collapse=None, depth=None):
+        """Return (results, more) for one page of the ranking; more is True if another page follows.
+
+        The ranking is computed once to `depth` rows (default: PAGE_DEPTH,
+        doubled until the page fits) and cached, so later pages are sliced
+        from it without encoding the query or searching again.
+        """
+        collapse = self.collapse if collapse is None else collapse
+        filters = parse_filters(filters)
+        start, stop = page * page_size, (page + 1) * page_size
+        if depth is None:
+            # One row past the page tells whether there is a next one
+            depth = PAGE_DEPTH
+            while depth < stop + 1:
+                depth *= 2
+        # The gate keeps a build swap from happening in the middle of this query
+        with self.gate.request(), trace() as query_trace:
+            try:
+                mode = self.search_mode(mode)
+                key = (normalize_query(query), depth, mode, filter_key(filters), collapse)
+                cached = self.cache.results.get(key)
+                hit = cached is not None
+                if cached is None:
+                    mask = self.search_mask(filters)
+                    if mode == 'semantic':
+                        search = lambda n: self.dense_search(query, n, mask)
+                    else:
+                        search = lambda n: self.hybrid_search(query, n, mode, mask)
+                    cached = self.collapsed(search, depth, collapse)
+                    self.cache.results.put(key, cached)
+                scores, ids = cached
+                results = self.build_results(scores[start:stop], ids[start:stop], start)
+                more = stop < len(ids) and ids[stop] >= 0
+            except Exception:
+                REGISTRY.counter('search_errors_total', "Queries that raised an error").inc()
+                raise
+            elapsed = query_trace.elapsed()
+
+        self.record_query(query_trace, elapsed, hit, mode, query=query, k=page_size, page=page, filters=filters,
+                          collapse=collapse, results=len(results))
+        return results, bool(more)
+
+    def find_threshold(self, query, threshold, limit=RANGE_LIMIT, filters=None, collapse=None):
+        """Return every workflow whose similarity to the query is above threshold, best first.
+
+        Semantic scores only (cosine similarity, -1..1), found with FAISS
+        range_search, so the number of results follows the query instead of a
+        fixed k. At most limit results are returned.
+        """
+        collapse = self.collapse if collapse is None else collapse
+        filters = parse_filters(filters)
+        with self.gate.request(), trace() as query_trace:
+            try:
+                key = ('range', normalize_query(query), float(threshold), limit, filter_key(filters), collapse)
+                cached = self.cache.results.get(key)
+                hit = cached is not None
+                if cached is None:
+                    mask = self.search_mask(filters)
+                    query_emb = self.encode_query(query)
+                    with stage('index_search'):
+                        cached = self.collapsed(lambda n: self.index_range_search(query_emb, threshold, n, mask),
+                                                limit, collapse)
+                    self.cache.results.put(key, cached)
+                results = self.build_results(*cached)
+            except Exception:
+                REGISTRY.counter('search_errors_total', "Queries that raised an error").inc()
+                raise
+            elapsed = query_trace.elapsed()
+
+        self.record_query(query_trace, elapsed, hit, 'threshold', query=query, threshold=threshold, limit=limit,
+                          filters=filters, collapse=collapse, results=len(results))
+        return results
+
+    def index_range_search(self, query_emb, threshold, limit, mask=None):
+        """(scores, ids) above threshold for one query from the index or the shard coordinator"""
+        if isinstance(self.index, ShardCoordinator):
+            return self.index.range_search(query_emb, threshold, limit, mask)
+        return range_search(self.index, query_emb, threshold, limit, mask, self.embeddings)
+
+    def record_query(self, query_trace, elapsed, hit, mode, **fields):
+        """Counters, latency histogram and query log line for one finished query"""
+        REGISTRY.counter('search_queries_total', "Queries searched", {'mode': mode}).inc()
+        REGISTRY.counter('search_cache_hits_total' if hit else 'search_cache_misses_total',
+                         "Result cache hits" if hit else "Result cache misses").inc()
+        REGISTRY.histogram('search_query_seconds', "End-to-end find() time", {'mode': mode}).observe(elapsed)
+        log_query(mode=mode, cache='hit' if hit else 'miss', total_ms=round(elapsed * 1000, 3),
+                  stages_ms={name: round(seconds * 1000, 3) for name, seconds in query_trace.stages.items()},
+                  **fields)
+
+    def suggest(self, prefix, n=SUGGEST_N):
+        """Workflow-name completions for a search box, most frequent first (no model involved)"""
+        if self.typeahead is None:
+            return []
+        with stage('suggest'):
+            return self.typeahead.suggest(prefix, n)
+
+    def build_results(self, scores, ids, offset=0):
+        """Look up metadata for the returned rows only; ranks start after offset"""
+        results = []
+        with stage('row_lookup'):
+            for i, idx in enumerate(ids):
+                if idx < 0:
+                    # FAISS pads with -1 when fewer than k vectors match
+                    break
+                results.append({
+                    'rank': offset + i + 1,
+                    'workflow_name': self.metadata.get('workflow_name', idx),
+                    'workflow_id': self.metadata.get('workflow_id', idx),
+                    'workflow_json': self.metadata.json_handle(idx),
+                    'score': float(scores[i]),
+                    'row': int(idx)
+                })
+                if self.duplicates is not None:
+                    # Other rows in the same duplicate group
+                    results[-1]['duplicates'] = self.duplicates.size(idx) - 1
+        return results
+
+    def search(self, query, k=5, mode=None, filters=None, collapse=None):
+        """Search for similar workflows"""
+        if not hasattr(self, 'model'):
+            print("Search engine not properly loaded!")
+            return
+            
+        results = self.find(query, k, mode, filters, collapse)
+        print_results(query, k, results, score_label(self.search_mode(mode)))
+
+def result_to_json(result, with_json=False):
+    """JSON-serializable copy of a result dict"""
+    record = {key: value for key, value in result.items() if key != 'workflow_json'}
+    record['workflow_id'] = str(record['workflow_id'])
+    if with_json:
+        record['workflow_json'] = result['workflow_json'].load()
+    return record
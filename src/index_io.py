@@ -0,0 +1,46 @@
+import faiss
+from ann import apply_search_params
+import json
+import os
+
+def read_index(path, mmap=True):
+    """Read a FAISS index, memory-mapping its vectors when the index type allows it.
+
+    A memory-mapped index lives in the OS page cache, so several worker processes
+    on one host share a single copy instead of each holding their own.
+    """
+    if mmap:
+        # IO_FLAG_MMAP_IFC (FAISS >= 1.9) extends mmap to flat and scalar-quantized codes, but
+        # IVF indexes reject it; those still mmap their inverted lists with the plain flags
+        attempts = [faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY]
+        if hasattr(faiss, 'IO_FLAG_MMAP_IFC'):
+            attempts.insert(0, attempts[0] | faiss.IO_FLAG_MMAP_IFC)
+        for flags in attempts:
+            try:
+                return faiss.read_index(path, flags)
+            except RuntimeError as e:
+                error = e
+        # Older FAISS builds cannot mmap every index type
+        print(f"Could not memory-map {path} ({error}), reading it into memory")
+    return faiss.read_index(path)
+
+def read_manifest(path):
+    """Return the build manifest written by build_index.py, or {} for older builds"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def load_index(path, manifest=None, search_params=None, mmap=True):
+    """Read whichever index type was built and apply its query-time parameters.
+
+    search_params (nprobe / ef_search) override the values stored in the manifest.
+    """
+    index = read_index(path, mmap=mmap)
+    return apply_search_params(index, index_params(manifest, search_params))
+
+def index_params(manifest=None, search_params=None):
+    """Query-time parameters stored in the manifest, with search_params overrides applied"""
+    params = dict((manifest or {}).get('index', {}).get('params') or {})
+    params.update({k: v for k, v in (search_params or {}).items() if v is not None})
+    return params
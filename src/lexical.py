@@ -0,0 +1,168 @@
+from collections import Counter
+import numpy as np
+import json
+import os
+import re
+import shutil
+from runs import PostingRuns
+from workflow_features import CAMEL_BOUNDARY, split_identifier
+
+# Paths
+LEXICAL_DIR = '../embeddings/lexical'
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Reciprocal-rank fusion constant
+RRF_K = 60
+
+# A query takes the lexical-only fast path when it has at most this many terms,
+# every term is in the vocabulary and at least k workflows contain all of them
+STRONG_MAX_TERMS = 3
+
+STOP_WORDS = {'a', 'an', 'and', 'the', 'of', 'to', 'for', 'in', 'on', 'with', 'by', 'from', 'or',
+              'n8n', 'nodes', 'base', 'api'}
+TOKEN = re.compile(r'[a-z0-9]+')
+
+def tokenize(text):
+    """Lowercase word tokens, with camelCase split ('GoogleSheets' -> google, sheets)"""
+    text = CAMEL_BOUNDARY.sub(' ', str(text))
+    return [t for t in TOKEN.findall(text.lower()) if t not in STOP_WORDS]
+
+def document_terms(workflow_name, features):
+    """Terms indexed for a workflow: its name plus node types and credential types
+    (features as returned by workflow_features.parse_workflow)"""
+    terms = tokenize(workflow_name)
+    for identifier in sorted(set(features['node_types']) | set(features['credentials'])):
+        terms.extend(tokenize(split_identifier(identifier)))
+    return terms
+
+class LexicalIndexWriter:
+    """Build a BM25 inverted index (CSR postings sorted by term, then row).
+
+    Postings are spilled to disk per chunk (see runs.PostingRuns); only the
+    vocabulary, which every engine loads anyway, and the per-row document
+    lengths stay in memory.
+    """
+
+    def __init__(self, path=LEXICAL_DIR):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self.runs = PostingRuns(os.path.join(self.tmp_path, 'runs'))
+        self.vocab = {}
+        self.doc_lengths = []
+        self.count = 0
+
+    def append(self, names, features_list):
+        terms, docs, tfs, lengths = [], [], [], []
+        for name, features in zip(names, features_list):
+            counts = Counter(document_terms(name, features))
+            for term, tf in counts.items():
+                terms.append(self.vocab.setdefault(term, len(self.vocab)))
+                docs.append(self.count)
+                tfs.append(tf)
+            lengths.append(sum(counts.values()))
+            self.count += 1
+        self.runs.append(terms, np.array(docs, dtype='int32'), np.minimum(tfs, 65535).astype('uint16'))
+        self.doc_lengths.append(np.array(lengths, dtype='int32'))
+
+    def close(self):
+        """Merge the postings by term and write the index"""
+        doc_lengths = np.concatenate(self.doc_lengths) if self.doc_lengths else np.zeros(0, dtype='int32')
+        offsets = self.runs.merge(len(self.vocab), [(os.path.join(self.tmp_path, 'docs.npy'), 'int32'),
+                                                    (os.path.join(self.tmp_path, 'tfs.npy'), 'uint16')])
+        np.save(os.path.join(self.tmp_path, 'offsets.npy'), offsets)
+        np.save(os.path.join(self.tmp_path, 'doc_lengths.npy'), doc_lengths)
+        vocab = sorted(self.vocab, key=self.vocab.get)
+        with open(os.path.join(self.tmp_path, 'vocab.json'), 'w', encoding='utf-8') as f:
+            json.dump(vocab, f, ensure_ascii=False)
+        meta = {
+            'count': self.count,
+            'terms': len(vocab),
+            'postings': int(offsets[-1]),
+            'avgdl': float(doc_lengths.mean()) if len(doc_lengths) else 0.0,
+        }
+        with open(os.path.join(self.tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self.tmp_path, self.path)
+        return meta
+
+class LexicalIndex:
+    """Memory-mapped BM25 index written by LexicalIndexWriter"""
+
+    def __init__(self, path=LEXICAL_DIR):
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        with open(os.path.join(path, 'vocab.json'), 'r', encoding='utf-8') as f:
+            self.vocab = {term: i for i, term in enumerate(json.load(f))}
+        self.count = self.meta['count']
+        self.avgdl = self.meta['avgdl'] or 1.0
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r')
+        self.docs = np.load(os.path.join(path, 'docs.npy'), mmap_mode='r')
+        self.tfs = np.load(os.path.join(path, 'tfs.npy'), mmap_mode='r')
+        self.doc_lengths = np.load(os.path.join(path, 'doc_lengths.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return self.count
+
+    def search(self, query, k=10, allowed=None):
+        """BM25 top-k for a query.
+
+        Returns (scores, ids, strong). strong is True when the query is a clean
+        keyword match: few terms, all known, and at least k workflows contain
+        every term. In that case only those workflows are returned. allowed is
+        an optional boolean row mask applied before ranking.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        known = [self.vocab[t] for t in terms if t in self.vocab]
+        if not known:
+            return np.zeros(0, dtype='float32'), np.zeros(0, dtype='int64'), False
+
+        doc_parts, score_parts = [], []
+        for term_id in known:
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = np.asarray(self.docs[start:end])
+            tfs = np.asarray(self.tfs[start:end], dtype='float32')
+            idf = np.log(1 + (self.count - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = K1 * (1 - B + B * np.asarray(self.doc_lengths[docs], dtype='float32') / self.avgdl)
+            doc_parts.append(docs)
+            score_parts.append(idf * tfs * (K1 + 1) / (tfs + norm))
+
+        ids, inverse = np.unique(np.concatenate(doc_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts)).astype('float32')
+        matched = np.bincount(inverse)
+        if allowed is not None:
+            keep = allowed[ids]
+            ids, scores, matched = ids[keep], scores[keep], matched[keep]
+
+        full = matched == len(terms)
+        strong = (len(known) == len(terms) and len(terms) <= STRONG_MAX_TERMS and int(full.sum()) >= k)
+        if strong:
+            ids, scores = ids[full], scores[full]
+
+        top = np.argsort(-scores, kind='stable')[:k]
+        return scores[top], ids[top].astype('int64'), strong
+
+def reciprocal_rank_fusion(rankings, k, rrf_k=RRF_K):
+    """Fuse ranked id lists: score(id) = sum over lists of 1 / (rrf_k + rank)"""
+    fused = {}
+    for ranking in rankings:
+        for rank, idx in enumerate(ranking):
+            idx = int(idx)
+            if idx < 0:
+                continue
+            fused[idx] = fused.get(idx, 0.0) + 1.0 / (rrf_k + rank + 1)
+    best = sorted(fused.items(), key=lambda item: (-item[1], item[0]))[:k]
+    return (np.array([score for _, score in best], dtype='float32'),
+            np.array([idx for idx, _ in best], dtype='int64'))
+
+def load_lexical_index(path=LEXICAL_DIR):
+    """Return the lexical index at path, or None if it has not been built"""
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        return None
+    return LexicalIndex(path)
@@ -0,0 +1,188 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+import json
+import logging
+import threading
+import time
+
+# Seconds; covers a cached lookup (<1 ms) up to a cold model encode
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Per-query log lines go to this logger at INFO; nothing is printed unless logging is configured
+QUERY_LOG = logging.getLogger('n8n_search.queries')
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}'
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+class Histogram:
+    """Cumulative-bucket histogram, as in the Prometheus exposition format"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q):
+        """Estimate a quantile by linear interpolation inside its bucket"""
+        with self.lock:
+            counts, total = list(self.counts), self.count
+        if not total:
+            return 0.0
+        target = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            if seen + count >= target and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (target - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+class Registry:
+    """Lightweight in-process metric registry: named counters and histograms with optional labels"""
+
+    def __init__(self):
+        self.metrics = {}
+        self.help = {}
+        self.lock = threading.Lock()
+
+    def _get(self, kind, name, help, labels, factory):
+        key = (name, tuple(sorted((labels or {}).items())))
+        metric = self.metrics.get(key)
+        if metric is None:
+            with self.lock:
+                metric = self.metrics.get(key)
+                if metric is None:
+                    metric = self.metrics[key] = factory()
+                    self.help.setdefault(name, (kind, help))
+        return metric
+
+    def counter(self, name, help='', labels=None):
+        return self._get('counter', name, help, labels, Counter)
+
+    def histogram(self, name, help='', labels=None, buckets=LATENCY_BUCKETS):
+        return self._get('histogram', name, help, labels, lambda: Histogram(buckets))
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        by_name = {}
+        for (name, labels), metric in sorted(self.metrics.items(), key=lambda item: item[0]):
+            by_name.setdefault(name, []).append((labels, metric))
+        for name, series in by_name.items():
+            kind, help = self.help[name]
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, metric in series:
+                if kind == 'counter':
+                    lines.append(f"{name}{format_labels(labels)} {metric.value}")
+                    continue
+                with metric.lock:
+                    counts, total, count = list(metric.counts), metric.sum, metric.count
+                cumulative = 0
+                for bound, bucket_count in zip(list(metric.buckets) + ['+Inf'], counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """Plain dict view for the app's debug panel: counters and histogram count/p50/p99/mean"""
+        counters, histograms = {}, {}
+        for (name, labels), metric in sorted(self.metrics.items(), key=lambda item: item[0]):
+            label = name + format_labels(labels)
+            if isinstance(metric, Counter):
+                counters[label] = metric.value
+            elif metric.count:
+                histograms[label] = {
+                    'count': metric.count,
+                    'p50_ms': metric.quantile(0.5) * 1000,
+                    'p99_ms': metric.quantile(0.99) * 1000,
+                    'mean_ms': metric.sum / metric.count * 1000,
+                }
+        return {'counters': counters, 'histograms': histograms}
+
+REGISTRY = Registry()
+
+class QueryTrace:
+    """Stage timings collected for one query on the current thread"""
+
+    def __init__(self):
+        self.stages = {}
+        self.start = time.perf_counter()
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+_local = threading.local()
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+@contextmanager
+def trace():
+    """Collect stage timings for the query running on this thread"""
+    previous = current_trace()
+    _local.trace = QueryTrace()
+    try:
+        yield _local.trace
+    finally:
+        _local.trace = previous
+
+def record_stages(stages):
+    """Add timings measured on another thread (e.g. the micro-batcher) to this thread's trace"""
+    query_trace = current_trace()
+    if query_trace is not None:
+        for stage, seconds in stages.items():
+            query_trace.add(stage, seconds)
+
+@contextmanager
+def stage(name, registry=REGISTRY):
+    """Time a hot-path stage into the search_stage_seconds histogram and the current trace"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        registry.histogram('search_stage_seconds', "Time spent per search stage",
+                           {'stage': name}).observe(seconds)
+        query_trace = current_trace()
+        if query_trace is not None:
+            query_trace.add(name, seconds)
+
+def log_query(**fields):
+    """One structured (JSON) log line per query"""
+    if QUERY_LOG.isEnabledFor(logging.INFO):
+        QUERY_LOG.info(json.dumps({'event': 'query', **fields}, ensure_ascii=False, default=str))
+
+def enable_query_log():
+    """Print per-query log lines to stderr"""
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    QUERY_LOG.addHandler(handler)
+    QUERY_LOG.setLevel(logging.INFO)
+    QUERY_LOG.propagate = False
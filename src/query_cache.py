@@ -0,0 +1,122 @@
+from collections import OrderedDict
+import os
+import pickle
+import threading
+import time
+
+# Paths
+CACHE_PATH = '../embeddings/query_cache.pkl'
+
+CACHE_SIZE = 1024
+CACHE_TTL = 3600  # seconds
+
+def normalize_query(query):
+    """Cache key for a query: case and whitespace do not change the embedding much"""
+    return ' '.join(str(query).lower().split())
+
+class LRUCache:
+    """Thread-safe LRU cache with a size limit, optional TTL and hit/miss counters.
+
+    Entries are tagged with a version; setting a different version drops them all.
+    """
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL, version=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.version = version
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached value or None"""
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is not None and self.ttl is not None and time.time() - entry[1] > self.ttl:
+                del self.items[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.items.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        with self.lock:
+            self.items[key] = (value, time.time())
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+
+    def set_version(self, version):
+        """Invalidate every entry if the version changed"""
+        with self.lock:
+            if version != self.version:
+                self.items.clear()
+                self.version = version
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self.items),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+    def state(self):
+        with self.lock:
+            return {'version': self.version, 'items': list(self.items.items())}
+
+    def restore(self, state):
+        """Load entries saved by state(), skipping them if the version is stale"""
+        if state.get('version') != self.version:
+            return
+        with self.lock:
+            for key, entry in state['items'][-self.maxsize:]:
+                self.items[key] = entry
+
+class QueryCache:
+    """Query-embedding cache (keyed by model) and top-k result cache (keyed by index build)"""
+
+    def __init__(self, maxsize=CACHE_SIZE, ttl=CACHE_TTL, path=None):
+        self.path = path
+        self.embeddings = LRUCache(maxsize, ttl)
+        self.results = LRUCache(maxsize, ttl)
+
+    def set_versions(self, model_version, index_version):
+        self.embeddings.set_version(model_version)
+        self.results.set_version(index_version)
+
+    def stats(self):
+        return {'embeddings': self.embeddings.stats(), 'results': self.results.stats()}
+
+    def load(self):
+        """Restore entries persisted by a previous process"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            print(f"Ignoring unreadable query cache {self.path}: {e}")
+            return
+        self.embeddings.restore(state.get('embeddings', {}))
+        self.results.restore(state.get('results', {}))
+
+    def save(self):
+        """Persist entries so they survive a restart"""
+        if not self.path:
+            return
+        state = {'embeddings': self.embeddings.state(), 'results': self.results.state()}
+        # Per-process temp file: several server workers may save at once
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(state, f)
+        os.replace(tmp_path, self.path)
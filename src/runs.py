@@ -0,0 +1,64 @@
+import numpy as np
+import os
+import shutil
+
+class PostingRuns:
+    """(key, row) postings spilled to disk one run per chunk, merged into CSR arrays at the end.
+
+    Streaming builds append one run per CSV chunk, in row order, so only the
+    current chunk's postings are ever in memory. merge() places each run's
+    postings after those of the earlier runs, which keeps every key's rows
+    sorted without a global sort.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        self.runs = 0
+        self.columns = 0
+
+    def append(self, keys, *columns):
+        """Save one run: int keys plus equally long value columns (row ids first)"""
+        np.save(os.path.join(self.path, f'{self.runs:05d}.keys.npy'), np.asarray(keys, dtype='int64'))
+        for i, values in enumerate(columns):
+            np.save(os.path.join(self.path, f'{self.runs:05d}.{i}.npy'), np.asarray(values))
+        self.columns = len(columns)
+        self.runs += 1
+
+    def keys(self, run, key_map=None):
+        keys = np.load(os.path.join(self.path, f'{run:05d}.keys.npy'))
+        return keys if key_map is None else np.asarray(key_map)[keys]
+
+    def merge(self, num_keys, outputs, key_map=None):
+        """Write each value column sorted by key to the .npy paths in outputs and return the offsets.
+
+        outputs holds one (path, dtype) per column; key_map renumbers the
+        appended keys. The output columns are memory-mapped, so memory stays at
+        one run plus the offsets.
+        """
+        counts = np.zeros(num_keys, dtype='int64')
+        for run in range(self.runs):
+            counts += np.bincount(self.keys(run, key_map), minlength=num_keys)
+        offsets = np.zeros(num_keys + 1, dtype='int64')
+        np.cumsum(counts, out=offsets[1:])
+
+        merged = [np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(int(offsets[-1]),))
+                  for path, dtype in outputs]
+        cursor = offsets[:-1].copy()
+        for run in range(self.runs):
+            keys = self.keys(run, key_map)
+            # Stable, so rows stay in append order within a key
+            order = np.argsort(keys, kind='stable')
+            keys = keys[order]
+            run_counts = np.bincount(keys, minlength=num_keys)
+            run_starts = np.cumsum(run_counts) - run_counts
+            positions = cursor[keys] + np.arange(len(keys)) - run_starts[keys]
+            for i, column in enumerate(merged):
+                column[positions] = np.load(os.path.join(self.path, f'{run:05d}.{i}.npy'))[order]
+            cursor += run_counts
+        for column in merged:
+            column.flush()
+        del merged
+        shutil.rmtree(self.path, ignore_errors=True)
+        return offsets
@@ -1,89 +1,172 @@
-import pandas as pd
-import numpy as np
-from sentence_transformers import SentenceTransformer
-import faiss
-import os
-
-# Paths
-CSV_PATH = '../data/workflows.csv'
-EMBEDDING_PATH = '../embeddings/workflow_embeddings.npy'
-INDEX_PATH = '../embeddings/faiss_index.index'
-
-class CSVSearchEngine:
-    def __init__(self):
-        self.load_data()
+import argparse
+import contextlib
+import json
+import sys
+import time
+
+# Heavy dependencies (numpy, faiss, torch) are only imported when the engine is
+# loaded in-process, so --query answered by the search daemon starts in milliseconds
+
+BATCH_SIZE = 256
+
+# semantic: dense embeddings only; keyword: BM25 only; hybrid: both, fused with
+# reciprocal-rank fusion (strong keyword matches skip the transformer)
+SEARCH_MODES = ['hybrid', 'semantic', 'keyword']
+
+# Shown in the CLI banner and the app sidebar, and pre-warmed in the query cache
+EXAMPLE_QUERIES = [
+    "email automation",
+    "data scraping",
+    "notifications",
+    "file backup",
+    "social media",
+    "payment processing"
+]
+
+def print_results(query, k, results, label="Similarity Score"):
+    """Print results (engine dicts or their JSON records) the way the CLI shows them"""
+    print(f"\nTop {k} results for: '{query}'")
+    print("-" * 50)
     
-    def load_data(self):
-        """Load all necessary data and models"""
-        print("Loading search engine...")
-        
-        # Check if files exist
-        if not os.path.exists(CSV_PATH):
-            print(f"Error: CSV file not found at {CSV_PATH}")
-            return False
-            
-        if not os.path.exists(EMBEDDING_PATH):
-            print(f"Error: Embeddings not found at {EMBEDDING_PATH}")
-            print("Please run build_index.py first!")
-            return False
-            
-        if not os.path.exists(INDEX_PATH):
-            print(f"Error: FAISS index not found at {INDEX_PATH}")
-            print("Please run build_index.py first!")
-            return False
-        
-        # Load CSV
-        self.df = pd.read_csv(CSV_PATH)
-        
-        # Load embeddings
-        self.embeddings = np.load(EMBEDDING_PATH)
-        
-        # Load FAISS index
-        self.index = faiss.read_index(INDEX_PATH)
-        
-        # Load model
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
-        
-        print("Search engine loaded successfully!")
-        return True
-
-    def search(self, query, k=5):
-        """Search for similar workflows"""
-        if not hasattr(self, 'model'):
-            print("Search engine not properly loaded!")
-            return
-            
-        # Generate query embedding
-        query_emb = self.model.encode([query])
-        query_emb = query_emb / np.linalg.norm(query_emb, axis=1, keepdims=True)
-        
-        # Search
-        D, I = self.index.search(query_emb, k)
-        
-        print(f"\nTop {k} results for: '{query}'")
-        print("-" * 50)
-        
-        for i, idx in enumerate(I[0]):
-            score = D[0][i]
-            workflow_name = self.df.iloc[idx]['workflow_name']
-            workflow_id = self.df.iloc[idx]['workflow_id']
-            print(f"{i+1}. {workflow_name}")
-            print(f"   Workflow ID: {workflow_id}")
-            print(f"   Similarity Score: {score:.4f}")
-            print()
+    for result in results:
+        print(f"{result['rank']}. {result['workflow_name']}")
+        print(f"   Workflow ID: {result['workflow_id']}")
+        print(f"   {label}: {result['score']:.4f}")
+        if result.get('duplicates'):
+            print(f"   Duplicates: {result['duplicates']}")
+        print()
+
+def score_label(mode):
+    # Cosine similarity for semantic search, fused rank score or BM25 otherwise
+    return "Similarity Score" if mode == 'semantic' else "Score"
+
+def iter_batches(lines, batch_size):
+    """Group non-empty stripped lines into lists of at most batch_size"""
+    batch = []
+    for line in lines:
+        query = line.strip()
+        if query:
+            batch.append(query)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def run_bulk(search_engine, source, output, k=5, batch_size=BATCH_SIZE, with_json=False, filters=None):
+    """Stream queries (one per line) from source and write one JSON line per query"""
+    from engine import result_to_json
+    count = 0
+    start = time.perf_counter()
+    for batch in iter_batches(source, batch_size):
+        for query, results in zip(batch, search_engine.search_batch(batch, k, batch_size, filters=filters)):
+            record = {'query': query, 'results': [result_to_json(r, with_json) for r in results]}
+            output.write(json.dumps(record, ensure_ascii=False) + '\n')
+        count += len(batch)
+    elapsed = time.perf_counter() - start
+    rate = count / elapsed if elapsed > 0 else 0.0
+    print(f"Searched {count} queries in {elapsed:.2f}s ({rate:.1f} queries/sec)", file=sys.stderr)
+    return count
+
+def print_query(args, records, mode):
+    """Output for a one-shot --query run"""
+    if args.json:
+        print(json.dumps({'query': args.query, 'k': args.k, 'results': records}, ensure_ascii=False))
+    else:
+        print_results(args.query, args.k, records, score_label(mode))
 
 def main():
-    # Initialize search engine
-    search_engine = CSVSearchEngine()
+    parser = argparse.ArgumentParser(description="Search workflows from the command line")
+    parser.add_argument('--nprobe', type=int, help="IVF cells visited per query (overrides the build setting)")
+    parser.add_argument('--rescore', type=int, help="pca index: candidates per result re-scored (overrides the build setting)")
+    parser.add_argument('--ef-search', type=int, help="HNSW search depth (overrides the build setting)")
+    parser.add_argument('--no-cache-file', action='store_true', help="do not persist the query cache across runs")
+    parser.add_argument('-k', type=int, default=5, help="results per query")
+    parser.add_argument('--mode', choices=SEARCH_MODES, help="retrieval mode (default: hybrid when the BM25 index exists)")
+    parser.add_argument('--batch', metavar='FILE', help="bulk mode: read queries from FILE (or '-' for stdin), one per line")
+    parser.add_argument('--output', metavar='FILE', help="bulk mode: write JSONL results to FILE instead of stdout")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="bulk mode: queries per encode/search call")
+    parser.add_argument('--with-json', action='store_true', help="bulk and --query modes: include workflow_json in the results")
+    parser.add_argument('--node-type', action='append', help="only workflows using this node type (repeatable), e.g. 'HTTP Request'")
+    parser.add_argument('--integration', action='append', help="only workflows using this service (repeatable), e.g. slack")
+    parser.add_argument('--trigger', help="only workflows started by this trigger, e.g. 'schedule trigger'")
+    parser.add_argument('--min-nodes', type=int, help="only workflows with at least this many nodes")
+    parser.add_argument('--max-nodes', type=int, help="only workflows with at most this many nodes")
+    parser.add_argument('--no-collapse', action='store_true', help="show every copy of duplicated workflows")
+    parser.add_argument('--encoder', help="query encoder backend: torch or onnx (default: $ENCODER_BACKEND or torch)")
+    parser.add_argument('--query-log', action='store_true', help="log one JSON line per query with stage timings to stderr")
+    parser.add_argument('--query', help="search once and exit (answered by the search daemon when it is running)")
+    parser.add_argument('--json', action='store_true', help="with --query: print the results as JSON")
+    parser.add_argument('--no-daemon', action='store_true', help="with --query: always load the engine in-process")
+    parser.add_argument('--suggest', metavar='PREFIX', help="print -k workflow-name completions and exit (no model is loaded)")
+    args = parser.parse_args()
+    filters = {'node_types': args.node_type, 'integrations': args.integration, 'trigger': args.trigger,
+               'min_nodes': args.min_nodes, 'max_nodes': args.max_nodes}
+
+    if args.suggest is not None:
+        # Reads only the memory-mapped typeahead index of the published build
+        from artifacts import current_build
+        from typeahead import load_typeahead
+        typeahead = load_typeahead(current_build()[1].typeahead)
+        if typeahead is None:
+            sys.exit("Error: typeahead index not found, please run build_index.py")
+        suggestions = typeahead.suggest(args.suggest, args.k)
+        if args.json:
+            print(json.dumps(suggestions, ensure_ascii=False))
+        else:
+            for suggestion in suggestions:
+                print(f"{suggestion['workflow_name']}  ({suggestion['count']})")
+        return
+
+    # Query-time index and encoder overrides only apply to an engine loaded here
+    overrides = (args.nprobe, args.ef_search, args.rescore, args.encoder)
+    if args.query and not args.no_daemon and all(value is None for value in overrides):
+        from daemon import request
+        reply = request({'op': 'search', 'query': args.query, 'k': args.k, 'mode': args.mode,
+                         'filters': filters, 'collapse': not args.no_collapse, 'with_json': args.with_json})
+        if reply is not None:
+            if not reply['ok']:
+                sys.exit(f"Error: {reply['error']}")
+            print_query(args, reply['results'], reply['mode'])
+            return
+
+    from engine import CSVSearchEngine, result_to_json
+    from query_cache import CACHE_PATH
+    from metrics import enable_query_log
+    if args.query_log:
+        enable_query_log()
+
+    # Initialize search engine (progress goes to stderr in bulk/JSON mode so stdout stays valid JSON)
+    with contextlib.redirect_stdout(sys.stderr if args.batch or args.json else sys.stdout):
+        search_engine = CSVSearchEngine(search_params={'nprobe': args.nprobe, 'ef_search': args.ef_search,
+                                                       'rescore': args.rescore},
+                                        cache_path=None if args.no_cache_file else CACHE_PATH,
+                                        mode=args.mode, encoder=args.encoder, collapse=not args.no_collapse)
     
     if not hasattr(search_engine, 'model'):
         return
+
+    if args.query:
+        results = search_engine.find(args.query, args.k, args.mode, filters)
+        print_query(args, [result_to_json(r, args.with_json) for r in results], search_engine.search_mode(args.mode))
+        return
+
+    if args.batch:
+        source = sys.stdin if args.batch == '-' else open(args.batch, 'r', encoding='utf-8')
+        output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+        with contextlib.ExitStack() as stack:
+            if source is not sys.stdin:
+                stack.enter_context(source)
+            if output is not sys.stdout:
+                stack.enter_context(output)
+            run_bulk(search_engine, source, output, args.k, args.batch_size, args.with_json, filters)
+        return
     
     print("\n" + "="*60)
     print("CSV SEARCH ENGINE - CLI Interface")
     print("="*60)
     print("Type your search queries below. Type 'exit' to quit.")
-    print("Example queries: 'email automation', 'data scraping', 'notifications'")
+    print("Example queries: " + ", ".join(f"'{q}'" for q in EXAMPLE_QUERIES[:3]))
     print("-"*60)
     
     while True:
@@ -98,7 +181,7 @@ def main():
                 print("Please enter a search query.")
                 continue
                 
-            search_engine.search(query)
+            search_engine.search(query, args.k, filters=filters)
             
         except KeyboardInterrupt:
             print("\nGoodbye!")
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Headless JSON search API for n8n workflows and other automation clients.
+
+Runs next to the Streamlit app on the same engine and artifacts. Requests are
+handled on an asyncio event loop while encoding and FAISS searches run in a
+thread pool, so slow queries never block other connections. With --workers N
+several processes bind the same port (SO_REUSEPORT) and share the
+memory-mapped index through the OS page cache.
+
+Endpoints:
+    GET  /health              row count and the build being served
+    GET  /stats               query cache and micro-batching counters
+    GET  /metrics             Prometheus text format: per-stage latency histograms and counters
+    GET  /search?q=...&k=5[&mode=hybrid][&with_json=1][&collapse=0][&node_types=gmail,slack][&trigger=...][&min_nodes=5]
+    POST /search              {"query": "...", "k": 5, "mode": "hybrid", "with_json": false, "filters": {...}}
+    POST /search/batch        {"queries": ["...", ...], "k": 5, "mode": "semantic", "with_json": false, "filters": {...}}
+
+Filters take node_types and integrations (lists), trigger, min_nodes and max_nodes.
+Duplicate workflows are collapsed to one result unless collapse is false.
+    GET  /suggest?q=...&n=10  workflow-name completions for typeahead, most frequent first
+    GET  /workflows/<id>[?with_json=0]
+    GET  /workflows/<id>/json  the raw workflow_json, streamed in chunks as it is decompressed
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from search import SEARCH_MODES
+from engine import CSVSearchEngine, result_to_json
+from query_cache import CACHE_PATH
+from batcher import MAX_BATCH, MAX_WAIT_MS
+from encoders import ENCODER_BACKENDS
+from metrics import REGISTRY, enable_query_log
+from typeahead import SUGGEST_N
+
+HOST = '0.0.0.0'
+PORT = 8502
+MAX_BODY_BYTES = 10 * 1024 * 1024
+MAX_BATCH_QUERIES = 10000
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+class Stream:
+    """Route result sent with chunked transfer encoding, one chunk per item of an iterator"""
+
+    def __init__(self, chunks, content_type):
+        self.chunks = chunks
+        self.content_type = content_type
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+def parse_flag(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def parse_mode(value):
+    if value is not None and value not in SEARCH_MODES:
+        raise HTTPError(400, f"mode must be one of {SEARCH_MODES}")
+    return value
+
+def parse_k(value):
+    try:
+        k = int(value)
+    except (TypeError, ValueError):
+        raise HTTPError(400, "k must be an integer")
+    if k < 1:
+        raise HTTPError(400, "k must be at least 1")
+    return k
+
+FILTER_LISTS = ('node_types', 'integrations')
+FILTER_INTS = ('min_nodes', 'max_nodes')
+
+def parse_filters(params):
+    """Filter dict from a POST "filters" object or GET params (lists comma-separated)"""
+    filters = params.get('filters')
+    if filters is None:
+        filters = {key: params[key] for key in FILTER_LISTS + FILTER_INTS + ('trigger',) if key in params}
+        for key in FILTER_LISTS:
+            if key in filters:
+                filters[key] = [value for value in filters[key].split(',') if value.strip()]
+    if not isinstance(filters, dict):
+        raise HTTPError(400, "filters must be a JSON object")
+    for key in FILTER_LISTS:
+        if isinstance(filters.get(key), str):
+            filters[key] = [filters[key]]
+    for key in FILTER_INTS:
+        if filters.get(key) is not None:
+            try:
+                filters[key] = int(filters[key])
+            except (TypeError, ValueError):
+                raise HTTPError(400, f"{key} must be an integer")
+    return filters
+
+class SearchServer:
+    def __init__(self, engine, threads=4):
+        self.engine = engine
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+
+    async def run_blocking(self, fn, *args):
+        """Run engine work off the event loop"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def row_for_id(self, workflow_id):
+        """Look up a row by workflow_id in the loaded build; call inside engine.gate.request().
+
+        A binary search over the snapshot's memory-mapped id index, so nothing
+        is built per worker or per swapped-in build.
+        """
+        return self.engine.metadata.find_id(workflow_id)
+
+    def fetch_workflow(self, workflow_id, with_json):
+        with self.engine.gate.request():
+            row = self.row_for_id(workflow_id)
+            if row is None:
+                return None
+            record = {'workflow_id': workflow_id,
+                      'workflow_name': self.engine.metadata.get('workflow_name', row),
+                      'row': row}
+            if with_json:
+                record['workflow_json'] = self.engine.metadata.get_json(row)
+            return record
+
+    def workflow_json_stream(self, workflow_id):
+        """Chunks of a workflow's JSON, or None; the stream keeps reading the build it was opened on"""
+        with self.engine.gate.request():
+            row = self.row_for_id(workflow_id)
+            if row is None:
+                return None
+            return self.engine.metadata.json_stream(row)
+
+    def search(self, query, k, mode, with_json, filters, collapse):
+        return [result_to_json(r, with_json) for r in self.engine.find(query, k, mode, filters, collapse)]
+
+    def search_batch(self, queries, k, mode, with_json, filters, collapse):
+        return [[result_to_json(r, with_json) for r in results]
+                for results in self.engine.search_batch(queries, k, mode=mode, filters=filters, collapse=collapse)]
+
+    async def route(self, method, target, body):
+        url = urlsplit(target)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        path = url.path.rstrip('/') or '/'
+
+        if path == '/health':
+            return {'status': 'ok', 'workflows': len(self.engine.metadata), 'build': self.engine.build_id}
+
+        if path == '/stats':
+            stats = {'cache': self.engine.cache.stats()}
+            if self.engine.batcher is not None:
+                stats['batcher'] = self.engine.batcher.stats()
+            return stats
+
+        if path == '/metrics':
+            # A str payload is sent as text/plain
+            return REGISTRY.render()
+
+        if path == '/suggest':
+            # Memory-mapped lookups well under a millisecond, answered on the event loop
+            prefix = params.get('q', '')
+            n = parse_k(params.get('n', SUGGEST_N))
+            return {'query': prefix, 'suggestions': self.engine.suggest(prefix, n)}
+
+        if path == '/search':
+            if method == 'POST':
+                params = self.parse_body(body)
+            elif method != 'GET':
+                raise HTTPError(405, "use GET or POST")
+            query = params.get('query', params.get('q'))
+            if not query or not isinstance(query, str):
+                raise HTTPError(400, "missing query")
+            k = parse_k(params.get('k', 5))
+            mode = parse_mode(params.get('mode'))
+            results = await self.run_blocking(self.search, query, k, mode, parse_flag(params.get('with_json', False)),
+                                              parse_filters(params), parse_flag(params.get('collapse', True)))
+            return {'query': query, 'k': k, 'results': results}
+
+        if path == '/search/batch':
+            if method != 'POST':
+                raise HTTPError(405, "use POST")
+            params = self.parse_body(body)
+            queries = params.get('queries')
+            if not isinstance(queries, list) or not all(isinstance(q, str) and q.strip() for q in queries):
+                raise HTTPError(400, "queries must be a list of non-empty strings")
+            if len(queries) > MAX_BATCH_QUERIES:
+                raise HTTPError(413, f"at most {MAX_BATCH_QUERIES} queries per batch")
+            k = parse_k(params.get('k', 5))
+            mode = parse_mode(params.get('mode'))
+            results = await self.run_blocking(self.search_batch, queries, k, mode,
+                                              parse_flag(params.get('with_json', False)), parse_filters(params),
+                                              parse_flag(params.get('collapse', True)))
+            return {'k': k, 'results': [{'query': q, 'results': r} for q, r in zip(queries, results)]}
+
+        if path.startswith('/workflows/') and path.endswith('/json'):
+            if method != 'GET':
+                raise HTTPError(405, "use GET")
+            workflow_id = unquote(path[len('/workflows/'):-len('/json')])
+            chunks = await self.run_blocking(self.workflow_json_stream, workflow_id)
+            if chunks is None:
+                raise HTTPError(404, f"workflow {workflow_id!r} not found")
+            return Stream(chunks, 'application/json; charset=utf-8')
+
+        if path.startswith('/workflows/'):
+            if method != 'GET':
+                raise HTTPError(405, "use GET")
+            workflow_id = unquote(path[len('/workflows/'):])
+            record = await self.run_blocking(self.fetch_workflow, workflow_id, parse_flag(params.get('with_json', True)))
+            if record is None:
+                raise HTTPError(404, f"workflow {workflow_id!r} not found")
+            return record
+
+        raise HTTPError(404, f"no route for {path}")
+
+    def parse_body(self, body):
+        try:
+            params = json.loads(body or b'{}')
+        except ValueError:
+            raise HTTPError(400, "body must be JSON")
+        if not isinstance(params, dict):
+            raise HTTPError(400, "body must be a JSON object")
+        return params
+
+    async def handle(self, reader, writer):
+        """Serve HTTP/1.1 requests on one connection (keep-alive supported)"""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self.respond(writer, 400, {'error': "malformed request line"}, keep_alive=False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = (version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close')
+                length = int(headers.get('content-length') or 0)
+                if length > MAX_BODY_BYTES:
+                    await self.respond(writer, 413, {'error': "request body too large"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                try:
+                    status, payload = 200, await self.route(method.upper(), target, body)
+                except HTTPError as e:
+                    status, payload = e.status, {'error': e.message}
+                except ValueError as e:
+                    status, payload = 400, {'error': str(e)}
+                except Exception as e:
+                    status, payload = 500, {'error': str(e)}
+                if isinstance(payload, Stream):
+                    await self.respond_stream(writer, payload, keep_alive)
+                else:
+                    await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive=True):
+        if isinstance(payload, str):
+            body, content_type = payload.encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            body, content_type = json.dumps(payload, ensure_ascii=False).encode('utf-8'), 'application/json; charset=utf-8'
+        head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    async def respond_stream(self, writer, stream, keep_alive=True):
+        head = (f"HTTP/1.1 200 OK\r\n"
+                f"Content-Type: {stream.content_type}\r\n"
+                f"Transfer-Encoding: chunked\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1'))
+        while True:
+            # Decompression runs in the thread pool, one chunk at a time
+            chunk = await self.run_blocking(next, stream.chunks, None)
+            if chunk is None:
+                break
+            if not chunk:
+                continue
+            writer.write(f"{len(chunk):x}\r\n".encode('latin-1') + chunk + b"\r\n")
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+async def serve(host, port, threads, reuse_port, max_batch, max_wait_ms, encoder=None):
+    # Concurrent /search requests from the thread pool are micro-batched
+    engine = CSVSearchEngine(cache_path=CACHE_PATH, micro_batch=max_batch > 1,
+                             max_batch=max_batch, max_wait_ms=max_wait_ms, encoder=encoder)
+    if not hasattr(engine, 'model'):
+        sys.exit(1)
+    app = SearchServer(engine, threads)
+    server = await asyncio.start_server(app.handle, host, port, reuse_port=reuse_port or None)
+    print(f"Search API listening on http://{host}:{port} (pid {os.getpid()})")
+    async with server:
+        await server.serve_forever()
+
+def run_worker(host, port, threads, reuse_port, max_batch, max_wait_ms, encoder=None):
+    try:
+        asyncio.run(serve(host, port, threads, reuse_port, max_batch, max_wait_ms, encoder))
+    except KeyboardInterrupt:
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless JSON search API")
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--threads', type=int, default=16, help="encode/search threads per worker")
+    parser.add_argument('--max-batch', type=int, default=MAX_BATCH, help="queries per micro-batch (1 disables batching)")
+    parser.add_argument('--max-wait-ms', type=float, default=MAX_WAIT_MS, help="how long a micro-batch waits to fill up")
+    parser.add_argument('--encoder', choices=ENCODER_BACKENDS, help="query encoder backend (default: $ENCODER_BACKEND or torch)")
+    parser.add_argument('--no-query-log', action='store_true', help="do not log one JSON line per query to stderr")
+    parser.add_argument('--workers', type=int, default=1, help="worker processes sharing the port (needs SO_REUSEPORT)")
+    args = parser.parse_args()
+    if not args.no_query_log:
+        enable_query_log()
+
+    if args.workers <= 1:
+        run_worker(args.host, args.port, args.threads, False, args.max_batch, args.max_wait_ms, args.encoder)
+        return
+
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        print("Multiple workers need SO_REUSEPORT, which this platform lacks; starting one worker")
+        run_worker(args.host, args.port, args.threads, False, args.max_batch, args.max_wait_ms, args.encoder)
+        return
+
+    workers = [multiprocessing.Process(target=run_worker, args=(args.host, args.port, args.threads, True,
+                                                                     args.max_batch, args.max_wait_ms, args.encoder))
+               for _ in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+
+if __name__ == "__main__":
+    main()
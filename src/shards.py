@@ -0,0 +1,152 @@
+import numpy as np
+import faiss
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+from ann import create_index, fill_index, filtered_search, range_search, to_global_ids, top_range, two_stage
+from index_io import load_index
+from metrics import REGISTRY
+
+# Paths
+SHARDS_DIR = '../embeddings/shards'
+
+def build_shards(embeddings, num_shards, index_type, params, shard_dir=SHARDS_DIR):
+    """Split rows into contiguous shards and write one index plus its global ids per shard.
+
+    Returns the shard list stored in the manifest. Contiguous ranges keep each
+    shard a plain slice of the (memory-mapped) embeddings while it is filled.
+    """
+    if os.path.exists(shard_dir):
+        shutil.rmtree(shard_dir)
+    os.makedirs(shard_dir)
+    num_shards = max(1, min(num_shards, len(embeddings)))
+    bounds = np.linspace(0, len(embeddings), num_shards + 1).astype('int64')
+    shards = []
+    for i, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:])):
+        name = f"shard-{i:03d}"
+        index = create_index(index_type, embeddings.shape[1], params)
+        fill_index(index, embeddings[start:stop])
+        faiss.write_index(index, os.path.join(shard_dir, name + '.index'))
+        np.save(os.path.join(shard_dir, name + '.ids.npy'), np.arange(start, stop, dtype='int64'))
+        shards.append({'index': name + '.index', 'ids': name + '.ids.npy', 'count': int(stop - start)})
+        print(f"  {name}: rows {start}-{stop}")
+    return shards
+
+def shard_bytes(shards, shard_dir=SHARDS_DIR):
+    """Bytes on disk of all shard indexes and id maps"""
+    return sum(os.path.getsize(os.path.join(shard_dir, shard[key])) for shard in shards for key in ('index', 'ids'))
+
+def _shard_worker(conn, shard_dir, shard, params, embedding_path):
+    """Serve searches over one shard: (queries, k, packed mask or None, threshold) -> (scores, global ids, seconds).
+
+    With a threshold the message is a range search for one query and k caps the hits.
+    """
+    index = load_index(os.path.join(shard_dir, shard['index']), search_params=params)
+    ids = np.load(os.path.join(shard_dir, shard['ids']), mmap_mode='r')
+    embeddings = np.load(embedding_path, mmap_mode='r') if embedding_path and os.path.exists(embedding_path) else None
+    if embeddings is not None:
+        index = two_stage(index, embeddings, params, ids)
+    conn.send((index.d, index.ntotal))
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        queries, k, packed, threshold = message
+        start = time.perf_counter()
+        try:
+            if threshold is not None:
+                mask = None if packed is None else np.unpackbits(packed, count=len(ids), bitorder='little').astype(bool)
+                D, I = range_search(index, queries, threshold, k, mask, embeddings, ids)
+            elif packed is None:
+                D, I = index.search(queries, k)
+                I = to_global_ids(I, ids)
+            else:
+                mask = np.unpackbits(packed, count=len(ids), bitorder='little').astype(bool)
+                D, I = filtered_search(index, queries, k, mask, embeddings, ids)
+            conn.send((D, I, time.perf_counter() - start))
+        except Exception as e:
+            conn.send(e)
+    conn.close()
+
+def merge_topk(results, k):
+    """Exact global top-k from per-shard top-k lists; equal scores are ordered by row id"""
+    D = np.concatenate([scores for scores, _ in results], axis=1)
+    I = np.concatenate([ids for _, ids in results], axis=1)
+    # Padding (-1 ids) must never outrank a real hit
+    D = np.where(I >= 0, D, -np.inf).astype('float32')
+    order = np.stack([np.lexsort((ids, -scores)) for scores, ids in zip(D, I)])[:, :k]
+    return np.take_along_axis(D, order, axis=1), np.take_along_axis(I, order, axis=1)
+
+class ShardCoordinator:
+    """Scatter-gather search over index shards, one worker process per shard.
+
+    Local worker processes stand in for remote shard servers: each loads (and
+    memory-maps) only its own shard, every query is sent to all shards at once
+    and their top-k lists are merged exactly, so a search takes as long as the
+    slowest shard. Exposes the parts of the FAISS index API the engine uses
+    (search, ntotal, d); search also takes a global row mask for filtering.
+    """
+
+    def __init__(self, shards, params=None, embedding_path=None, shard_dir=SHARDS_DIR):
+        context = multiprocessing.get_context('spawn')
+        self.shards = shards
+        self.conns, self.processes = [], []
+        # One scatter-gather round at a time on the pipes; the shards themselves run in parallel
+        self.lock = threading.Lock()
+        for shard in shards:
+            parent, child = context.Pipe()
+            process = context.Process(target=_shard_worker, daemon=True, name=shard['index'],
+                                      args=(child, shard_dir, shard, params, embedding_path))
+            process.start()
+            self.conns.append(parent)
+            self.processes.append(process)
+        ready = [conn.recv() for conn in self.conns]
+        self.d = ready[0][0]
+        self.ntotal = sum(ntotal for _, ntotal in ready)
+        self.shard_ids = [np.load(os.path.join(shard_dir, shard['ids']), mmap_mode='r') for shard in shards]
+
+    def __len__(self):
+        return len(self.shards)
+
+    def search(self, queries, k, mask=None):
+        """Global (scores, ids) for a query matrix, optionally restricted to rows where mask is True"""
+        return merge_topk(self.scatter(queries, k, mask), k)
+
+    def range_search(self, query, threshold, limit, mask=None):
+        """Global (scores, ids) of all rows scoring above threshold for one query, best first, capped at limit"""
+        results = self.scatter(query, limit, mask, threshold)
+        return top_range(np.concatenate([D for D, _ in results]), np.concatenate([I for _, I in results]), limit)
+
+    def scatter(self, queries, k, mask=None, threshold=None):
+        """Send one search to every shard at once and collect their (scores, global ids)"""
+        queries = np.ascontiguousarray(queries, dtype='float32')
+        messages = []
+        for ids in self.shard_ids:
+            packed = None if mask is None else np.packbits(mask[ids], bitorder='little')
+            messages.append((queries, k, packed, threshold))
+
+        with self.lock:
+            for conn, message in zip(self.conns, messages):
+                conn.send(message)
+            replies = [conn.recv() for conn in self.conns]
+
+        results = []
+        for i, reply in enumerate(replies):
+            if isinstance(reply, Exception):
+                raise RuntimeError(f"shard {i} failed: {reply}")
+            D, I, seconds = reply
+            REGISTRY.histogram('search_shard_seconds', "Index search time per shard", {'shard': i}).observe(seconds)
+            results.append((D, I))
+        return results
+
+    def close(self):
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+        self.conns, self.processes = [], []
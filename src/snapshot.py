@@ -0,0 +1,229 @@
+import pandas as pd
+import numpy as np
+import hashlib
+import json
+import os
+import shutil
+from blobstore import BLOB_STORE_DIR, load_blob_store
+
+# Paths
+SNAPSHOT_DIR = '../embeddings/metadata'
+
+# workflow_json lives in the compressed blob store, see blobstore.py
+COLUMNS = ['workflow_id', 'workflow_name']
+
+# Column rows can be looked up by (see MetadataSnapshot.find_id)
+ID_COLUMN = 'workflow_id'
+
+def id_hashes(values):
+    """64-bit hashes of id strings, the sort key of the snapshot's id index"""
+    digests = b''.join(hashlib.blake2b(v.encode('utf-8'), digest_size=8).digest() for v in values)
+    return np.frombuffer(digests, dtype='<u8')
+
+class WorkflowJSON:
+    """Handle to a row's workflow_json; the payload is fetched on load()"""
+
+    def __init__(self, metadata, row):
+        self.metadata = metadata
+        self.row = row
+
+    def load(self, limit=None):
+        """The payload, or only its first limit bytes"""
+        return self.metadata.get_json(self.row, limit)
+
+    def stream(self):
+        """The payload as UTF-8 byte chunks, for downloads of any size"""
+        return self.metadata.json_stream(self.row)
+
+    def size(self):
+        """Payload size in bytes, without decompressing it"""
+        return self.metadata.json_size(self.row)
+
+    def __repr__(self):
+        return f"WorkflowJSON(row={self.row})"
+
+class SnapshotWriter:
+    """Write workflow metadata as one UTF-8 blob plus an offsets table per column.
+
+    The ID_COLUMN also gets an id index: its rows sorted by the hash of their
+    value, so a row is found with a binary search over memory-mapped arrays.
+    """
+
+    def __init__(self, path=SNAPSHOT_DIR, columns=COLUMNS):
+        self.path = path
+        self.columns = list(columns)
+        self.tmp_path = path + '.tmp'
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self.files = {c: open(os.path.join(self.tmp_path, f'{c}.bin'), 'wb') for c in self.columns}
+        self.offsets = {c: [np.zeros(1, dtype='int64')] for c in self.columns}
+        self.position = {c: 0 for c in self.columns}
+        self.id_file = open(os.path.join(self.tmp_path, 'id_hashes.tmp'), 'wb') if ID_COLUMN in self.columns else None
+        self.count = 0
+
+    def append(self, chunk):
+        """Append a DataFrame chunk holding (at least) the snapshot columns"""
+        for column in self.columns:
+            encoded = [v.encode('utf-8') for v in chunk[column].fillna('').astype(str)]
+            lengths = np.fromiter((len(v) for v in encoded), dtype='int64', count=len(encoded))
+            self.files[column].write(b''.join(encoded))
+            self.offsets[column].append(self.position[column] + np.cumsum(lengths))
+            self.position[column] += int(lengths.sum())
+        if self.id_file is not None:
+            self.id_file.write(id_hashes(chunk[ID_COLUMN].fillna('').astype(str)).tobytes())
+        self.count += len(chunk)
+
+    def close(self):
+        """Finish the snapshot and move it into place"""
+        for column in self.columns:
+            self.files[column].close()
+            np.save(os.path.join(self.tmp_path, f'{column}.offsets.npy'), np.concatenate(self.offsets[column]))
+        if self.id_file is not None:
+            self.id_file.close()
+            hashes = np.fromfile(self.id_file.name, dtype='<u8')
+            # Stable, so a repeated id finds its first row
+            order = np.argsort(hashes, kind='stable')
+            np.save(os.path.join(self.tmp_path, f'{ID_COLUMN}.hashes.npy'), hashes[order])
+            np.save(os.path.join(self.tmp_path, f'{ID_COLUMN}.rows.npy'), order)
+            del hashes, order
+            os.remove(self.id_file.name)
+        with open(os.path.join(self.tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'count': self.count, 'columns': self.columns}, f, indent=2)
+
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(self.tmp_path, self.path)
+
+class MetadataSnapshot:
+    """Memory-mapped reader for a snapshot written by SnapshotWriter"""
+
+    def __init__(self, path=SNAPSHOT_DIR, blobs=None):
+        self.blobs = blobs
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.count = meta['count']
+        self.columns = meta['columns']
+        self.data = {}
+        self.offsets = {}
+        for column in self.columns:
+            bin_path = os.path.join(path, f'{column}.bin')
+            # np.memmap refuses empty files
+            if os.path.getsize(bin_path):
+                self.data[column] = np.memmap(bin_path, dtype='uint8', mode='r')
+            else:
+                self.data[column] = np.zeros(0, dtype='uint8')
+            self.offsets[column] = np.load(os.path.join(path, f'{column}.offsets.npy'), mmap_mode='r')
+        self.id_index = None
+        if os.path.exists(os.path.join(path, f'{ID_COLUMN}.hashes.npy')):
+            self.id_index = (np.load(os.path.join(path, f'{ID_COLUMN}.hashes.npy'), mmap_mode='r'),
+                             np.load(os.path.join(path, f'{ID_COLUMN}.rows.npy'), mmap_mode='r'))
+        self.ids = None
+
+    def __len__(self):
+        return self.count
+
+    def get(self, column, row):
+        """Return a single value as a string"""
+        offsets = self.offsets[column]
+        return self.data[column][offsets[row]:offsets[row + 1]].tobytes().decode('utf-8')
+
+    def find_id(self, workflow_id):
+        """Row of a workflow_id, or None; a binary search over the memory-mapped id index"""
+        if self.id_index is None:
+            # Snapshots written before the id index existed
+            if self.ids is None:
+                self.ids = {self.get(ID_COLUMN, i): i for i in range(self.count)}
+            return self.ids.get(workflow_id)
+        hashes, rows = self.id_index
+        key = id_hashes([workflow_id])[0]
+        start, stop = np.searchsorted(hashes, key, 'left'), np.searchsorted(hashes, key, 'right')
+        # Distinct ids can share a 64-bit hash, so candidates are compared with the stored value
+        for row in rows[start:stop]:
+            if self.get(ID_COLUMN, int(row)) == workflow_id:
+                return int(row)
+        return None
+
+    def get_json(self, row, limit=None):
+        """Decompress and return a row's workflow_json (with limit, only its first limit bytes)"""
+        if self.blobs is None:
+            raise FileNotFoundError("workflow_json blob store not found, please run build_index.py")
+        if limit is not None:
+            return self.blobs.read(row, limit)
+        return self.blobs.get(row)
+
+    def json_stream(self, row):
+        if self.blobs is None:
+            raise FileNotFoundError("workflow_json blob store not found, please run build_index.py")
+        return self.blobs.stream(row)
+
+    def json_size(self, row):
+        return self.blobs.size(row) if self.blobs is not None else 0
+
+    def json_handle(self, row):
+        return WorkflowJSON(self, row)
+
+    def row(self, row):
+        """Return all columns of a row as a dict"""
+        return {column: self.get(column, row) for column in self.columns}
+
+    def head(self, n=5):
+        """Return the first n rows as a DataFrame"""
+        return pd.DataFrame([self.row(i) for i in range(min(n, self.count))], columns=self.columns)
+
+class CSVMetadata:
+    """Same interface as MetadataSnapshot, backed by a parsed CSV"""
+
+    def __init__(self, df):
+        if 'workflow_json' in df.columns:
+            # Blank cells are read as NaN; the blob store holds them as ''
+            df['workflow_json'] = df['workflow_json'].fillna('').astype(str)
+        self.df = df
+        self.columns = [c for c in COLUMNS if c in df.columns]
+        self.ids = None
+
+    def __len__(self):
+        return len(self.df)
+
+    def get(self, column, row):
+        return self.df.iloc[row][column]
+
+    def find_id(self, workflow_id):
+        # The whole CSV is in memory already
+        if self.ids is None:
+            ids = self.df[ID_COLUMN].astype(str)
+            self.ids = dict(zip(ids[::-1], range(len(ids) - 1, -1, -1)))
+        return self.ids.get(workflow_id)
+
+    def get_json(self, row, limit=None):
+        value = self.df.iloc[row]['workflow_json']
+        if limit is not None:
+            return value.encode('utf-8')[:limit].decode('utf-8', errors='ignore')
+        return value
+
+    def json_stream(self, row):
+        yield self.get_json(row).encode('utf-8')
+
+    def json_size(self, row):
+        return len(self.get_json(row).encode('utf-8'))
+
+    def json_handle(self, row):
+        return WorkflowJSON(self, row)
+
+    def row(self, row):
+        record = self.df.iloc[row]
+        return {column: record[column] for column in self.columns}
+
+    def head(self, n=5):
+        return self.df.head(n)
+
+def load_metadata(csv_path, path=SNAPSHOT_DIR, expected_count=None, blob_path=BLOB_STORE_DIR):
+    """Load the binary snapshot if it is present and current, otherwise parse the CSV"""
+    if os.path.exists(os.path.join(path, 'meta.json')):
+        blobs = load_blob_store(blob_path)
+        snapshot = MetadataSnapshot(path, blobs=blobs)
+        if blobs is not None and len(blobs) != len(snapshot):
+            print(f"Blob store has {len(blobs)} rows but snapshot has {len(snapshot)}, falling back to CSV")
+        elif expected_count is None or len(snapshot) == expected_count:
+            return snapshot
+        else:
+            print(f"Metadata snapshot has {len(snapshot)} rows but index has {expected_count}, falling back to CSV")
+    return CSVMetadata(pd.read_csv(csv_path))
@@ -0,0 +1,319 @@
+import numpy as np
+import heapq
+import json
+import os
+import shutil
+from duplicates import normalize_text
+from runs import PostingRuns
+
+# Paths
+TYPEAHEAD_DIR = '../embeddings/typeahead'
+
+# Completions returned by default
+SUGGEST_N = 10
+
+# Prefixes matching more than SCAN_LIMIT names get their top MAX_SUGGEST
+# completions precomputed at build time, so no request scans a large range
+MAX_SUGGEST = 20
+SCAN_LIMIT = 2048
+
+# Candidates checked per step of a substring match
+INFIX_BLOCK = 512
+
+# Names handled per step while the index is written
+MERGE_BLOCK = 8192
+
+def trigram_codes(key):
+    """Distinct character trigrams of a normalized name, packed into int64 (21 bits per code point)"""
+    return {(ord(key[i]) << 42) | (ord(key[i + 1]) << 21) | ord(key[i + 2]) for i in range(len(key) - 2)}
+
+class StringWriter:
+    """One UTF-8 blob plus an offsets table, as in the metadata snapshot, written incrementally"""
+
+    def __init__(self, directory, name):
+        self.directory, self.name = directory, name
+        self.file = open(os.path.join(directory, f'{name}.bin'), 'wb')
+        self.offsets = [np.zeros(1, dtype='int64')]
+        self.position = 0
+
+    def append(self, encoded):
+        lengths = np.fromiter((len(b) for b in encoded), dtype='int64', count=len(encoded))
+        self.file.write(b''.join(encoded))
+        self.offsets.append(self.position + np.cumsum(lengths))
+        self.position += int(lengths.sum())
+
+    def close(self):
+        self.file.close()
+        np.save(os.path.join(self.directory, f'{self.name}.offsets.npy'), np.concatenate(self.offsets))
+
+class StringTable:
+    """Memory-mapped reader for StringWriter output"""
+
+    def __init__(self, directory, name):
+        path = os.path.join(directory, f'{name}.bin')
+        self.data = np.memmap(path, dtype='uint8', mode='r') if os.path.getsize(path) else np.zeros(0, 'uint8')
+        self.offsets = np.load(os.path.join(directory, f'{name}.offsets.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def bytes(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].tobytes()
+
+    def get(self, i):
+        return self.bytes(i).decode('utf-8')
+
+def lower_bound(table, encoded, lo, hi):
+    """First position in [lo, hi) of a byte-sorted StringTable whose string is >= encoded"""
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if table.bytes(mid) < encoded:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+class TypeaheadWriter:
+    """Distinct workflow names with their row counts, a prefix table and trigram postings.
+
+    Names are deduplicated by normalize_text and numbered by popularity (id 0
+    is the most frequent name), so any sorted id list is already ranked.
+    first_rows maps every row to the first row with the same normalized name
+    (see duplicates.FirstRows); that row's spelling is the one suggested.
+    Each chunk's new names are written as a sorted run and close() merges the
+    runs, so names are never all held in memory.
+    """
+
+    def __init__(self, first_rows, path=TYPEAHEAD_DIR):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(os.path.join(self.tmp_path, 'runs'))
+        self.first_rows = first_rows
+        # Rows per first row, on disk like the rest of the build
+        self.row_counts = np.lib.format.open_memmap(os.path.join(self.tmp_path, 'row_counts.tmp.npy'), mode='w+',
+                                                    dtype='int32', shape=(len(first_rows),))
+        self.runs = 0
+        self.count = 0
+
+    def append(self, names):
+        rows = np.arange(self.count, self.count + len(names))
+        first = np.asarray(self.first_rows[self.count:self.count + len(names)])
+        firsts, counts = np.unique(first, return_counts=True)
+        self.row_counts[firsts] += counts.astype('int32')
+        run = []
+        for i in np.flatnonzero(first == rows):
+            key = normalize_text(names[i])
+            if key:
+                run.append((key.encode('utf-8'), ' '.join(str(names[i]).split()).encode('utf-8'), int(rows[i])))
+        # Byte order of UTF-8 is code point order, so runs and lookups compare raw bytes
+        run.sort()
+        directory = os.path.join(self.tmp_path, 'runs')
+        for column, name in ((0, f'{self.runs:05d}.keys'), (1, f'{self.runs:05d}.names')):
+            writer = StringWriter(directory, name)
+            writer.append([entry[column] for entry in run])
+            writer.close()
+        np.save(os.path.join(directory, f'{self.runs:05d}.rows.npy'), np.array([entry[2] for entry in run], dtype='int32'))
+        self.runs += 1
+        self.count += len(names)
+
+    def merged(self):
+        """(key, name, first row) of every distinct name in key order"""
+        directory = os.path.join(self.tmp_path, 'runs')
+
+        def read(run):
+            keys = StringTable(directory, f'{run:05d}.keys')
+            names = StringTable(directory, f'{run:05d}.names')
+            rows = np.load(os.path.join(directory, f'{run:05d}.rows.npy'))
+            for i in range(len(keys)):
+                yield keys.bytes(i), names.bytes(i), int(rows[i])
+        # Every key comes from exactly one run: only its first row starts a name
+        return heapq.merge(*(read(run) for run in range(self.runs)))
+
+    def close(self):
+        tmp_path = self.tmp_path
+        # Names in key order; a block at a time so only the rows array grows with the name count
+        sorted_keys, sorted_names = StringWriter(tmp_path, 'sorted_keys'), StringWriter(tmp_path, 'sorted_names')
+        rows, block = [], []
+        for entry in self.merged():
+            block.append(entry)
+            if len(block) == MERGE_BLOCK:
+                sorted_keys.append([key for key, _, _ in block])
+                sorted_names.append([name for _, name, _ in block])
+                rows.append(np.array([row for _, _, row in block], dtype='int32'))
+                block = []
+        sorted_keys.append([key for key, _, _ in block])
+        sorted_names.append([name for _, name, _ in block])
+        rows.append(np.array([row for _, _, row in block], dtype='int32'))
+        sorted_keys.close()
+        sorted_names.close()
+        shutil.rmtree(os.path.join(tmp_path, 'runs'))
+        counts = np.asarray(self.row_counts[np.concatenate(rows)])
+        num_names = len(counts)
+
+        # Ids by popularity, ties in key order; prefix_order lists the ids in key order
+        by_rank = np.lexsort((np.arange(num_names), -counts.astype('int64')))
+        prefix_order = np.empty(num_names, dtype='int32')
+        prefix_order[by_rank] = np.arange(num_names, dtype='int32')
+        np.save(os.path.join(tmp_path, 'prefix_order.npy'), prefix_order)
+        np.save(os.path.join(tmp_path, 'counts.npy'), counts[by_rank].astype('int32'))
+        sorted_keys, sorted_names = StringTable(tmp_path, 'sorted_keys'), StringTable(tmp_path, 'sorted_names')
+        keys, names = StringWriter(tmp_path, 'keys'), StringWriter(tmp_path, 'names')
+        for start in range(0, num_names, MERGE_BLOCK):
+            ranks = by_rank[start:start + MERGE_BLOCK]
+            keys.append([sorted_keys.bytes(r) for r in ranks])
+            names.append([sorted_names.bytes(r) for r in ranks])
+        keys.close()
+        names.close()
+
+        # Top completions of every prefix too common to rank per request; a prefix's
+        # names are one range of the key order, split by the next character
+        hot, hot_ids = [], []
+        ranges = [('', 0, num_names)]
+        while ranges:
+            parent, lo, hi = ranges.pop()
+            length = len(parent) + 1
+            while lo < hi:
+                key = sorted_keys.get(lo)
+                if len(key) < length:
+                    # The parent prefix itself
+                    lo += 1
+                    continue
+                prefix = key[:length]
+                # 0xff never occurs in UTF-8, so this is the end of the prefix range
+                end = lower_bound(sorted_keys, prefix.encode('utf-8') + b'\xff', lo, hi)
+                if end - lo > SCAN_LIMIT:
+                    hot.append(prefix)
+                    hot_ids.append(np.sort(np.partition(prefix_order[lo:end], MAX_SUGGEST)[:MAX_SUGGEST]))
+                    ranges.append((prefix, lo, end))
+                lo = end
+        np.save(os.path.join(tmp_path, 'hot_ids.npy'), np.array(hot_ids, dtype='int32').reshape(-1, MAX_SUGGEST))
+        del sorted_keys, sorted_names
+        for name in ('sorted_keys', 'sorted_names'):
+            os.remove(os.path.join(tmp_path, f'{name}.bin'))
+            os.remove(os.path.join(tmp_path, f'{name}.offsets.npy'))
+
+        # Trigram postings, appended in id order so every list comes out sorted
+        keys = StringTable(tmp_path, 'keys')
+        postings = PostingRuns(os.path.join(tmp_path, 'trigram_runs'))
+        trigram_ids = {}
+        for start in range(0, num_names, MERGE_BLOCK):
+            codes, ids = [], []
+            for i in range(start, min(start + MERGE_BLOCK, num_names)):
+                for code in trigram_codes(keys.get(i)):
+                    codes.append(trigram_ids.setdefault(code, len(trigram_ids)))
+                    ids.append(i)
+            postings.append(codes, np.array(ids, dtype='int32'))
+        codes = np.fromiter(trigram_ids, dtype='int64', count=len(trigram_ids))
+        order = np.argsort(codes)
+        code_rank = np.empty(len(codes), dtype='int64')
+        code_rank[order] = np.arange(len(codes))
+        offsets = postings.merge(len(codes), [(os.path.join(tmp_path, 'trigram.ids.npy'), 'int32')], key_map=code_rank)
+        np.save(os.path.join(tmp_path, 'trigrams.npy'), codes[order])
+        np.save(os.path.join(tmp_path, 'trigram.offsets.npy'), offsets)
+        del keys
+
+        meta = {'count': self.count, 'names': num_names, 'trigrams': len(codes), 'hot': hot}
+        with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        del self.row_counts
+        self.first_rows = None
+        os.remove(os.path.join(tmp_path, 'row_counts.tmp.npy'))
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(tmp_path, self.path)
+        return meta
+
+class Typeahead:
+    """Memory-mapped workflow-name completions; needs no model or search index"""
+
+    def __init__(self, path=TYPEAHEAD_DIR):
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.count = meta['count']
+        self.hot = {prefix: i for i, prefix in enumerate(meta['hot'])}
+        self.names = StringTable(path, 'names')
+        self.keys = StringTable(path, 'keys')
+        self.counts = np.load(os.path.join(path, 'counts.npy'), mmap_mode='r')
+        self.prefix_order = np.load(os.path.join(path, 'prefix_order.npy'), mmap_mode='r')
+        self.hot_ids = np.load(os.path.join(path, 'hot_ids.npy'), mmap_mode='r')
+        self.trigrams = np.load(os.path.join(path, 'trigrams.npy'), mmap_mode='r')
+        self.trigram_offsets = np.load(os.path.join(path, 'trigram.offsets.npy'), mmap_mode='r')
+        self.trigram_ids = np.load(os.path.join(path, 'trigram.ids.npy'), mmap_mode='r')
+
+    def __len__(self):
+        """Rows the names were collected from (not the number of distinct names)"""
+        return self.count
+
+    def suggest(self, prefix, n=SUGGEST_N):
+        """Top-n workflow names completing prefix, most frequent first.
+
+        Names starting with the prefix come first, then names containing it
+        (found through trigram postings). Returns dicts with 'workflow_name'
+        and 'count', the number of workflows with that name.
+        """
+        query = normalize_text(prefix)
+        if not query:
+            return []
+        if prefix[-1:].isspace():
+            # "gmail " completes the word after gmail, not gmailApi
+            query += ' '
+        ids = self.prefix_ids(query, n)
+        if len(ids) < n and len(query) >= 3:
+            ids += self.infix_ids(query, n - len(ids), set(ids))
+        return [{'workflow_name': self.names.get(i), 'count': int(self.counts[i])} for i in ids]
+
+    def prefix_ids(self, query, n):
+        """Most popular names starting with query"""
+        if query in self.hot and n <= MAX_SUGGEST:
+            ids = self.hot_ids[self.hot[query]]
+            return [int(i) for i in ids[ids >= 0][:n]]
+        encoded = query.encode('utf-8')
+        start = self.lower_bound(encoded)
+        # 0xff never occurs in UTF-8, so this is the end of the prefix range
+        stop = self.lower_bound(encoded + b'\xff', start)
+        ids = np.asarray(self.prefix_order[start:stop])
+        if len(ids) > n:
+            ids = np.partition(ids, n)[:n]
+        return sorted(int(i) for i in ids)
+
+    def lower_bound(self, encoded, lo=0):
+        """First position in prefix order whose key is >= encoded"""
+        hi = len(self.prefix_order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.keys.bytes(self.prefix_order[mid]) < encoded:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def infix_ids(self, query, n, exclude):
+        """Most popular names containing query: intersect its trigram postings, then check the text"""
+        postings = []
+        for code in trigram_codes(query):
+            i = int(np.searchsorted(self.trigrams, code))
+            if i == len(self.trigrams) or self.trigrams[i] != code:
+                return []
+            postings.append(self.trigram_ids[self.trigram_offsets[i]:self.trigram_offsets[i + 1]])
+        postings.sort(key=len)
+        ids = []
+        # Postings are in popularity order, so the shortest one is walked a block
+        # at a time and the search stops at the first n true matches
+        for start in range(0, len(postings[0]), INFIX_BLOCK):
+            candidates = np.asarray(postings[0][start:start + INFIX_BLOCK])
+            for posting in postings[1:]:
+                positions = np.minimum(np.searchsorted(posting, candidates), len(posting) - 1)
+                candidates = candidates[np.asarray(posting[positions]) == candidates]
+            for i in candidates:
+                if int(i) not in exclude and query in self.keys.get(i):
+                    ids.append(int(i))
+                    if len(ids) == n:
+                        return ids
+        return ids
+
+def load_typeahead(path=TYPEAHEAD_DIR):
+    """Return the typeahead index at path, or None if it has not been built"""
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        return None
+    return Typeahead(path)
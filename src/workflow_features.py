@@ -0,0 +1,278 @@
+import numpy as np
+import json
+import os
+import re
+import shutil
+from runs import PostingRuns
+
+# Paths
+FEATURES_DIR = '../embeddings/features'
+
+# n8n node types look like "n8n-nodes-base.googleSheets" or "@n8n/n8n-nodes-langchain.openAi"
+CAMEL_BOUNDARY = re.compile(r'(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])')
+
+def split_identifier(identifier):
+    """'n8n-nodes-base.googleSheets' -> 'google sheets', 'slackApi' -> 'slack api'"""
+    short = identifier.rsplit('.', 1)[-1]
+    return CAMEL_BOUNDARY.sub(' ', short).lower()
+
+def parse_workflow(workflow_json):
+    """Extract node types, credentials and trigger from an n8n workflow export.
+
+    Returns a dict with 'node_types' (list, one entry per node), 'credentials'
+    (list of credential type keys) and 'trigger' (type of the first trigger
+    node, or None). Unparseable payloads give empty features.
+    """
+    features = {'node_types': [], 'credentials': [], 'trigger': None}
+    try:
+        workflow = json.loads(workflow_json) if isinstance(workflow_json, str) else workflow_json
+    except ValueError:
+        return features
+    if not isinstance(workflow, dict):
+        return features
+
+    nodes = workflow.get('nodes') or []
+    for node in nodes if isinstance(nodes, list) else []:
+        if not isinstance(node, dict):
+            continue
+        node_type = str(node.get('type') or '')
+        if node_type:
+            features['node_types'].append(node_type)
+            if features['trigger'] is None and is_trigger(node_type):
+                features['trigger'] = node_type
+        credentials = node.get('credentials')
+        if isinstance(credentials, dict):
+            features['credentials'].extend(str(c) for c in credentials)
+    return features
+
+def is_trigger(node_type):
+    short = node_type.rsplit('.', 1)[-1].lower()
+    return short.endswith('trigger') or short in ('webhook', 'cron', 'start', 'manualtrigger')
+
+# Core nodes that are not integrations with an outside service
+GENERIC_NODES = {
+    'set', 'if', 'switch', 'merge', 'code', 'function', 'function item', 'no op', 'start', 'manual',
+    'schedule', 'cron', 'interval', 'wait', 'split in batches', 'item lists', 'sticky note', 'filter',
+    'execute workflow', 'respond to webhook', 'webhook', 'html', 'xml', 'date time', 'move binary data',
+    'http request', 'sort', 'limit', 'aggregate', 'split out', 'remove duplicates', 'summarize',
+}
+
+def node_key(node_type):
+    """Normalized node type used for filtering: 'n8n-nodes-base.httpRequest' -> 'http request'"""
+    return split_identifier(node_type)
+
+def integration_keys(features):
+    """Services a workflow talks to, from its node and credential types"""
+    keys = set()
+    for node_type in features['node_types']:
+        key = node_key(node_type)
+        if key.endswith(' trigger'):
+            key = key[:-len(' trigger')]
+        if key not in GENERIC_NODES:
+            keys.add(key)
+    for credential in features['credentials']:
+        key = split_identifier(credential)
+        for suffix in (' o auth2 api', ' oauth2 api', ' api'):
+            if key.endswith(suffix):
+                key = key[:-len(suffix)]
+                break
+        if key:
+            keys.add(key)
+    return keys
+
+class FeatureStoreWriter:
+    """Per-workflow features: node_count and trigger as integer columns, node types
+    and integrations as sorted row-id posting lists, plus each row's node types
+    (in workflow order) for result summaries.
+
+    Posting lists and per-row node types are spilled to disk per chunk, so
+    only the small vocabularies and the integer columns stay in memory.
+    """
+
+    def __init__(self, path=FEATURES_DIR):
+        self.path = path
+        self.tmp_path = path + '.tmp'
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self.node_counts = []
+        self.triggers = []
+        self.vocab = {'node_types': {}, 'integrations': {}, 'triggers': {}}
+        self.postings = {name: PostingRuns(os.path.join(self.tmp_path, f'{name}.runs'))
+                         for name in ('node_types', 'integrations')}
+        self.row_counts = []
+        self.row_node_types = open(os.path.join(self.tmp_path, 'row_node_types.ids.bin'), 'wb')
+        self.count = 0
+
+    def append(self, features_list):
+        node_counts = np.zeros(len(features_list), dtype='int32')
+        triggers = np.full(len(features_list), -1, dtype='int16')
+        pairs = {'node_types': [], 'integrations': []}
+        row_node_types = np.zeros(len(features_list), dtype='int64')
+        for i, features in enumerate(features_list):
+            row = self.count + i
+            node_counts[i] = len(features['node_types'])
+            if features['trigger']:
+                triggers[i] = self.vocab['triggers'].setdefault(node_key(features['trigger']), len(self.vocab['triggers']))
+            keys = dict.fromkeys(node_key(t) for t in features['node_types'])
+            for key in keys:
+                pairs['node_types'].append((self.vocab['node_types'].setdefault(key, len(self.vocab['node_types'])), row))
+            row_node_types[i] = len(keys)
+            for key in integration_keys(features):
+                pairs['integrations'].append((self.vocab['integrations'].setdefault(key, len(self.vocab['integrations'])), row))
+        for name, values in pairs.items():
+            values = np.array(values, dtype='int32').reshape(-1, 2)
+            self.postings[name].append(values[:, 0], values[:, 1])
+            if name == 'node_types':
+                # The node_types pairs are already in row and workflow order
+                self.row_node_types.write(values[:, 0].tobytes())
+        self.row_counts.append(row_node_types)
+        self.node_counts.append(node_counts)
+        self.triggers.append(triggers)
+        self.count += len(features_list)
+
+    def close(self):
+        tmp_path = self.tmp_path
+        np.save(os.path.join(tmp_path, 'node_count.npy'), np.concatenate(self.node_counts or [np.zeros(0, 'int32')]))
+        np.save(os.path.join(tmp_path, 'trigger.npy'), np.concatenate(self.triggers or [np.zeros(0, 'int16')]))
+        for name in ('node_types', 'integrations'):
+            offsets = self.postings[name].merge(len(self.vocab[name]),
+                                                [(os.path.join(tmp_path, f'{name}.rows.npy'), 'int32')])
+            np.save(os.path.join(tmp_path, f'{name}.offsets.npy'), offsets)
+        row_counts = np.concatenate(self.row_counts or [np.zeros(0, 'int64')])
+        offsets = np.zeros(self.count + 1, dtype='int64')
+        np.cumsum(row_counts, out=offsets[1:])
+        np.save(os.path.join(tmp_path, 'row_node_types.offsets.npy'), offsets)
+        # Copy the spilled ids into a .npy through memory maps rather than reading them in
+        self.row_node_types.close()
+        ids_path = os.path.join(tmp_path, 'row_node_types.ids.bin')
+        ids = np.lib.format.open_memmap(os.path.join(tmp_path, 'row_node_types.ids.npy'), mode='w+',
+                                        dtype='int32', shape=(int(offsets[-1]),))
+        if len(ids):
+            ids[:] = np.memmap(ids_path, dtype='int32', mode='r')
+        ids.flush()
+        del ids
+        os.remove(ids_path)
+        meta = {'count': self.count}
+        for name, vocab in self.vocab.items():
+            meta[name] = sorted(vocab, key=vocab.get)
+        with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2, ensure_ascii=False)
+
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(tmp_path, self.path)
+        return meta
+
+class FeatureStore:
+    """Memory-mapped reader for FeatureStoreWriter output that turns filters into row masks.
+
+    Filters are a dict with any of:
+        node_types:   node types every result must use, e.g. ['HTTP Request', 'Gmail']
+        integrations: services every result must use, e.g. ['slack']
+        trigger:      trigger node type, e.g. 'schedule trigger'
+        min_nodes / max_nodes: bounds on the node count
+    """
+
+    def __init__(self, path=FEATURES_DIR):
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        self.count = meta['count']
+        self.vocab = {name: {key: i for i, key in enumerate(meta[name])}
+                      for name in ('node_types', 'integrations', 'triggers')}
+        self.node_count = np.load(os.path.join(path, 'node_count.npy'), mmap_mode='r')
+        self.trigger = np.load(os.path.join(path, 'trigger.npy'), mmap_mode='r')
+        self.offsets = {}
+        self.rows = {}
+        for name in ('node_types', 'integrations'):
+            self.offsets[name] = np.load(os.path.join(path, f'{name}.offsets.npy'), mmap_mode='r')
+            self.rows[name] = np.load(os.path.join(path, f'{name}.rows.npy'), mmap_mode='r')
+        self.names = {name: meta[name] for name in ('node_types', 'triggers')}
+        # Per-row node types; absent in feature stores built before result summaries
+        self.row_offsets = self.row_node_types = None
+        if os.path.exists(os.path.join(path, 'row_node_types.ids.npy')):
+            self.row_offsets = np.load(os.path.join(path, 'row_node_types.offsets.npy'), mmap_mode='r')
+            self.row_node_types = np.load(os.path.join(path, 'row_node_types.ids.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return self.count
+
+    def vocab_names(self, name):
+        """Known values of a feature ('node_types', 'integrations' or 'triggers'), sorted"""
+        return sorted(self.vocab[name])
+
+    def summary(self, row):
+        """Compact description of a workflow: node count, distinct node types (None if not stored) and trigger"""
+        trigger = int(self.trigger[row])
+        node_types = None
+        if self.row_node_types is not None:
+            ids = self.row_node_types[self.row_offsets[row]:self.row_offsets[row + 1]]
+            node_types = [self.names['node_types'][i] for i in ids]
+        return {'node_count': int(self.node_count[row]), 'node_types': node_types,
+                'trigger': self.names['triggers'][trigger] if trigger >= 0 else None}
+
+    def posting(self, name, key):
+        """Sorted rows having a node type / integration (empty if unknown)"""
+        term = self.vocab[name].get(normalize_filter_value(key))
+        if term is None:
+            return np.zeros(0, dtype='int32')
+        return np.asarray(self.rows[name][self.offsets[name][term]:self.offsets[name][term + 1]])
+
+    def mask(self, filters):
+        """Boolean row mask for a filter dict.
+
+        Posting lists are intersected shortest first and the trigger and node
+        count predicates only read the rows that survive, so only the final
+        mask is N-sized.
+        """
+        postings = sorted((self.posting(name, key) for name in ('node_types', 'integrations')
+                           for key in filters.get(name) or []), key=len)
+        rows = None
+        for posting in postings:
+            rows = posting if rows is None else np.intersect1d(rows, posting, assume_unique=True)
+
+        predicates = []
+        if filters.get('trigger'):
+            trigger = self.vocab['triggers'].get(normalize_filter_value(filters['trigger']), -2)
+            predicates.append((self.trigger, lambda values: values == trigger))
+        if filters.get('min_nodes') is not None:
+            min_nodes = int(filters['min_nodes'])
+            predicates.append((self.node_count, lambda values: values >= min_nodes))
+        if filters.get('max_nodes') is not None:
+            max_nodes = int(filters['max_nodes'])
+            predicates.append((self.node_count, lambda values: values <= max_nodes))
+
+        if rows is None:
+            # Column filters only: one pass over each column
+            mask = np.ones(self.count, dtype=bool)
+            for column, test in predicates:
+                mask &= test(np.asarray(column))
+            return mask
+        for column, test in predicates:
+            rows = rows[test(np.asarray(column[rows]))]
+        mask = np.zeros(self.count, dtype=bool)
+        mask[rows] = True
+        return mask
+
+def normalize_filter_value(value):
+    """'HTTP Request', 'httpRequest' and 'n8n-nodes-base.httpRequest' all become 'http request'"""
+    value = str(value).strip()
+    if ' ' in value:
+        return ' '.join(value.lower().split())
+    return node_key(value)
+
+def parse_filters(filters):
+    """Drop empty entries; returns None when nothing is filtered"""
+    filters = {key: value for key, value in (filters or {}).items() if value not in (None, '', [], ())}
+    return filters or None
+
+def filter_key(filters):
+    """Hashable cache key for a filter dict"""
+    if not filters:
+        return None
+    return tuple(sorted((key, tuple(value) if isinstance(value, (list, tuple)) else value)
+                        for key, value in filters.items()))
+
+def load_feature_store(path=FEATURES_DIR):
+    """Return the feature store at path, or None if it has not been built"""
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        return None
+    return FeatureStore(path)